@@ -0,0 +1,188 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import data_tools
+from data_tools import get_poll_data, list_poll_snapshots
+from script import X_COLUMNS
+
+
+# The poll archive is a directory holding one raw binary file per column, which is only ever appended to so that each
+# column stays contiguous, and an index file recording the number of rows, the state names and the first row of each
+# snapshot date. The index is replaced after the columns are written, so an interrupted append is never seen.
+POLL_ARCHIVE_DIRECTORY = ".poll_archive"
+ARCHIVE_INDEX_FILE = "index.json"
+ARCHIVE_COLUMNS = {
+    "dates": (np.dtype("<M8[D]"), ()),
+    "states": (np.dtype("<u2"), ()),
+    "shares": (np.dtype("<f8"), (len(X_COLUMNS),))
+}
+STATE_COLUMN = "State Alpha"
+
+
+def archive_day(date):
+    """
+    This function converts a snapshot date to the day used by the poll archive.
+    :param date: A string in the format of the poll file names, e.g. "17-Mar-24", or an ISO date string, e.g.
+    "2024-03-17", or anything else accepted by pd.Timestamp.
+    :return: A numpy datetime64 of the day.
+    """
+    is_snapshot_format = isinstance(date, str) and not date[:4].isdigit()
+    timestamp = pd.to_datetime(date, format="%d-%b-%y") if is_snapshot_format else pd.Timestamp(date)
+    return np.datetime64(timestamp.date(), "D")
+
+
+def _read_archive_index(archive_path):
+    """
+    This function reads the index of a poll archive, or returns the index of an empty archive if there is none.
+    :return: A dictionary containing the share columns, the number of rows, the state names, the snapshot dates as ISO
+    strings and the first row of each snapshot date followed by the number of rows.
+    """
+    try:
+        with open(os.path.join(archive_path, ARCHIVE_INDEX_FILE), 'r') as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {"columns": X_COLUMNS, "n_rows": 0, "states": [], "snapshot_dates": [], "offsets": [0]}
+
+
+def open_archive(archive_path=None):
+    """
+    This function memory-maps a poll archive, so that nothing is read from the column files until it is used.
+    :param archive_path: An optional path of the archive directory. By default it is in the data directory.
+    :return: A dictionary containing the path, the state names as a numpy array, the snapshot dates as a numpy array of
+    datetime64 days (m,), the first row of each snapshot date followed by the number of rows (m+1,), and the
+    memory-mapped dates (n,), state codes (n,) and poll shares (n,3) of every row.
+    """
+    archive_path = data_tools.DATA_ROOT / POLL_ARCHIVE_DIRECTORY if archive_path is None else archive_path
+    index = _read_archive_index(archive_path)
+    if index["columns"] != X_COLUMNS:
+        raise ValueError(f"The poll archive has the columns {index['columns']} rather than {X_COLUMNS}.")
+    n_rows = index["n_rows"]
+    archive = {
+        "path": archive_path,
+        "state_names": np.array(index["states"], dtype=object),
+        "snapshot_dates": np.array(index["snapshot_dates"], dtype="M8[D]"),
+        "offsets": np.array(index["offsets"], dtype=np.int64)
+    }
+    for column, (dtype, shape) in ARCHIVE_COLUMNS.items():
+        # A memory map cannot be empty, so an empty archive has empty arrays instead
+        archive[column] = np.memmap(os.path.join(archive_path, f"{column}.bin"), dtype, "r", shape=(n_rows,) + shape) \
+            if n_rows > 0 else np.empty((0,) + shape, dtype)
+    return archive
+
+
+def append_snapshot(archive_path, snapshot_date, polls_data):
+    """
+    This function appends a snapshot of polling data to a poll archive, creating the archive if it does not exist.
+    Snapshots must be appended in chronological order.
+    :param archive_path: The path of the archive directory.
+    :param snapshot_date: The date of the snapshot, as accepted by archive_day.
+    :param polls_data: A pandas Dataframe of the polling data, indexed by State Alpha and containing the X columns.
+    :return: The number of rows in the archive after the snapshot was appended.
+    """
+    index = _read_archive_index(archive_path)
+    day = archive_day(snapshot_date)
+    if index["snapshot_dates"] and day <= np.datetime64(index["snapshot_dates"][-1], "D"):
+        raise ValueError(f"Snapshots must be appended after the last one in the archive: {index['snapshot_dates'][-1]}")
+    state_codes = {state: code for code, state in enumerate(index["states"])}
+    for state in polls_data.index:
+        state_codes.setdefault(state, len(state_codes))
+    if len(state_codes) > np.iinfo(ARCHIVE_COLUMNS["states"][0]).max + 1:
+        raise ValueError("There are too many states for the state codes of the poll archive.")
+    n_rows = index["n_rows"]
+    values = {
+        "dates": np.full(len(polls_data), day, dtype=ARCHIVE_COLUMNS["dates"][0]),
+        "states": np.array([state_codes[state] for state in polls_data.index], dtype=ARCHIVE_COLUMNS["states"][0]),
+        "shares": polls_data[X_COLUMNS].to_numpy(dtype=ARCHIVE_COLUMNS["shares"][0])
+    }
+    os.makedirs(archive_path, exist_ok=True)
+    for column, (dtype, shape) in ARCHIVE_COLUMNS.items():
+        column_path = os.path.join(archive_path, f"{column}.bin")
+        with open(column_path, 'r+b' if os.path.exists(column_path) else 'wb') as column_file:
+            # Any bytes beyond the indexed rows are from an interrupted append, and are overwritten
+            column_file.truncate(n_rows * dtype.itemsize * int(np.prod(shape)))
+            column_file.seek(0, os.SEEK_END)
+            column_file.write(np.ascontiguousarray(values[column]).tobytes())
+    index.update({
+        "n_rows": n_rows + len(polls_data),
+        "states": list(state_codes),
+        "snapshot_dates": index["snapshot_dates"] + [str(day)],
+        "offsets": index["offsets"] + [n_rows + len(polls_data)]
+    })
+    index_path = os.path.join(archive_path, ARCHIVE_INDEX_FILE)
+    with open(f"{index_path}.tmp", 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(f"{index_path}.tmp", index_path)
+    return index["n_rows"]
+
+
+def convert_poll_snapshots(archive_path=None, snapshot_dates=None):
+    """
+    This function converts the poll data csv files to a poll archive, appending the snapshots that are not yet in it.
+    :param archive_path: An optional path of the archive directory. By default it is in the data directory.
+    :param snapshot_dates: An optional list of strings of the snapshot dates, e.g. ["17-Mar-24"]. All of the snapshots
+    are converted by default.
+    :return: A list of the strings of the snapshot dates that were appended.
+    """
+    archive_path = data_tools.DATA_ROOT / POLL_ARCHIVE_DIRECTORY if archive_path is None else archive_path
+    snapshot_dates = list_poll_snapshots() if snapshot_dates is None else snapshot_dates
+    archived = set(_read_archive_index(archive_path)["snapshot_dates"])
+    appended = []
+    for date in sorted(snapshot_dates, key=archive_day):
+        if str(archive_day(date)) not in archived:
+            append_snapshot(archive_path, date, get_poll_data(date))
+            appended.append(date)
+    return appended
+
+
+def _row_selection(archive, rows):
+    """
+    This function selects the rows of an archive.
+    :return: A dictionary containing the dates, state codes and poll shares of the rows.
+    """
+    return {column: archive[column][rows] for column in ARCHIVE_COLUMNS}
+
+
+def load_date_range(archive, start=None, end=None):
+    """
+    This function selects the snapshots between two dates from the date index, without copying or reading any rows.
+    :param archive: A dictionary as returned by open_archive.
+    :param start: The first date to be included, as accepted by archive_day. By default the range starts with the first
+    snapshot.
+    :param end: The last date to be included, as accepted by archive_day. By default the range ends with the last
+    snapshot.
+    :return: A dictionary containing memory-mapped views of the dates (n,), state codes (n,) and poll shares (n,3) of
+    the rows in the range.
+    """
+    first = 0 if start is None else np.searchsorted(archive["snapshot_dates"], archive_day(start), "left")
+    last = len(archive["snapshot_dates"]) if end is None else \
+        np.searchsorted(archive["snapshot_dates"], archive_day(end), "right")
+    return _row_selection(archive, slice(archive["offsets"][first], archive["offsets"][max(first, last)]))
+
+
+def load_states(archive, states, start=None, end=None):
+    """
+    This function selects the rows of some states between two dates. The date range is a view, as in load_date_range,
+    and only the rows of the states within it are gathered.
+    :param archive: A dictionary as returned by open_archive.
+    :param states: A list of the State Alpha of the states, e.g. ["PA", "ME-AL"].
+    :param start: The first date to be included, as accepted by archive_day.
+    :param end: The last date to be included, as accepted by archive_day.
+    :return: A dictionary containing the dates (n,), state codes (n,) and poll shares (n,3) of the selected rows.
+    """
+    selection = load_date_range(archive, start, end)
+    codes = np.flatnonzero(np.isin(archive["state_names"], list(states)))
+    return _row_selection(selection, np.isin(selection["states"], codes))
+
+
+def archive_polls_data(archive, selection):
+    """
+    This function converts rows selected from a poll archive to polling data, as returned by stack_poll_snapshots.
+    :param archive: A dictionary as returned by open_archive.
+    :param selection: A dictionary of the rows, as returned by load_date_range or load_states.
+    :return: A pandas Dataframe of the polling data, with a "Snapshot date" column and indexed by State Alpha.
+    """
+    polls_data = pd.DataFrame(selection["shares"], columns=X_COLUMNS,
+                              index=pd.Index(archive["state_names"][selection["states"]], name=STATE_COLUMN))
+    polls_data["Snapshot date"] = selection["dates"].astype("M8[us]")
+    return polls_data
@@ -0,0 +1,294 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import data_tools
+from archive_tools import POLL_ARCHIVE_DIRECTORY, ARCHIVE_INDEX_FILE, open_archive
+from data_tools import load_data
+from forecast_tools import forecast_arrays, stack_poll_snapshots
+from math_tools import normalise_predictions, performance_metric, rmse
+from model_tools import polynomial_features, map_jobs
+from registry_tools import model_fingerprint
+from script import X_COLUMNS, Y_COLUMNS, classify_predictions, load_or_train_model
+from simulation_tools import PARTIES
+from synthetic_tools import synthetic_data
+from timing_tools import timed_stage
+
+
+YEAR_LEVEL = "Year"
+# The split of each cycle's training data is seeded, so that a backtest can be repeated and its models reused
+BACKTEST_TRAINING_OPTIONS = {"random_state": 20}
+_cycle_cache = {}
+
+
+def clear_backtest_cache():
+    """
+    This function empties the in-process cache of the models and predictions of each cycle.
+    """
+    _cycle_cache.clear()
+
+
+def cycle_years(df):
+    """
+    This function finds the election cycles in the training data.
+    :param df: The training data as a Pandas dataframe, indexed by State Alpha and Year.
+    :return: A sorted list of integers of the years of the cycles.
+    """
+    return sorted(int(year) for year in df.index.get_level_values(YEAR_LEVEL).unique())
+
+
+def score_cycle(predictions, actual_y, error_margin):
+    """
+    This function scores the predictions of a cycle against its results.
+    :param predictions: A numpy array of the normalised predictions of dimensions (n_rows, 3).
+    :param actual_y: A numpy array of the results of dimensions (n_rows, 3).
+    :param error_margin: The error margin of the model that made the predictions.
+    :return: A dictionary containing the performance metric, the RMSE of each party, and the call accuracy, i.e. the
+    fraction of rows in which the predicted winner is the actual winner.
+    """
+    predicted_winners, _, _ = classify_predictions(predictions, error_margin, output="codes")
+    actual_winners, _, _ = classify_predictions(actual_y, error_margin, output="codes")
+    return {
+        "performance": performance_metric(predictions, actual_y),
+        "rmse": rmse(predictions, actual_y),
+        "call_accuracy": float(np.mean(predicted_winners == actual_winners))
+    }
+
+
+def _cycle_key(train_data, test_X, training_options):
+    """
+    This function gives the key of a cycle in the cache, from the fingerprint of its model and a hash of its inputs.
+    :return: A string of the key.
+    """
+    fingerprint = model_fingerprint(train_data, X_COLUMNS, Y_COLUMNS, **training_options)
+    return f"{fingerprint}-{hashlib.sha256(np.ascontiguousarray(test_X, dtype=float).tobytes()).hexdigest()}"
+
+
+def _cycle_job(arguments):
+    """
+    This function trains the model of a cycle on the earlier cycles (or loads it from the registry) and predicts the
+    rows of the cycle, so that it can be mapped over by an executor.
+    """
+    train_data, test_X, registry_directory, training_options = arguments
+    model = load_or_train_model(train_data, verbose=False, registry_directory=registry_directory, **training_options)
+    features = polynomial_features(test_X, model["order"])
+    return {
+        "model": model,
+        "features": features,
+        "predictions": normalise_predictions(features @ model["coefficients"])
+    }
+
+
+def fit_cycles(jobs, executor=None, n_workers=None, registry_directory=None, training_options=None):
+    """
+    This function trains the model of each cycle and predicts its rows, with the cycles optionally spread across a
+    pool of processes or threads. The model, the feature matrix and the predictions of each cycle are cached in the
+    process, and the models are saved to the registry, so that each cycle is only trained once however many backtests
+    and scenarios include it.
+    :param jobs: A list of tuples of the training data (a Pandas dataframe of the earlier cycles) and the X input
+    variables of the cycle to be predicted as a numpy array of dimensions (n,3).
+    :param executor: None to run the cycles serially, or "process" or "thread" for the type of pool to run them across.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param registry_directory: An optional path of the directory of saved models.
+    :param training_options: An optional dictionary of the arguments of train_model, by default
+    BACKTEST_TRAINING_OPTIONS.
+    :return: A list of dictionaries, one for each job, containing the model, the feature matrix of the cycle at the
+    model's order, and the normalised predictions.
+    """
+    training_options = BACKTEST_TRAINING_OPTIONS if training_options is None else training_options
+    keys = [_cycle_key(train_data, test_X, training_options) for train_data, test_X in jobs]
+    missing = {}
+    for key, (train_data, test_X) in zip(keys, jobs):
+        if key not in _cycle_cache:
+            missing[key] = (train_data, test_X, registry_directory, training_options)
+    with timed_stage("fit_cycles"):
+        results = map_jobs(_cycle_job, list(missing.values()), executor, n_workers)
+    _cycle_cache.update(zip(missing, results))
+    return [_cycle_cache[key] for key in keys]
+
+
+def _walk_forward_jobs(df, years, min_train_cycles):
+    """
+    This function pairs each year that can be backtested with the data of the cycles before it.
+    :return: A tuple of the list of years that have at least min_train_cycles earlier cycles, and the list of jobs for
+    fit_cycles.
+    """
+    data_years = df.index.get_level_values(YEAR_LEVEL).to_numpy()
+    test_years = [year for year in years if np.count_nonzero(np.unique(data_years) < year) >= min_train_cycles]
+    jobs = [(df[data_years < year], df.loc[data_years == year, X_COLUMNS].to_numpy(dtype=float))
+            for year in test_years]
+    return test_years, jobs
+
+
+def _cycle_row(df, year, result):
+    """
+    This function summarises the backtest of a cycle.
+    :return: A dictionary of the columns of the row of the cycle in the table of cycles.
+    """
+    data_years = df.index.get_level_values(YEAR_LEVEL).to_numpy()
+    scores = score_cycle(result["predictions"], df.loc[data_years == year, Y_COLUMNS].to_numpy(dtype=float),
+                         result["model"]["error_margin"])
+    return {
+        YEAR_LEVEL: year,
+        "training cycles": ", ".join(str(cycle) for cycle in np.unique(data_years[data_years < year])),
+        "training rows": int(np.count_nonzero(data_years < year)),
+        "rows": int(np.count_nonzero(data_years == year)),
+        "order": result["model"]["order"],
+        "error margin": result["model"]["error_margin"],
+        "performance": scores["performance"],
+        **{f"rmse-{party}": value for party, value in zip(PARTIES, scores["rmse"])},
+        "call accuracy": scores["call_accuracy"]
+    }
+
+
+def replay_snapshots(df, snapshots, models):
+    """
+    This function forecasts the poll snapshots of each cycle in chronological order, each with the model trained on the
+    cycles before it, and scores the forecasts of every snapshot of a cycle whose results are known.
+    :param df: The training data as a Pandas dataframe, indexed by State Alpha and Year.
+    :param snapshots: A pandas Dataframe of polling data, as returned by stack_poll_snapshots.
+    :param models: A dictionary of the model dictionary of each year, as returned by train_model.
+    :return: A tuple of pandas Dataframes: the tidy forecasts of every state in every snapshot, with the winner of the
+    state's result and whether it was called correctly where the result is known, and the scores of each snapshot.
+    """
+    snapshots = snapshots.sort_values("Snapshot date", kind="stable")
+    snapshot_years = snapshots["Snapshot date"].dt.year.to_numpy()
+    data_years = df.index.get_level_values(YEAR_LEVEL).to_numpy()
+    forecasts, scores = [], []
+    for year, model in models.items():
+        polls_data = snapshots[snapshot_years == year]
+        if len(polls_data) == 0:
+            continue
+        X = polls_data[X_COLUMNS].to_numpy(dtype=float)
+        cycle_forecasts = pd.DataFrame(forecast_arrays(model["order"], model["coefficients"], model["error_margin"], X),
+                                       index=polls_data.index).reset_index()
+        cycle_forecasts.insert(0, "Snapshot date", polls_data["Snapshot date"].to_numpy())
+        cycle_forecasts.insert(1, YEAR_LEVEL, year)
+        results = df[data_years == year].droplevel(YEAR_LEVEL)[Y_COLUMNS].reindex(polls_data.index)
+        known = results.notna().all(axis=1).to_numpy()
+        actual_winners = np.full(len(polls_data), None, dtype=object)
+        if np.any(known):
+            winners, _, _ = classify_predictions(results.to_numpy(dtype=float)[known], model["error_margin"])
+            actual_winners[known] = winners
+            predictions = normalise_predictions(polynomial_features(X, model["order"]) @ model["coefficients"])
+            for date in np.unique(polls_data["Snapshot date"].to_numpy()[known]):
+                rows = known & (polls_data["Snapshot date"].to_numpy() == date)
+                snapshot_scores = score_cycle(predictions[rows], results.to_numpy(dtype=float)[rows],
+                                              model["error_margin"])
+                scores.append({"Snapshot date": date, YEAR_LEVEL: year, "states": int(np.count_nonzero(rows)),
+                               "performance": snapshot_scores["performance"],
+                               "call accuracy": snapshot_scores["call_accuracy"]})
+        cycle_forecasts["Result win"] = actual_winners
+        cycle_forecasts["Correct call"] = np.where(known, cycle_forecasts["Party win"] == actual_winners, None)
+        forecasts.append(cycle_forecasts)
+    score_columns = ["Snapshot date", YEAR_LEVEL, "states", "performance", "call accuracy"]
+    return (pd.concat(forecasts, ignore_index=True) if forecasts else pd.DataFrame(),
+            pd.DataFrame(scores, columns=score_columns))
+
+
+def walk_forward_backtest(df=None, min_train_cycles=1, replay=True, snapshot_dates=None, archive=None, executor=None,
+                          n_workers=None, registry_directory=None, **training_options):
+    """
+    This function backtests the modelling pipeline one election cycle at a time: the model of each cycle is trained by
+    train_model on the cycles before it only, and scored on the cycle with the performance metric, the RMSE and the
+    accuracy of its calls. The poll snapshots of each cycle are then replayed in chronological order with the model of
+    their cycle, which gives the forecasts that would have been made at the time.
+    :param df: The training data as a Pandas dataframe, indexed by State Alpha and Year. By default it is loaded.
+    :param min_train_cycles: An integer for the number of earlier cycles a cycle needs to be backtested.
+    :param replay: A boolean for whether to replay the poll snapshots.
+    :param snapshot_dates: An optional list of strings of the snapshot dates to be replayed. All are used by default.
+    :param archive: An optional dictionary as returned by open_archive, from which the snapshots are loaded.
+    :param executor: None to run the cycles serially, or "process" or "thread" to run them across a pool.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param registry_directory: An optional path of the directory of saved models.
+    :param training_options: Any of the orders, n_folds, seeds and random_state arguments of train_model, by default
+    BACKTEST_TRAINING_OPTIONS.
+    :return: A dictionary containing pandas Dataframes of the scores of each cycle, the prediction for each row of each
+    cycle, the replayed forecasts of each snapshot and the scores of each snapshot, and the model of each cycle.
+    """
+    df = load_data() if df is None else df
+    training_options = {**BACKTEST_TRAINING_OPTIONS, **training_options}
+    snapshots = stack_poll_snapshots(snapshot_dates, archive) if replay else None
+    years = set(cycle_years(df))
+    if replay:
+        years |= set(int(year) for year in snapshots["Snapshot date"].dt.year.unique())
+    test_years, jobs = _walk_forward_jobs(df, sorted(years), min_train_cycles)
+    results = fit_cycles(jobs, executor, n_workers, registry_directory, training_options)
+    data_years = df.index.get_level_values(YEAR_LEVEL).to_numpy()
+    cycles, predictions = [], []
+    for year, result in zip(test_years, results):
+        if np.count_nonzero(data_years == year) == 0:
+            continue
+        cycles.append(_cycle_row(df, year, result))
+        cycle_predictions = pd.DataFrame(result["predictions"], columns=[f"pred-{party}" for party in PARTIES],
+                                         index=df.index[data_years == year])
+        parties, likelihoods, _ = classify_predictions(result["predictions"], result["model"]["error_margin"])
+        actual_winners, _, _ = classify_predictions(df.loc[data_years == year, Y_COLUMNS].to_numpy(dtype=float),
+                                                    result["model"]["error_margin"])
+        cycle_predictions[Y_COLUMNS] = df.loc[data_years == year, Y_COLUMNS].to_numpy(dtype=float)
+        cycle_predictions["Party win"] = parties
+        cycle_predictions["Likelihood"] = likelihoods
+        cycle_predictions["Result win"] = actual_winners
+        cycle_predictions["Correct call"] = parties == actual_winners
+        predictions.append(cycle_predictions)
+    models = {year: result["model"] for year, result in zip(test_years, results)}
+    with timed_stage("replay_snapshots"):
+        replay_forecasts, replay_scores = replay_snapshots(df, snapshots, models) if replay else (None, None)
+    return {
+        "cycles": pd.DataFrame(cycles).set_index(YEAR_LEVEL) if cycles else pd.DataFrame(),
+        "predictions": pd.concat(predictions) if predictions else pd.DataFrame(),
+        "replay": replay_forecasts,
+        "replay_scores": replay_scores,
+        "models": models
+    }
+
+
+def backtest_scenarios(df=None, scenario_seeds=range(10), scale=10, noise=0.01, min_train_cycles=1, executor=None,
+                       n_workers=None, registry_directory=None, **training_options):
+    """
+    This function runs the walk-forward backtest on synthetic scenarios of the training data, as made by
+    synthetic_data with a different seed for each scenario. The cycles of every scenario are trained in a single pool.
+    :param df: The training data as a Pandas dataframe, indexed by State Alpha and Year. By default it is loaded.
+    :param scenario_seeds: A list of integer seeds, one for each scenario.
+    :param scale: An integer for the number of copies of each row in a scenario.
+    :param noise: The standard deviation of the noise added to each vote share of the copies.
+    :param min_train_cycles: An integer for the number of earlier cycles a cycle needs to be backtested.
+    :param executor: None to run the cycles serially, or "process" or "thread" to run them across a pool.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param registry_directory: An optional path of the directory of saved models.
+    :param training_options: Any of the orders, n_folds, seeds and random_state arguments of train_model, by default
+    BACKTEST_TRAINING_OPTIONS.
+    :return: A pandas Dataframe of the scores of each cycle of each scenario, indexed by the seed of the scenario and
+    the year.
+    """
+    df = load_data() if df is None else df
+    training_options = {**BACKTEST_TRAINING_OPTIONS, **training_options}
+    scenarios = [synthetic_data(df, scale, noise, seed) for seed in scenario_seeds]
+    scenario_jobs = [_walk_forward_jobs(scenario, cycle_years(scenario), min_train_cycles) for scenario in scenarios]
+    results = fit_cycles([job for _, jobs in scenario_jobs for job in jobs], executor, n_workers, registry_directory,
+                         training_options)
+    rows = []
+    for seed, scenario, (test_years, _) in zip(scenario_seeds, scenarios, scenario_jobs):
+        for year in test_years:
+            rows.append({"scenario": seed, **_cycle_row(scenario, year, results[len(rows)])})
+    return pd.DataFrame(rows).set_index(["scenario", YEAR_LEVEL])
+
+
+def backtest_script():
+    """
+    This function runs the walk-forward backtest of the training data, replaying the poll snapshots from the poll
+    archive if there is one, and prints the scores of each cycle and snapshot.
+    :return: The dictionary returned by walk_forward_backtest.
+    """
+    archive_path = data_tools.DATA_ROOT / POLL_ARCHIVE_DIRECTORY
+    archive = open_archive(archive_path) if (archive_path / ARCHIVE_INDEX_FILE).exists() else None
+    backtest = walk_forward_backtest(archive=archive)
+    pd.set_option('display.max_columns', None)
+    print("Walk-forward backtest of each cycle, trained on the cycles before it:")
+    print(backtest["cycles"])
+    if len(backtest["replay_scores"]) > 0:
+        print("Scores of the replayed poll snapshots:")
+        print(backtest["replay_scores"])
+    if len(backtest["replay"]) > 0:
+        print(f'Replayed {backtest["replay"]["Snapshot date"].nunique()} poll snapshots of the cycles '
+              f'{sorted(int(year) for year in backtest["replay"][YEAR_LEVEL].unique())}.')
+    return backtest
@@ -0,0 +1,182 @@
+import datetime
+import json
+import pathlib as pl
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_tools
+from backtest_tools import clear_backtest_cache, walk_forward_backtest
+from data_tools import load_data, get_poll_data, split_dataframe, k_folds, convert_to_xys
+from math_tools import normalise_predictions, performance_metric, rmse
+from model_tools import fit_model, bespoke_cross_validation_2
+from script import X_COLUMNS, Y_COLUMNS, classify_predictions, train_model
+from selection_tools import repeated_cross_validation
+from simulation_tools import simulate_electoral_college
+from synthetic_tools import synthetic_data
+from timing_tools import record_stages
+
+
+BENCHMARK_DIRECTORY = "benchmarks"
+
+
+def _benchmark_stages(df, max_legacy_rows, max_backtest_rows):
+    """
+    This function sets up the stages to be timed on a dataset.
+    :return: A list of tuples of the name of each stage and a function that runs it.
+    """
+    train_data, test_data = split_dataframe(df, [0.7, 0.3], 20)
+    folds = k_folds(train_data, 20)
+    X_train, Y_train = train_data[X_COLUMNS].to_numpy(), train_data[Y_COLUMNS].to_numpy()
+    orders = [i for i in range(5)]
+    predictions = normalise_predictions(Y_train + 0.01)
+    polls_data = get_poll_data("20-Jul-24")
+
+    def legacy_cross_validation():
+        # The 300 (folds x orders x parties) fits of the sklearn pipeline made by the original cross-validation
+        for i in range(len(folds)):
+            training_xys = convert_to_xys(pd.concat([folds[j] for j in range(len(folds)) if j != i]), X_COLUMNS,
+                                          Y_COLUMNS)
+            for order in orders:
+                for X, y in training_xys:
+                    fit_model(X, y, order)
+
+    def walk_forward_backtest():
+        # The cycles are trained afresh on every run: the cache is emptied, and the splits are random so that no model
+        # is loaded from (or saved to) the registry
+        clear_backtest_cache()
+        walk_forward_backtest(df, replay=False, random_state=None)
+
+    def print_results():
+        pd.DataFrame(predictions, columns=["pred-D", "pred-R", "pred-O"]).to_string()
+
+    stages = [
+        ("split_dataframe", lambda: split_dataframe(df, [0.7, 0.3], 20)),
+        ("k_folds", lambda: k_folds(train_data, 20)),
+        ("convert_to_xys", lambda: convert_to_xys(train_data, X_COLUMNS, Y_COLUMNS)),
+        ("cross_validation", lambda: bespoke_cross_validation_2(folds, X_COLUMNS, Y_COLUMNS, orders,
+                                                                performance_metric)),
+        ("repeated_cross_validation", lambda: repeated_cross_validation(X_train, Y_train, orders, 20,
+                                                                        [i for i in range(5)])),
+        ("normalise_and_metrics", lambda: (performance_metric(normalise_predictions(predictions), Y_train),
+                                           rmse(predictions, Y_train))),
+        ("classify_predictions", lambda: classify_predictions(predictions, 0.035)),
+        ("print_results", print_results),
+        ("simulate_electoral_college", lambda: simulate_electoral_college(
+            list(polls_data.index.values), list(polls_data[X_COLUMNS].to_numpy().T), 0.035, n_simulations=100000,
+            seed=20))
+    ]
+    if len(train_data) <= max_legacy_rows:
+        stages.append(("legacy_fit_model_cross_validation", legacy_cross_validation))
+    if len(df) <= max_backtest_rows:
+        stages.append(("walk_forward_backtest", walk_forward_backtest))
+    return stages
+
+
+def run_benchmarks(scales=(1, 10, 100, 1000), repeats=3, max_legacy_rows=10000, verbose=True, year_scales=(1, 10),
+                   max_backtest_rows=2000):
+    """
+    This function times each stage of the training and forecast pipeline on the training data and on synthetically
+    scaled copies of it. Each stage is timed as the best of several runs, and its peak memory is measured in a separate
+    run with tracemalloc, since tracing slows the stage down. The whole of train_model is also run with the timing hooks
+    enabled, to give the time spent in each of its stages.
+    :param scales: A list of integers for the number of copies of the training data as extra states in each dataset.
+    :param repeats: An integer for the number of timed runs of each stage.
+    :param max_legacy_rows: An integer for the largest training set on which to time the original sklearn pipeline
+    cross-validation, which is slow on large datasets.
+    :param verbose: A boolean for whether to print out each result.
+    :param year_scales: A list of integers for the number of copies of the cycles as extra years. Each is combined with
+    each of the scales, as long as the dataset has no more rows than the largest scale alone.
+    :param max_backtest_rows: An integer for the largest dataset on which to time the walk-forward backtest, which
+    trains a model for every cycle.
+    :return: A dictionary of the results and the details of the environment, which can be saved with save_benchmarks.
+    """
+    df = load_data()
+    results = []
+    datasets = [(scale, year_scale) for year_scale in year_scales for scale in scales
+                if scale * year_scale <= max(scales)]
+    for scale, year_scale in datasets:
+        scaled_data = synthetic_data(df, scale, year_scale=year_scale)
+        for stage, function in _benchmark_stages(scaled_data, max_legacy_rows, max_backtest_rows):
+            durations = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                function()
+                durations.append(time.perf_counter() - start)
+            tracemalloc.start()
+            function()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({
+                "scale": scale,
+                "year_scale": year_scale,
+                "n_rows": len(scaled_data),
+                "stage": stage,
+                "seconds": min(durations),
+                "rows_per_second": len(scaled_data) / min(durations),
+                "peak_memory_bytes": peak_memory
+            })
+            if verbose:
+                print(f'{scale}x{year_scale} ({len(scaled_data)} rows) {stage}: {min(durations):.6f}s, '
+                      f'peak memory {peak_memory / 1e6:.2f}MB')
+        with record_stages() as durations:
+            train_model(scaled_data, verbose=False, random_state=20)
+        for stage, stage_durations in durations.items():
+            results.append({
+                "scale": scale,
+                "year_scale": year_scale,
+                "n_rows": len(scaled_data),
+                "stage": f"train_model.{stage}",
+                "seconds": sum(stage_durations),
+                "rows_per_second": len(scaled_data) / sum(stage_durations),
+                "peak_memory_bytes": None
+            })
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results
+    }
+
+
+def save_benchmarks(benchmarks, path=None):
+    """
+    This function saves benchmark results to a json file.
+    :param benchmarks: A dictionary of results as returned by run_benchmarks.
+    :param path: An optional path for the json file. By default it is written to a timestamped file in the benchmarks
+    directory within the data directory.
+    :return: The path of the json file.
+    """
+    if path is None:
+        timestamp = benchmarks["created"].replace(":", "").replace("-", "")
+        path = data_tools.DATA_ROOT / BENCHMARK_DIRECTORY / f"benchmark-{timestamp}.json"
+    path = pl.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as benchmark_file:
+        json.dump(benchmarks, benchmark_file, indent=2)
+    return path
+
+
+def compare_benchmarks(baseline_path, current_path, tolerance=0.2):
+    """
+    This function compares the timings of two saved benchmark runs, to catch regressions.
+    :param baseline_path: The path of the json file of the baseline run.
+    :param current_path: The path of the json file of the run to be compared. Both runs must record the year_scale of
+    each result, as saved by save_benchmarks.
+    :param tolerance: The fraction by which a stage may be slower before it is counted as a regression.
+    :return: A pandas Dataframe of the stages in both runs, with the baseline and current times, their ratio, and
+    whether the stage has regressed.
+    """
+    runs = []
+    for path in [baseline_path, current_path]:
+        with open(path, 'r') as benchmark_file:
+            run = pd.DataFrame(json.load(benchmark_file)["results"])
+        if "year_scale" not in run or run["year_scale"].isna().any():
+            raise ValueError(f"The benchmark run has no year_scale for its results, so it cannot be compared: {path}")
+        runs.append(run.set_index(["scale", "year_scale", "stage"])["seconds"])
+    comparison = pd.concat(runs, axis=1, keys=["baseline_seconds", "current_seconds"], join="inner")
+    comparison["ratio"] = comparison["current_seconds"] / comparison["baseline_seconds"]
+    comparison["regression"] = comparison["ratio"] > 1 + tolerance
+    return comparison
@@ -1,3 +1,4 @@
+import json
 import pathlib as pl
 import os
 import numpy as np
@@ -5,84 +6,316 @@ import pandas as pd
 from math_tools import split_n_by_k
 
 
-path_csv = pl.Path(os.getcwd()) / f'US Election Data - csv (2).csv'
-with open(path_csv, 'rb') as file:
-    data = pd.read_csv(file, index_col=[0, 1])
+# The directory containing the data files, which defaults to the directory of this file so that the data can be found
+# from any working directory. It can be changed with the US_ELECTION_DATA_ROOT environment variable or set_data_root.
+DATA_ROOT = pl.Path(os.environ.get("US_ELECTION_DATA_ROOT", pl.Path(__file__).resolve().parent))
+TRAINING_DATA_FILE = "US Election Data - csv (2).csv"
+POLL_DATA_DIRECTORY = "Current Poll Data"
+BINARY_CACHE_DIRECTORY = ".data_cache"
+_csv_cache = {}
 
 
-def get_poll_data(polls_at_date):
+def set_data_root(data_root):
+    """
+    This function changes the directory from which the data files are loaded.
+    :param data_root: The path of the directory containing the data files.
+    """
+    global DATA_ROOT
+    DATA_ROOT = pl.Path(data_root)
+
+
+def clear_cache():
+    """
+    This function empties the in-process cache of loaded data files.
+    """
+    _csv_cache.clear()
+
+
+def file_stamp(path):
+    """
+    This function returns the modification time and size of a file, which change whenever the file is rewritten.
+    :param path: The path of the file.
+    :return: A tuple of integers for the modification time in nanoseconds and the size in bytes.
+    """
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _binary_cache_paths(path):
+    """
+    This function returns the paths of the values (.npy) and metadata (.json) files of the binary cache of a csv file.
+    """
+    cache_directory = path.parent / BINARY_CACHE_DIRECTORY
+    return cache_directory / f"{path.stem}.npy", cache_directory / f"{path.stem}.json"
+
+
+def _read_binary_cache(path, stamp):
+    """
+    This function loads a dataframe from the binary cache of a csv file, with the values memory-mapped from the .npy
+    file. None is returned if there is no cache, or if the csv file has changed since the cache was written.
+    """
+    values_path, metadata_path = _binary_cache_paths(path)
+    try:
+        with open(metadata_path, 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        if tuple(metadata["stamp"]) != stamp:
+            return None
+        values = np.load(values_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    index = pd.MultiIndex.from_arrays(metadata["index"], names=metadata["index_names"]) \
+        if len(metadata["index_names"]) > 1 else pd.Index(metadata["index"][0], name=metadata["index_names"][0])
+    return pd.DataFrame(values, index=index, columns=metadata["columns"], copy=False)
+
+
+def _write_binary_cache(path, stamp, dataframe):
+    """
+    This function writes the binary cache of a csv file. The csv file must only contain numeric columns. Failures to
+    write the cache (e.g. from a read-only directory) are ignored, since the csv file can always be parsed instead.
+    """
+    values_path, metadata_path = _binary_cache_paths(path)
+    metadata = {
+        "stamp": list(stamp),
+        "columns": list(dataframe.columns),
+        "index_names": list(dataframe.index.names),
+        "index": [dataframe.index.get_level_values(i).tolist() for i in range(dataframe.index.nlevels)]
+    }
+    try:
+        values_path.parent.mkdir(exist_ok=True)
+        np.save(values_path, dataframe.to_numpy(dtype=float))
+        with open(metadata_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+    except OSError:
+        pass
+
+
+def read_csv_cached(path, index_col, binary_cache=False):
+    """
+    This function reads a csv file into a pandas Dataframe, keeping it in an in-process cache keyed by the path and the
+    modification time of the file, so that the file is only parsed again once it has changed. Optionally the values
+    are also cached in a binary .npy file next to the csv file, so that other processes can skip parsing it.
+    :param path: The path of the csv file.
+    :param index_col: The column(s) of the csv file to be used as the index.
+    :param binary_cache: A boolean for whether to read and write the binary cache.
+    :return: A pandas Dataframe containing the data, which is a copy that can be modified by the caller.
+    """
+    path = pl.Path(path).resolve()
+    stamp = file_stamp(path)
+    cached = _csv_cache.get(path)
+    if cached is None or cached[0] != stamp:
+        dataframe = _read_binary_cache(path, stamp) if binary_cache else None
+        if dataframe is None:
+            with open(path, 'rb') as file:
+                dataframe = pd.read_csv(file, index_col=index_col)
+            if binary_cache:
+                _write_binary_cache(path, stamp, dataframe)
+        _csv_cache[path] = (stamp, dataframe)
+    return _csv_cache[path][1].copy()
+
+
+def load_data(binary_cache=False):
+    """
+    This function loads the historical polling and election results data used to train the models.
+    :param binary_cache: A boolean for whether to read and write the binary cache.
+    :return: A pandas Dataframe containing the data, indexed by State Alpha and Year.
+    """
+    return read_csv_cached(DATA_ROOT / TRAINING_DATA_FILE, [0, 1], binary_cache)
+
+
+def __getattr__(name):
+    # The training data used to be read when this module was imported, so it is still available as data_tools.data
+    if name == "data":
+        return load_data()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_poll_data(polls_at_date, binary_cache=False):
     """
     This function extracts polling data at the specified date from a csv file and converts it to a pandas Dataframe.
     :param polls_at_date: A string specifying the date for the file name, e.g. "17-Mar-24"
+    :param binary_cache: A boolean for whether to read and write the binary cache.
     :return: A pandas Dataframe containing the polling data
     """
-    polls_path_csv = pl.Path(os.getcwd()) / f"Current Poll Data/US Election Data - Polls {polls_at_date}.csv"
-    with open(polls_path_csv, 'rb') as polls_file:
-        polls_data = pd.read_csv(polls_file, index_col=0)
-    return polls_data
+    polls_path_csv = DATA_ROOT / POLL_DATA_DIRECTORY / f"US Election Data - Polls {polls_at_date}.csv"
+    return read_csv_cached(polls_path_csv, 0, binary_cache)
 
 
-def split_dataframe(df, data_split):
+def list_poll_snapshots():
     """
-    function to divide a dataframe into training, validation and test dataframes
-    :param df: the full dataframe which is to be divided
-    :param data_split: a list containing the fraction of the full dataframe for each of training and test, in that order
-    :return training, test: dataframes for each of the sets
+    This function finds the dates of all of the polling data files, in chronological order.
+    :return: A list of strings of the dates in the file names, e.g. ["17-Mar-24", "20-Jul-24"]
+    """
+    prefix = "US Election Data - Polls "
+    dates = [path.stem[len(prefix):] for path in (DATA_ROOT / POLL_DATA_DIRECTORY).glob(f"{prefix}*.csv")]
+    return sorted(dates, key=lambda date: pd.to_datetime(date, format="%d-%b-%y"))
+
+
+def split_indices(n, data_split, random_state=None):
+    """
+    This function randomly divides the row positions 0 to n-1 into training and test sets.
+    :param n: An integer for the number of rows.
+    :param data_split: a list containing the fraction of the rows for each of training and test, in that order
+    :param random_state: An optional integer seed for the random number generator.
+    :return training, test: sorted integer numpy arrays of the row positions in each of the sets
     """
-    if not isinstance(df, pd.DataFrame):
-        raise TypeError("The data must be input as a Pandas Dataframe.")
     if len(data_split) != 2:
         raise ValueError("The data split should be a list length-2, with the proportions for the training and test "
                          "sets respectively.")
     if sum(data_split) != 1:
         raise ValueError("The data split should sum to 1.")
-    if np.product(data_split) < 0:
+    if np.prod(data_split) < 0:
         raise ValueError("The data split must not contain negative numbers.")
-    training = df.sample(frac=data_split[0])
-    test = df.drop(training.index)
-    return training, test
+    permutation = np.random.default_rng(random_state).permutation(n)
+    n_training = int(round(data_split[0] * n))
+    return np.sort(permutation[:n_training]), np.sort(permutation[n_training:])
+
+
+def split_dataframe(df, data_split, random_state=None):
+    """
+    function to divide a dataframe into training, validation and test dataframes
+    :param df: the full dataframe which is to be divided
+    :param data_split: a list containing the fraction of the full dataframe for each of training and test, in that order
+    :param random_state: An optional integer seed for the random number generator.
+    :return training, test: dataframes for each of the sets
+    """
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("The data must be input as a Pandas Dataframe.")
+    training_rows, test_rows = split_indices(len(df), data_split, random_state)
+    return df.iloc[training_rows], df.iloc[test_rows]
 
 
-def k_folds(dataframe, k):
+def fold_assignments(n, k, random_state=20):
+    """
+    This function randomly assigns each of n rows to one of k folds, with the folds as even as possible in size.
+    :param n: An integer for the number of rows.
+    :param k: An integer for the number of folds.
+    :param random_state: An optional integer seed for the random number generator.
+    :return: An integer numpy array of length n, giving the fold to which each row belongs.
+    """
+    if k > n:
+        raise ValueError("The number of folds cannot be more than the number of rows.")
+    fold_ids = np.empty(n, dtype=np.int64)
+    fold_ids[np.random.default_rng(random_state).permutation(n)] = np.repeat(np.arange(k), split_n_by_k(n, k))
+    return fold_ids
+
+
+def k_folds(dataframe, k, random_state=20):
     """
     This is a function that returns a list of k folds of the data. The returned value should be a list of dataframes
     :param dataframe: The input data as a Pandas dataframe.
     :param k: An integer for the number of folds to be made in the data.
+    :param random_state: An optional integer seed for the random number generator.
     :return: A list of dataframes, where each element is a fold in the data.
     """
-    # Create list of how long each fold should be. The folds should be as even as possible in number, but some may need
-    # to have an extra data point if the total number of data points isn't divisible by n
-    len_folds = split_n_by_k(len(dataframe), k)
-    folds = []
-    for i in range(k):
-        data_ss = dataframe.sample(n=len_folds[i], random_state=20)
-        dataframe = dataframe.drop(data_ss.index)
-        folds.append(data_ss)
-    return folds
+    # The folds should be as even as possible in number, but some may need to have an extra data point if the total
+    # number of data points isn't divisible by k
+    fold_ids = fold_assignments(len(dataframe), k, random_state)
+    return [dataframe.iloc[np.flatnonzero(fold_ids == i)] for i in range(k)]
+
+
+class ColumnarDataset:
+    """
+    This class holds the X input variables and y output variables of a dataset as two numpy arrays, which are pulled
+    from a dataframe once: a contiguous float64 X block of dimensions (n,d), and a Y block of dimensions (n,k) stored
+    column by column so that each y is a contiguous view. Subsets of the rows are cheap: a slice of rows is a view of
+    the same blocks, and other row selections are only gathered when X or Y is accessed.
+    """
+
+    def __init__(self, X, Y, X_columns, y_columns, index=None, rows=None):
+        """
+        :param X: The input variables as a numpy array of dimensions (n,d).
+        :param Y: The output variables as a numpy array of dimensions (n,k).
+        :param X_columns: A list of the names of the X input variables.
+        :param y_columns: A list of the names of the y output variables.
+        :param index: An optional pandas Index of the rows.
+        :param rows: An optional slice or integer numpy array selecting the rows of X and Y in this dataset.
+        """
+        self._X = X
+        self._Y = Y
+        self.X_columns = list(X_columns)
+        self.y_columns = list(y_columns)
+        self._index = index
+        self._rows = slice(None) if rows is None else rows
+
+    @classmethod
+    def from_dataframe(cls, dataframe, X_columns, y_columns):
+        """
+        This function pulls the X and y columns out of a dataframe, after checking them in the same way as
+        convert_to_xys.
+        :param dataframe: The data as a Pandas dataframe.
+        :param X_columns: A list of the column names in the dataframe which represent the X input variables.
+        :param y_columns: A list of the column names in the dataframe which represent the y output variables.
+        :return: A ColumnarDataset of the data.
+        """
+        if not isinstance(dataframe, pd.DataFrame):
+            raise TypeError("The data must be input as a Pandas Dataframe.")
+        for X_column in X_columns:
+            if X_column not in dataframe.columns:
+                raise ValueError(f"Column specified in X_columns is not present in the dataframe: {X_column}")
+        for y_column in y_columns:
+            if y_column not in dataframe.columns:
+                raise ValueError(f"Column specified in y_columns is not present in the dataframe: {y_column}")
+            if y_column in X_columns:
+                raise ValueError(f"A column specified in X_columns cannot also be a y column: {y_column}")
+        X = np.ascontiguousarray(dataframe[X_columns].to_numpy(dtype=np.float64))
+        Y = np.asfortranarray(dataframe[y_columns].to_numpy(dtype=np.float64))
+        return cls(X, Y, X_columns, y_columns, dataframe.index)
+
+    def __len__(self):
+        return len(self._X[self._rows]) if isinstance(self._rows, slice) else len(self._rows)
+
+    @property
+    def X(self):
+        """
+        The input variables of the rows in this dataset, as a numpy array of dimensions (n,d).
+        """
+        return self._X[self._rows]
+
+    @property
+    def Y(self):
+        """
+        The output variables of the rows in this dataset, as a numpy array of dimensions (n,k).
+        """
+        return self._Y[self._rows]
+
+    @property
+    def index(self):
+        """
+        The pandas Index of the rows in this dataset, or None if the dataset was not made from a dataframe.
+        """
+        return None if self._index is None else self._index[self._rows]
+
+    def subset(self, rows):
+        """
+        This function selects some of the rows of this dataset, without copying the X and Y blocks.
+        :param rows: A slice, or an integer or boolean numpy array, of the rows to select, relative to this dataset.
+        :return: A ColumnarDataset of the selected rows.
+        """
+        positions = range(len(self._X))[self._rows] if isinstance(self._rows, slice) else self._rows
+        if isinstance(positions, range) and isinstance(rows, slice) and positions[rows].step > 0:
+            # A slice of a slice is still a slice, so the blocks stay as views
+            selected = positions[rows]
+            rows = slice(selected.start, selected.stop, selected.step)
+        else:
+            rows = np.asarray(positions)[rows]
+        return ColumnarDataset(self._X, self._Y, self.X_columns, self.y_columns, self._index, rows)
+
+    def xys(self):
+        """
+        This function gives the data in the form returned by convert_to_xys.
+        :return: A list of tuples (X,y), one for each y output variable, which all share the same X array.
+        """
+        X, Y = self.X, self.Y
+        return [(X, Y[:, i]) for i in range(Y.shape[1])]
 
 
 def convert_to_xys(dataframe, X_columns, y_columns):
     """
     This function takes a dataframe, and outputs a list of tuples of numpy arrays for each y, where the tuple is in the
-    form (X,y).
+    form (X,y). The X array is only pulled out of the dataframe once, and is shared by all of the tuples.
     :param dataframe: The data as a Pandas dataframe.
     :param X_columns: A list of the column names in the dataframe which represent the X input variables.
     :param y_columns: A list of the column names in the dataframe which represent the y output variables.
     :return: A list of tuples (X,y).
     """
-    if not isinstance(dataframe, pd.DataFrame):
-        raise TypeError("The data must be input as a Pandas Dataframe.")
-    for X_column in X_columns:
-        if X_column not in dataframe.columns:
-            raise ValueError(f"Column specified in X_columns is not present in the dataframe: {X_column}")
-    for y_column in y_columns:
-        if y_column not in dataframe.columns:
-            raise ValueError(f"Column specified in y_columns is not present in the dataframe: {y_column}")
-        if y_column in X_columns:
-            raise ValueError(f"A column specified in X_columns cannot also be a y column: {y_column}")
-    output = [0 for _ in range(len(y_columns))]
-    for i, y_column in enumerate(y_columns):
-        y = dataframe[y_column].to_numpy()
-        X = dataframe[X_columns].to_numpy()
-        output[i] = (X, y)
-    return output
+    return ColumnarDataset.from_dataframe(dataframe, X_columns, y_columns).xys()
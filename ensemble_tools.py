@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from math_tools import normalise_predictions
+from model_tools import polynomial_features, fit_coefficients
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def fit_bootstrap_ensemble(X, Y, order, n_members=200, seed=None, batch_size=100, rcond=1e-6):
+    """
+    This function fits an ensemble of models of the given order to bootstrap resamples of the training data, with each
+    resample fitted by weighting the rows by the number of times they were drawn, and the resamples of each batch
+    fitted in a single batched call. It also keeps what is needed to tell whether new rows are like the training data:
+    the range of each input variable, and the leverage of the training rows, i.e. how far each row's features are from
+    the bulk of the training features.
+    :param X: The input variables of the training data as a numpy array of dimensions (n,d).
+    :param Y: The output variables of the training data as a numpy array of dimensions (n,k).
+    :param order: The order of the polynomial that the models are being fit to.
+    :param n_members: An integer for the number of bootstrap resamples in the ensemble.
+    :param seed: An optional integer seed for the random number generator.
+    :param batch_size: An integer for the number of resamples fitted at once, which bounds the memory used.
+    :param rcond: The cutoff for small singular values, relative to the largest, as in fit_coefficients.
+    :return: A dictionary containing the order, the coefficients of every member (n_members,p,k), the residuals of the
+    normalised fit to all of the training data (n,k), the minimum and maximum of each input variable, the basis from
+    which leverages are calculated (p,r), and the largest leverage of a training row.
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    features = polynomial_features(X, order)
+    rng = np.random.default_rng(seed)
+    coefficients = np.zeros((n_members, features.shape[1], Y.shape[1]))
+    for start in range(0, n_members, batch_size):
+        size = min(batch_size, n_members - start)
+        counts = rng.multinomial(len(X), np.full(len(X), 1 / len(X)), size=size)
+        coefficients[start:start + size] = fit_coefficients(features, Y, counts, rcond)
+    residuals = Y - normalise_predictions(features @ fit_coefficients(features, Y, rcond=rcond))
+    # The leverage of a row with features f is f^T (F^T F)^+ f, which is the squared norm of f in this basis
+    _, singular_values, vh = np.linalg.svd(features, full_matrices=False)
+    rank = int(np.count_nonzero(singular_values > rcond * singular_values[0]))
+    leverage_basis = vh[:rank].T / singular_values[:rank]
+    return {
+        "order": order,
+        "coefficients": coefficients,
+        "residuals": residuals,
+        "X_min": X.min(axis=0),
+        "X_max": X.max(axis=0),
+        "leverage_basis": leverage_basis,
+        "max_leverage": float(np.max(np.sum(np.square(features @ leverage_basis), axis=1)))
+    }
+
+
+def predict_ensemble(ensemble, X, level=0.9, seed=None, tolerance=1e-9):
+    """
+    This function predicts every row against every member of the ensemble with a single matrix product. Each member's
+    normalised prediction has a residual of the training data added to it, drawn at random for each member and row, so
+    that the spread of the predictions covers the noise in the results as well as the uncertainty in the coefficients.
+    :param ensemble: A dictionary as returned by fit_bootstrap_ensemble.
+    :param X: The input variables as a numpy array of dimensions (m,d).
+    :param level: The probability covered by each predictive interval, e.g. 0.9 for the 5% to 95% quantiles.
+    :param seed: An optional integer seed for the random number generator used to draw the residuals.
+    :param tolerance: The distance outside the range of the training data within which an input variable is still
+    counted as in range.
+    :return: A dictionary containing the mean and the lower and upper bounds of the predictive intervals of each output
+    variable (m,k), and of the Republican margin (y^_2-y^_1) (m,), the fraction of members in which each party has the
+    largest share (m,k), the leverage of each row, and boolean numpy arrays of the rows with an input variable out of
+    the training range, and of the rows that are out of distribution, i.e. out of range or with a higher leverage than
+    any training row.
+    """
+    X = np.asarray(X, dtype=float)
+    features = polynomial_features(X, ensemble["order"])
+    predictions = features @ ensemble["coefficients"]  # i.e. (n_members, m, k)
+    shares = predictions[:, :, :3]
+    predictions[:, :, :3] = shares / shares.sum(axis=2, keepdims=True)
+    residuals = ensemble["residuals"]
+    rng = np.random.default_rng(seed)
+    predictions += residuals[rng.integers(0, len(residuals), predictions.shape[:2])]
+    margins = predictions[:, :, 1] - predictions[:, :, 0]
+    quantiles = [(1 - level) / 2, (1 + level) / 2]
+    lower, upper = np.quantile(predictions, quantiles, axis=0)
+    margin_lower, margin_upper = np.quantile(margins, quantiles, axis=0)
+    winners = np.argmax(predictions[:, :, :3], axis=2)
+    win_probabilities = np.stack([(winners == i).mean(axis=0) for i in range(3)], axis=1)
+    leverage = np.sum(np.square(features @ ensemble["leverage_basis"]), axis=1)
+    out_of_range = np.any((X < ensemble["X_min"] - tolerance) | (X > ensemble["X_max"] + tolerance), axis=1)
+    return {
+        "mean": predictions.mean(axis=0),
+        "lower": lower,
+        "upper": upper,
+        "margin_mean": margins.mean(axis=0),
+        "margin_lower": margin_lower,
+        "margin_upper": margin_upper,
+        "win_probabilities": win_probabilities,
+        "leverage": leverage,
+        "out_of_range": out_of_range,
+        "out_of_distribution": out_of_range | (leverage > ensemble["max_leverage"])
+    }
+
+
+def ensemble_forecast(ensemble, polls_data, level=0.9, seed=None):
+    """
+    This function forecasts each row of polling data with predictive intervals from a bootstrap ensemble.
+    :param ensemble: A dictionary as returned by fit_bootstrap_ensemble.
+    :param polls_data: A pandas Dataframe of polling data containing the X columns.
+    :param level: The probability covered by each predictive interval.
+    :param seed: An optional integer seed for the random number generator used to draw the residuals.
+    :return: A pandas Dataframe with the same index as polls_data, containing the lower and upper bounds of the
+    predicted vote shares and the Republican margin (R-D) as percentages, the probability of each party winning, the
+    leverage, and whether the row is out of distribution.
+    """
+    predictions = predict_ensemble(ensemble, polls_data[X_COLUMNS].to_numpy(), level, seed)
+    forecasts = {}
+    for i, party in enumerate(["D", "R", "O"]):
+        forecasts[f"pred-{party} lower"] = np.around(100 * predictions["lower"][:, i], 2)
+        forecasts[f"pred-{party} upper"] = np.around(100 * predictions["upper"][:, i], 2)
+    forecasts["R-D margin lower"] = np.around(100 * predictions["margin_lower"], 2)
+    forecasts["R-D margin upper"] = np.around(100 * predictions["margin_upper"], 2)
+    for i, party in enumerate(["D", "R", "O"]):
+        forecasts[f"P(win-{party})"] = predictions["win_probabilities"][:, i]
+    forecasts["leverage"] = predictions["leverage"]
+    forecasts["out of distribution"] = predictions["out_of_distribution"]
+    return pd.DataFrame(forecasts, index=polls_data.index)
+
+
+def fit_data_ensemble(df, order, n_members=200, seed=None):
+    """
+    This function fits a bootstrap ensemble to the training data.
+    :param df: The training data as a Pandas dataframe, e.g. from load_data().
+    :param order: The order of the polynomial that the models are being fit to, e.g. the order of a trained model.
+    :param n_members: An integer for the number of bootstrap resamples in the ensemble.
+    :param seed: An optional integer seed for the random number generator.
+    :return: A dictionary as returned by fit_bootstrap_ensemble.
+    """
+    return fit_bootstrap_ensemble(df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy(), order, n_members, seed)
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import data_tools
+from archive_tools import archive_polls_data, load_date_range
+from data_tools import load_data, get_poll_data, list_poll_snapshots
+from ensemble_tools import ensemble_forecast, fit_data_ensemble
+from math_tools import normalise_predictions
+from model_tools import polynomial_features
+from script import X_COLUMNS, classify_predictions, load_or_train_model
+from timing_tools import timed_stage
+
+
+# The columns of ensemble_forecast added to the forecast history
+ENSEMBLE_COLUMNS = ["R-D margin lower", "R-D margin upper", "out of distribution"]
+
+
+def stack_poll_snapshots(snapshot_dates=None, archive=None):
+    """
+    This function loads the polling data of several snapshots into a single dataframe.
+    :param snapshot_dates: An optional list of strings of the snapshot dates, e.g. ["17-Mar-24"]. All of the snapshots
+    in the poll data directory (or the archive) are used by default.
+    :param archive: An optional dictionary as returned by open_archive, from which the snapshots are loaded instead of
+    parsing the poll data files.
+    :return: A pandas Dataframe of the polling data, with a "Snapshot date" column and indexed by State Alpha.
+    """
+    if archive is not None:
+        selections = [load_date_range(archive)] if snapshot_dates is None else \
+            [load_date_range(archive, date, date) for date in snapshot_dates]
+        return pd.concat([archive_polls_data(archive, selection) for selection in selections])
+    snapshot_dates = list_poll_snapshots() if snapshot_dates is None else snapshot_dates
+    snapshots = [get_poll_data(date).assign(**{"Snapshot date": pd.to_datetime(date, format="%d-%b-%y")})
+                 for date in snapshot_dates]
+    return pd.concat(snapshots)
+
+
+def forecast_arrays(order, coefficients, error_margin, X):
+    """
+    This function predicts and classifies the results for each row of poll shares.
+    :param order: The order of the polynomial that the coefficients were fit to.
+    :param coefficients: The coefficients of the model as a numpy array of dimensions (p,3).
+    :param error_margin: The error margin of the model, determined from the performance metric evaluated against the
+    test set.
+    :param X: The poll shares as a numpy array of dimensions (n,3), in the order of X_COLUMNS.
+    :return: A dictionary of numpy arrays of length n, containing the winning party, the likelihood rating, the
+    predicted vote shares and the margin, with the shares and margin as percentages.
+    """
+    predictions = normalise_predictions(polynomial_features(X, order) @ coefficients)
+    parties, likelihoods, margins = classify_predictions(predictions, error_margin)
+    return {
+        "Party win": parties,
+        "Likelihood": likelihoods,
+        "pred-D": np.around(100 * predictions[:, 0], 2),
+        "pred-R": np.around(100 * predictions[:, 1], 2),
+        "pred-O": np.around(100 * predictions[:, 2], 2),
+        "margin": np.around(100 * margins, 2)
+    }
+
+
+def forecast_polls(order, coefficients, error_margin, polls_data):
+    """
+    This function predicts and classifies the results for each row of polling data.
+    :param order: The order of the polynomial that the coefficients were fit to.
+    :param coefficients: The coefficients of the model as a numpy array of dimensions (p,3).
+    :param error_margin: The error margin of the model, determined from the performance metric evaluated against the
+    test set.
+    :param polls_data: A pandas Dataframe of polling data containing the X columns.
+    :return: A pandas Dataframe with the same index as polls_data, containing the predicted vote shares, the winning
+    party, the likelihood rating and the margin, with the shares and margin as percentages.
+    """
+    return pd.DataFrame(forecast_arrays(order, coefficients, error_margin, polls_data[X_COLUMNS].to_numpy()),
+                        index=polls_data.index)
+
+
+def batch_forecast(order, coefficients, error_margin, snapshot_dates=None, ensemble=None, level=0.9, archive=None):
+    """
+    This function predicts the results of every state in every poll snapshot with a single matrix product, and
+    classifies each prediction. If a bootstrap ensemble is given, the predictive intervals and out of distribution flags
+    of each prediction are added.
+    :param order: The order of the polynomial that the coefficients were fit to.
+    :param coefficients: The coefficients of the model as a numpy array of dimensions (p,3).
+    :param error_margin: The error margin of the model, determined from the performance metric evaluated against the
+    test set.
+    :param snapshot_dates: An optional list of strings of the snapshot dates. All snapshots are used by default.
+    :param ensemble: An optional dictionary as returned by fit_bootstrap_ensemble.
+    :param level: The probability covered by each predictive interval of the ensemble.
+    :param archive: An optional dictionary as returned by open_archive, from which the snapshots are loaded.
+    :return: A tidy pandas Dataframe with one row per snapshot date and state, containing the predicted vote shares, the
+    winning party, the likelihood rating and the margin, with the shares and margin as percentages, and the columns of
+    ensemble_forecast if an ensemble is given.
+    """
+    with timed_stage("stack_poll_snapshots"):
+        polls_data = stack_poll_snapshots(snapshot_dates, archive)
+    with timed_stage("forecast_polls"):
+        forecasts = forecast_polls(order, coefficients, error_margin, polls_data)
+    if ensemble is not None:
+        with timed_stage("ensemble_forecast"):
+            ensemble_forecasts = ensemble_forecast(ensemble, polls_data, level, seed=20)
+        for column in ENSEMBLE_COLUMNS:
+            forecasts[column] = ensemble_forecasts[column].to_numpy()
+    forecasts = forecasts.reset_index()
+    forecasts.insert(0, "Snapshot date", polls_data["Snapshot date"].to_numpy())
+    return forecasts
+
+
+def batch_script(output_path=None):
+    """
+    This function loads or trains the model once, forecasts every poll snapshot, and writes the forecast history to a
+    csv file.
+    :param output_path: An optional path for the csv file. By default it is written to the data directory.
+    :return: The forecast history as a pandas Dataframe.
+    """
+    output_path = data_tools.DATA_ROOT / "US Election Forecast History.csv" if output_path is None else output_path
+    df = load_data()
+    model = load_or_train_model(df, verbose=False)
+    print(f'Forecast all poll snapshots with the model of order {model["order"]}.')
+    ensemble = fit_data_ensemble(df, model["order"], seed=20)
+    forecasts = batch_forecast(model["order"], model["coefficients"], model["error_margin"], ensemble=ensemble)
+    forecasts.to_csv(output_path, index=False, date_format="%d-%b-%y")
+    print(f'The forecasts for {forecasts["Snapshot date"].nunique()} snapshots were written to: {output_path}')
+    return forecasts
@@ -0,0 +1,157 @@
+import pathlib as pl
+import time
+import numpy as np
+import pandas as pd
+import data_tools
+from data_tools import file_stamp, load_data
+from forecast_tools import forecast_polls
+from script import X_COLUMNS, load_or_train_model
+
+
+def new_ingestion_state(model=None):
+    """
+    This function creates the state kept in memory between poll updates.
+    :param model: An optional model dictionary as returned by train_model. If it is not given, the model is trained
+    when the first polls are ingested.
+    :return: A dictionary containing the model, the stamp of the training data file it was trained on, the latest
+    polling data and its forecasts, and the stamps of the poll files that have been ingested, or that failed to be
+    ingested.
+    """
+    training_path = data_tools.DATA_ROOT / data_tools.TRAINING_DATA_FILE
+    return {
+        "model": model,
+        "training_stamp": None if model is None else file_stamp(training_path),
+        "polls": None,
+        "forecasts": None,
+        "file_stamps": {},
+        "failed_stamps": {}
+    }
+
+
+def refresh_model(state):
+    """
+    This function loads or retrains the model (including the cross-validation) only if the training data file has
+    changed since the model was loaded, or if there is no model yet.
+    :param state: The ingestion state, as created by new_ingestion_state.
+    :return: A boolean for whether the model was replaced.
+    """
+    training_stamp = file_stamp(data_tools.DATA_ROOT / data_tools.TRAINING_DATA_FILE)
+    if state["model"] is not None and state["training_stamp"] == training_stamp:
+        return False
+    state["model"] = load_or_train_model(load_data(), verbose=False)
+    state["training_stamp"] = training_stamp
+    return True
+
+
+def changed_states(previous_polls, polls_data):
+    """
+    This function compares two snapshots of polling data by State Alpha.
+    :param previous_polls: A pandas Dataframe of the previous polling data, or None.
+    :param polls_data: A pandas Dataframe of the new polling data.
+    :return: A tuple of pandas Indexes, for the states that are new or have changed polls, and the states that have been
+    removed.
+    """
+    if previous_polls is None:
+        return polls_data.index, pd.Index([], name=polls_data.index.name)
+    common = polls_data.index.intersection(previous_polls.index)
+    differs = ~np.isclose(polls_data.loc[common, X_COLUMNS].to_numpy(),
+                          previous_polls.loc[common, X_COLUMNS].to_numpy()).all(axis=1)
+    added = polls_data.index.difference(previous_polls.index)
+    return common[differs].append(added), previous_polls.index.difference(polls_data.index)
+
+
+def ingest_polls(state, polls_data):
+    """
+    This function updates the forecasts for a new snapshot of polling data. Only the rows for states whose polls have
+    changed are predicted and classified again, unless the model has been retrained, in which case every row is.
+    :param state: The ingestion state, as created by new_ingestion_state.
+    :param polls_data: A pandas Dataframe of the new polling data, indexed by State Alpha.
+    :return: A pandas Dataframe of the deltas, with a row for each state whose forecast was added, changed or removed,
+    containing the change, the new forecast, and the previous winning party and likelihood rating.
+    """
+    retrained = refresh_model(state)
+    previous_polls, previous_forecasts = state["polls"], state["forecasts"]
+    if retrained:
+        previous_polls = None
+    updated, removed = changed_states(previous_polls, polls_data)
+    model = state["model"]
+    updated_forecasts = forecast_polls(model["order"], model["coefficients"], model["error_margin"],
+                                       polls_data.loc[updated])
+    if previous_forecasts is None:
+        forecasts = updated_forecasts
+        previous_forecasts = updated_forecasts.iloc[:0]
+    else:
+        forecasts = pd.concat([previous_forecasts.drop(index=removed.union(updated), errors="ignore"),
+                               updated_forecasts])
+    state["polls"] = polls_data
+    state["forecasts"] = forecasts.loc[polls_data.index]
+    # Only report the updated rows whose forecast has actually changed
+    previous = previous_forecasts.reindex(updated_forecasts.index)
+    unchanged = (updated_forecasts == previous).all(axis=1)
+    deltas = updated_forecasts[~unchanged].copy()
+    deltas.insert(0, "Change", np.where(previous.loc[deltas.index, "Party win"].isna(), "added", "changed"))
+    deltas["previous Party win"] = previous.loc[deltas.index, "Party win"]
+    deltas["previous Likelihood"] = previous.loc[deltas.index, "Likelihood"]
+    removed_deltas = pd.DataFrame({
+        "Change": "removed",
+        "previous Party win": previous_forecasts.loc[removed, "Party win"],
+        "previous Likelihood": previous_forecasts.loc[removed, "Likelihood"]
+    }, index=removed)
+    return pd.concat([deltas, removed_deltas]) if len(removed) > 0 else deltas
+
+
+def watch_polls(poll_directory=None, interval=1.0, on_deltas=None, max_updates=None, state=None):
+    """
+    This function watches a directory for new or modified poll files, and ingests each one in the order in which they
+    were modified, keeping the model and the latest forecasts in memory between updates. A file that cannot be read or
+    ingested (e.g. one that is still being written) is reported and skipped, and is tried again once it changes.
+    :param poll_directory: An optional path of the directory to watch. The poll data directory is used by default.
+    :param interval: The number of seconds to wait between checks of the directory.
+    :param on_deltas: An optional function called with the path of each ingested file and its deltas. By default the
+    deltas are printed.
+    :param max_updates: An optional integer for the number of files to ingest before returning. By default the
+    directory is watched until interrupted.
+    :param state: An optional ingestion state to continue from, e.g. with a model that has already been trained.
+    :return: The ingestion state.
+    """
+    if poll_directory is None:
+        poll_directory = data_tools.DATA_ROOT / data_tools.POLL_DATA_DIRECTORY
+    if on_deltas is None:
+        def on_deltas(path, deltas):
+            print(f'{path.name}: {len(deltas)} states changed')
+            if len(deltas) > 0:
+                print(deltas)
+    state = new_ingestion_state() if state is None else state
+    n_updates = 0
+    try:
+        while max_updates is None or n_updates < max_updates:
+            stamps = {}
+            for path in pl.Path(poll_directory).glob("*.csv"):
+                try:
+                    stamps[path] = file_stamp(path)
+                except FileNotFoundError:
+                    continue
+            failed_stamps = state.setdefault("failed_stamps", {})
+            new_paths = [path for path, stamp in stamps.items()
+                         if state["file_stamps"].get(path) != stamp and failed_stamps.get(path) != stamp]
+            for path in sorted(new_paths, key=lambda path: stamps[path]):
+                try:
+                    with open(path, 'rb') as polls_file:
+                        polls_data = pd.read_csv(polls_file, index_col=0)
+                    deltas = ingest_polls(state, polls_data)
+                except Exception as error:
+                    # The file is not recorded as ingested, so it is tried again once it has changed
+                    print(f'{path.name}: could not be ingested: {error!r}')
+                    failed_stamps[path] = stamps[path]
+                    continue
+                failed_stamps.pop(path, None)
+                on_deltas(path, deltas)
+                state["file_stamps"][path] = stamps[path]
+                n_updates += 1
+                if max_updates is not None and n_updates >= max_updates:
+                    break
+            else:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return state
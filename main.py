@@ -1,6 +1,29 @@
-from script import script
+import sys
 
 
+# Each command imports its own module, so that starting one does not pay for importing the others
 if __name__ == '__main__':
-    script()
-
+    if sys.argv[1:] == ["batch"]:
+        from forecast_tools import batch_script
+        batch_script()
+    elif sys.argv[1:] == ["watch"]:
+        from ingest_tools import watch_polls
+        watch_polls()
+    elif sys.argv[1:] == ["benchmark"]:
+        from benchmark_tools import run_benchmarks, save_benchmarks
+        print(f'Benchmark results were written to: {save_benchmarks(run_benchmarks())}')
+    elif sys.argv[1:] == ["serve"]:
+        from service_tools import run_service
+        run_service()
+    elif sys.argv[1:] == ["search"]:
+        from search_tools import search_script
+        search_script()
+    elif sys.argv[1:] == ["backtest"]:
+        from backtest_tools import backtest_script
+        backtest_script()
+    elif sys.argv[1:] == ["archive"]:
+        from archive_tools import convert_poll_snapshots
+        print(f'Snapshots appended to the poll archive: {convert_poll_snapshots()}')
+    else:
+        from script import script
+        script()
@@ -17,26 +17,69 @@ def split_n_by_k(n, k):
     return output
 
 
+def as_prediction_matrix(columns):
+    """
+    This function converts predictions or actual y values to a 2-D numpy array with one column per output variable.
+    :param columns: Either a list of numpy arrays (the columns) for each output variable, or a numpy array of
+    dimensions (n_rows, k) which is returned as it is.
+    :return: A numpy array of dimensions (n_rows, k).
+    """
+    if isinstance(columns, np.ndarray):
+        if columns.ndim != 2:
+            raise ValueError("A numpy array of predictions should have dimensions (n_rows, k).")
+        return columns
+    n = len(columns[0])
+    for column in columns:
+        if len(column) != n:
+            raise ValueError("The number of predictions for each output variable must be the same.")
+    return np.column_stack(columns).astype(float, copy=False)
+
+
+def normalise_predictions(predictions, n_shares=3, out=None):
+    """
+    This function rescales each row of predictions so that the vote shares sum to 1.
+    :param predictions: A list of numpy arrays (the columns) or a numpy array of dimensions (n_rows, k).
+    :param n_shares: An integer for the number of leading columns which are vote shares to be rescaled.
+    :param out: An optional float numpy array of dimensions (n_rows, k) to write the rescaled predictions to, which may
+    be predictions itself to rescale them in place.
+    :return: A numpy array of dimensions (n_rows, k) with the rescaled predictions, which is out if it is given and a
+    new array otherwise.
+    """
+    if out is None:
+        out = np.array(as_prediction_matrix(predictions), dtype=float)
+    elif out is not predictions:
+        out[...] = as_prediction_matrix(predictions)
+    out[:, :n_shares] /= out[:, :n_shares].sum(axis=1, keepdims=True)
+    return out
+
+
+def margin_errors(predictions, actual_y):
+    """
+    This function calculates the error on the margin for each row, i.e. (y^_2-y^_1)-(y_2-y_1), where the predictions
+    and actual ys have the columns [y_1, y_2, y_3].
+    :param predictions: A list length-3 of numpy arrays or a numpy array of dimensions (n_rows, 3) of predictions.
+    :param actual_y: A list length-3 of numpy arrays or a numpy array of dimensions (n_rows, 3) of actual y values.
+    :return: A numpy array of length n_rows of the errors on the margin.
+    """
+    predictions = as_prediction_matrix(predictions)
+    actual_y = as_prediction_matrix(actual_y)
+    if len(actual_y) != len(predictions):
+        raise ValueError("The number of predictions must be equal to the number of actual y values for each "
+                         "variable.")
+    return predictions[:, 1] - predictions[:, 0] - actual_y[:, 1] + actual_y[:, 0]
+
+
 def performance_metric(predictions, actual_y):
     """
     This function calculates the performance metric for a set of predictions against the actual y values. The metric is
     equal to the mean of |(y^_2-y^_1)-(y_2-y_1)|, where the predictions and actual ys are in the form [y_1, y_2, y_3].
-    :param predictions: A list length-3 of numpy arrays containing the predictions for y_1, y_2 and y_3.
-    :param actual_y: A list length-3 of numpy arrays containing the actual y values for y_1, y_2 and y_3.
+    :param predictions: A list length-3 of numpy arrays containing the predictions for y_1, y_2 and y_3, or a numpy
+    array of dimensions (n_rows, 3).
+    :param actual_y: A list length-3 of numpy arrays containing the actual y values for y_1, y_2 and y_3, or a numpy
+    array of dimensions (n_rows, 3).
     :return: A float equal to the mean of |(y^_2-y^_1)-(y_2-y_1)|
     """
-    n = len(predictions[0])
-    for i in range(1, 3):
-        if len(predictions[i]) != n:
-            raise ValueError("The number of predictions for each output variable must be the same.")
-    for i in range(3):
-        if len(actual_y[i]) != n:
-            raise ValueError("The number of predictions must be equal to the number of actual y values for each "
-                             "variable.")
-    running_total = 0
-    for i in range(n):
-        running_total += abs(predictions[1][i] - predictions[0][i] - actual_y[1][i] + actual_y[0][i])
-    return running_total / n
+    return np.mean(np.abs(margin_errors(predictions, actual_y)))
 
 
 def rmse(predictions, actual_y):
@@ -44,23 +87,30 @@ def rmse(predictions, actual_y):
     This function calculates the root mean squared error for each column of predictions after comparing to the actual y
     values.
     :param predictions: A list of numpy arrays (the columns) containing the predictions for a number of output y
-    variables.
+    variables, or a numpy array of dimensions (n_rows, k).
     :param actual_y: A list of numpy arrays (the columns) containing the actual values for a number of output y
-    variables.
+    variables, or a numpy array of dimensions (n_rows, k).
     :return: A list of RMSEs calculated for each column.
     """
-    if len(predictions) != len(actual_y):
+    predictions = as_prediction_matrix(predictions)
+    actual_y = as_prediction_matrix(actual_y)
+    if predictions.shape[1] != actual_y.shape[1]:
         raise ValueError("The number of output variables (columns) should be equal for the predictions and actual "
                          "values")
-    n = len(predictions[0])
-    for i in range(1, len(predictions)):
-        if len(predictions[i]) != n:
-            raise ValueError("The number of predictions for each output variable must be the same.")
-    for i in range(len(predictions)):
-        if len(actual_y[i]) != n:
-            raise ValueError("The number of predictions must be equal to the number of actual y values for each "
-                             "variable.")
-    output = [0 for _ in range(len(predictions))]
-    for i in range(len(predictions)):
-        output[i] = np.sqrt(np.mean(np.square(predictions[i] - actual_y[i])))
-    return output
+    if len(actual_y) != len(predictions):
+        raise ValueError("The number of predictions must be equal to the number of actual y values for each "
+                         "variable.")
+    return list(np.sqrt(np.mean(np.square(predictions - actual_y), axis=0)))
+
+
+def prediction_check_counts(predictions, tolerance=0.01):
+    """
+    This function counts the predictions that fail the sanity checks of check_predictions.
+    :param predictions: A list of numpy arrays (the columns) or a numpy array of dimensions (n_rows, k).
+    :param tolerance: The acceptable tolerance for predictions that either are below 0, or sum to more than 1.
+    :return: A tuple of the number of predictions less than 0, and the number of rows that sum to more than 1.
+    """
+    predictions = as_prediction_matrix(predictions)
+    less_than_0_count = int(np.count_nonzero(predictions < -tolerance))
+    sum_more_than_1_count = int(np.count_nonzero(predictions.sum(axis=1) > 1 + tolerance))
+    return less_than_0_count, sum_more_than_1_count
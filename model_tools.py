@@ -1,9 +1,10 @@
-import pandas as pd
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import combinations_with_replacement
 import numpy as np
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.linear_model import LinearRegression
-from sklearn.pipeline import Pipeline
-from data_tools import convert_to_xys
+from math_tools import normalise_predictions, prediction_check_counts
+from timing_tools import timed_stage
 
 
 def fit_model(X, y, order):
@@ -15,13 +16,375 @@ def fit_model(X, y, order):
     :param order: The order of the polynomial that the model is being fit to.
     :return: A scikit-learn regression object that has been fit to the data.
     """
+    # scikit-learn is only needed for this reference model, and is slow to import, so it is imported on first use
+    from sklearn.preprocessing import PolynomialFeatures
+    from sklearn.linear_model import LinearRegression
+    from sklearn.pipeline import Pipeline
     model = Pipeline([('poly', PolynomialFeatures(degree=order)),
                       ('linear', LinearRegression(fit_intercept=False))])
     model = model.fit(X, y)
     return model
 
 
-def cross_validation(folds, X_columns, y_columns, orders, performance_metric_function):
+def polynomial_terms(d, order):
+    """
+    This function lists the terms of the polynomial features, in the same order as the columns of polynomial_features.
+    :param d: An integer for the number of input variables.
+    :param order: The order of the polynomial features.
+    :return: A list of tuples of the input variables multiplied together in each term, e.g. (0, 2) for x_0 * x_2, with
+    an empty tuple for the bias term.
+    """
+    return [combination for degree in range(order + 1)
+            for combination in combinations_with_replacement(range(d), degree)]
+
+
+def polynomial_features(X, order):
+    """
+    This function expands the input variables into polynomial features, with the columns in the same order as the
+    scikit-learn PolynomialFeatures transformer (bias first, then the terms of each degree in turn).
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :param order: The order of the polynomial features.
+    :return: A numpy array of dimensions (n,p), where p is the number of polynomial terms.
+    """
+    X = np.asarray(X, dtype=float)
+    n, d = X.shape
+    terms = polynomial_terms(d, order)
+    features = np.ones((n, len(terms)))
+    for i, combination in enumerate(terms):
+        if len(combination) > 0:
+            # Each term extends a lower degree term that has already been computed
+            features[:, i] = features[:, terms.index(combination[:-1])] * X[:, combination[-1]]
+    return features
+
+
+def fit_coefficients(features, Y, masks=None, rcond=1e-6):
+    """
+    This function solves the least-squares problem for every output variable at once, giving the same (minimum norm)
+    coefficients as the linear step of fit_model. Where masks are given, one problem is solved per mask in a single
+    batched call, with the rows excluded by a mask set to zero so that they do not contribute to that solution. A mask
+    may also contain row counts (e.g. from a bootstrap resample), which is equivalent to repeating each row that many
+    times.
+    :param features: The polynomial features as a numpy array of dimensions (n,p).
+    :param Y: The output variables as a numpy array of dimensions (n,k).
+    :param masks: Optional boolean or integer numpy array of dimensions (b,n), where each row selects (or counts) the
+    training rows of one problem.
+    :param rcond: The cutoff for small singular values, relative to the largest. The default matches the tolerance used
+    by the scikit-learn LinearRegression solver, which matters here since the poll shares sum to 1 and so the
+    polynomial features are rank deficient.
+    :return: A numpy array of coefficients of dimensions (p,k), or (b,p,k) where masks are given.
+    """
+    features = np.asarray(features, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    if masks is None:
+        return np.linalg.pinv(features, rcond=rcond) @ Y
+    masks = np.asarray(masks)
+    if masks.dtype == bool:
+        # Excluded rows have zero columns in the pseudo-inverse, so Y does not need to be masked
+        designs = features[np.newaxis, :, :] * masks[:, :, np.newaxis]  # i.e. (b, n, p)
+        return np.linalg.pinv(designs, rcond=rcond) @ Y
+    # Repeating a row c times is the same as scaling it by the square root of c
+    scales = np.sqrt(masks)[:, :, np.newaxis]
+    return np.linalg.pinv(features[np.newaxis, :, :] * scales, rcond=rcond) @ (Y[np.newaxis, :, :] * scales)
+
+
+def compress_folds(features, Y, fold_ids, n_folds, blocks=None, targets=None):
+    """
+    This function reduces the rows of each fold to a p x p triangular block with a QR decomposition, i.e. the rows X_f
+    and y_f of fold f are replaced by R_f and Q_f^T y_f, where X_f = Q_f R_f. Any least-squares problem over a set of
+    whole folds has the same solution (and singular values) on the blocks as on the rows, so the cost of fitting the
+    folds no longer depends on the number of rows. Blocks from earlier rows can be passed in to be updated with new
+    rows, so that a dataset can be compressed one chunk at a time. If the rows are sorted by fold, the rows of each fold
+    are taken as a slice rather than selected with a mask.
+    :param features: The polynomial features as a numpy array of dimensions (n,p).
+    :param Y: The output variables as a numpy array of dimensions (n,k).
+    :param fold_ids: An integer numpy array of length n, giving the fold to which each row belongs.
+    :param n_folds: An integer for the number of folds.
+    :param blocks: An optional numpy array of dimensions (folds,p,p) of the blocks of earlier rows.
+    :param targets: An optional numpy array of dimensions (folds,p,k) of the targets of earlier rows.
+    :return: A tuple of numpy arrays of dimensions (folds,p,p) and (folds,p,k), with zero rows padding the blocks of
+    folds with fewer than p rows.
+    """
+    n, p = features.shape
+    k = np.shape(Y)[1]
+    if blocks is None:
+        blocks, targets = np.zeros((n_folds, p, p)), np.zeros((n_folds, p, k))
+    else:
+        blocks, targets = blocks.copy(), targets.copy()
+    fold_ids = np.asarray(fold_ids)
+    fold_sizes = np.bincount(fold_ids, minlength=n_folds)
+    is_sorted = np.all(fold_ids[1:] >= fold_ids[:-1])
+    bounds = np.concatenate([[0], np.cumsum(fold_sizes)])
+    for i in range(n_folds):
+        if fold_sizes[i] == 0:
+            continue
+        in_fold = slice(bounds[i], bounds[i + 1]) if is_sorted else fold_ids == i
+        # The earlier rows of the fold are represented exactly by their block. The targets are factorised alongside the
+        # features, since the leading p rows of the R of [X_f y_f] are [R_f Q_f^T y_f], so Q_f is never formed
+        r = np.linalg.qr(np.block([[blocks[i], targets[i]], [features[in_fold], Y[in_fold]]]), mode="r")[:p]
+        blocks[i], targets[i] = 0, 0
+        blocks[i, :len(r)], targets[i, :len(r)] = r[:, :p], r[:, p:]
+    return blocks, targets
+
+
+def solve_held_out_coefficients(blocks, targets, folds=None, rcond=1e-6):
+    """
+    This function fits a model to every combination of training folds from the compressed folds, i.e. the model for
+    fold i is trained on the blocks of every fold other than i, with every held out fold solved in a single batched
+    call.
+    :param blocks: A numpy array of dimensions (folds,p,p) as returned by compress_folds.
+    :param targets: A numpy array of dimensions (folds,p,k) as returned by compress_folds.
+    :param folds: An optional sorted list of the folds to be held out in turn. All folds are held out by default.
+    :param rcond: The cutoff for small singular values, relative to the largest, as in fit_coefficients.
+    :return: A numpy array of coefficients of dimensions (len(folds),p,k).
+    """
+    n_folds, p, k = targets.shape
+    folds = np.arange(n_folds) if folds is None else np.asarray(folds)
+    keep = (np.arange(n_folds)[np.newaxis, :] != folds[:, np.newaxis])[:, :, np.newaxis, np.newaxis]
+    designs = (blocks[np.newaxis] * keep).reshape(len(folds), n_folds * p, p)
+    return np.linalg.pinv(designs, rcond=rcond) @ (targets[np.newaxis] * keep).reshape(len(folds), n_folds * p, k)
+
+
+def map_jobs(function, jobs, executor=None, n_workers=None):
+    """
+    This function maps a function over a list of jobs, either serially or across a pool of processes or threads. The
+    results are returned in the order of the jobs, whichever executor runs them.
+    :param function: A function taking a single job, which must be picklable for a pool of processes.
+    :param jobs: A list of the arguments of each job.
+    :param executor: None to run the jobs serially, or "process" or "thread" for the type of pool to run them across.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :return: A list of the results of the jobs.
+    """
+    if executor not in [None, "process", "thread"]:
+        raise ValueError(f"The executor should be None, \"process\" or \"thread\": {executor}")
+    if executor is None:
+        return list(map(function, jobs))
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    with pool_class(max_workers=n_workers) as pool:
+        return list(pool.map(function, jobs))
+
+
+def _compress_fold_chunk_job(arguments):
+    """
+    This function compresses the rows of a chunk of folds, given as a contiguous slice of the rows sorted by fold, into
+    their blocks as in compress_folds, so that it can be mapped over by an executor.
+    """
+    features, targets, fold_sizes = arguments
+    return compress_folds(features, targets, np.repeat(np.arange(len(fold_sizes)), fold_sizes), len(fold_sizes))
+
+
+def _score_fold_chunk_job(arguments):
+    """
+    This function fits the held out models of a chunk of folds for each order from the blocks of every fold, and then
+    predicts, converts back from the targets, post-processes and scores the rows of the chunk, given as a contiguous
+    slice of the rows sorted by fold, so that it can be mapped over by an executor.
+    :return: A tuple of the predictions of the chunk, of dimensions (folds of the chunk, orders, rows, k), and a list of
+    the scores of each fold of the chunk for each order.
+    """
+    (blocks, targets, folds, n_terms, features, X, evaluations, bounds, from_targets, post_process,
+     performance_metric_function, predictions) = arguments
+    fold_sizes = np.diff(bounds)
+    if predictions is None:
+        predictions = np.empty((len(folds), len(n_terms), fold_sizes.max(), targets.shape[2]))
+    scores = []
+    for j, p in enumerate(n_terms):
+        coefficients = solve_held_out_coefficients(blocks[:, :p, :p], targets[:, :p], folds)
+        scores.append([])
+        for i in range(len(folds)):
+            rows = slice(bounds[i], bounds[i + 1])
+            fold_predictions = predictions[i, j, :fold_sizes[i]]
+            np.matmul(features[rows, :p], coefficients[i], out=fold_predictions)
+            if from_targets is not None:
+                from_targets(fold_predictions, X[rows])
+            if post_process is not None:
+                post_process(fold_predictions)
+            scores[j].append(performance_metric_function(fold_predictions, evaluations[rows]))
+    return predictions, scores
+
+
+def multiplier_targets(Y, X):
+    """
+    This function converts vote shares to the multipliers of the poll shares, i.e. the targets of the models of
+    bespoke_cross_validation. Any y output variables beyond the inputs are multipliers of the last input.
+    :param Y: The output variables as a numpy array of dimensions (n,k).
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :return: A numpy array of the multipliers of dimensions (n,k).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        multipliers = Y / X[:, [min(i, X.shape[1] - 1) for i in range(Y.shape[1])]]
+    if not np.all(np.isfinite(multipliers)):
+        raise ValueError("The multiplier targets need every poll share to be greater than 0.")
+    return multipliers
+
+
+def apply_multipliers(predictions, X):
+    """
+    This function converts predicted multipliers to predicted vote shares in place, by multiplying them by the poll
+    shares, as in bespoke_cross_validation.
+    :param predictions: A numpy array of the predicted multipliers of dimensions (n,k), which is overwritten.
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :return: The predictions array.
+    """
+    predictions *= X[:, [min(i, X.shape[1] - 1) for i in range(predictions.shape[1])]]
+    return predictions
+
+
+def normalise_in_place(predictions):
+    """
+    This function rescales each row of predictions in place so that the vote shares sum to 1.
+    :param predictions: A numpy array of dimensions (n,k), which is overwritten.
+    :return: The predictions array.
+    """
+    return normalise_predictions(predictions, out=predictions)
+
+
+# The target transforms of cross_validation_engine, as pairs of the function from the y output variables to the targets
+# of the models, and the function from the predicted targets back to the y output variables in place
+TARGET_TRANSFORMS = {
+    "shares": (None, None),
+    "multipliers": (multiplier_targets, apply_multipliers)
+}
+
+
+def cross_validation_buffer(fold_ids, n_orders, k):
+    """
+    This function allocates the prediction buffer of cross_validation_engine, which can be passed back to the engine to
+    be reused by any run with folds of the same sizes, e.g. for each assignment of repeated cross-validation.
+    :param fold_ids: An integer numpy array of length n, giving the fold to which each row belongs.
+    :param n_orders: An integer for the number of orders.
+    :param k: An integer for the number of y output variables.
+    :return: An empty numpy array of dimensions (folds, n_orders, rows of the largest fold, k).
+    """
+    fold_sizes = np.bincount(fold_ids)
+    return np.empty((len(fold_sizes), n_orders, fold_sizes.max(), k))
+
+
+def cross_validation_engine(X, Y, fold_ids, orders, performance_metric_function, target_transform="shares",
+                            post_process=None, evaluations=None, buffer=None, executor=None, n_workers=None,
+                            chunk_size=None, features=None):
+    """
+    This function is the cross-validation behind cross_validation, bespoke_cross_validation and
+    bespoke_cross_validation_2. The polynomial features are computed once at the highest order, and the rows are
+    reordered by fold so that each chunk of folds is a contiguous slice. The work is done in two rounds of jobs over the
+    chunks of folds, which are optionally spread across a pool of processes or threads, with each job only receiving the
+    slices of its own chunk:
+    1. The rows of each fold are compressed into p x p blocks at the highest order, as in compress_folds.
+    2. Since the columns of a lower order are the leading columns of a higher order, the blocks of each order are the
+    leading rows and columns of those blocks, from which the models of each held out fold of the chunk are fitted for
+    every order. The rows of each fold are then predicted straight into their part of a single
+    (folds x orders x rows x parties) buffer, and converted back from the targets, post-processed and scored in place.
+    The results are gathered in the order of the folds, so they do not depend on the executor or the number of workers.
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :param Y: The output variables as a numpy array of dimensions (n,k).
+    :param fold_ids: An integer numpy array of length n, giving the fold to which each row belongs.
+    :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values for each fold. A function that takes
+    lists of columns can be adapted with column_metric.
+    :param target_transform: The name of a pair in TARGET_TRANSFORMS, or a pair of functions: one from Y and X to the
+    targets of the models (or None for Y itself), and one that converts predictions of the targets of some rows back to
+    the y output variables in place, given the predictions and X of the rows (or None to leave them).
+    :param post_process: An optional function that adjusts the predictions of some rows in place, e.g.
+    normalise_in_place.
+    :param evaluations: An optional numpy array of dimensions (n,k) of the values against which performance is to be
+    evaluated. By default the predictions are evaluated against Y.
+    :param buffer: An optional numpy array from cross_validation_buffer to write the predictions to. By default a new
+    one is allocated.
+    :param executor: None to run the folds serially, or "process" or "thread" to run them across a pool. The functions
+    and metric must be picklable for a pool of processes, e.g. functions of a module or from column_metric.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param chunk_size: An optional integer for the number of folds in each job. By default every fold is in one job when
+    run serially, and the folds are shared evenly between the workers of a pool.
+    :param features: An optional numpy array of the polynomial features of X at the highest order, e.g. to be reused
+    across repeats of the cross-validation. By default they are computed.
+    :return: A dictionary containing the buffer of predictions, the positions of the rows of each fold in X, the
+    performance of each order on each fold, and the mean performance across the folds for each order.
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    fold_ids = np.asarray(fold_ids)
+    evaluations = Y if evaluations is None else np.asarray(evaluations, dtype=float)
+    to_targets, from_targets = TARGET_TRANSFORMS[target_transform] if isinstance(target_transform, str) \
+        else target_transform
+    targets = Y if to_targets is None else to_targets(Y, X)
+    features = polynomial_features(X, max(orders)) if features is None else features
+    # The rows are reordered by fold once, so that the rows of each fold are a contiguous slice of every array and can
+    # be taken as views rather than copied for each fold and order
+    row_order = np.argsort(fold_ids, kind="stable")
+    fold_sizes = np.bincount(fold_ids)
+    bounds = np.concatenate([[0], np.cumsum(fold_sizes)])
+    fold_rows = [row_order[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+    X, targets, evaluations, features = X[row_order], targets[row_order], evaluations[row_order], features[row_order]
+    n_folds = len(fold_sizes)
+    if chunk_size is None:
+        n_chunks = 1 if executor is None else min(n_folds, n_workers or os.cpu_count() or 1)
+        chunk_size = -(-n_folds // n_chunks)
+    fold_chunks = [np.arange(i, min(i + chunk_size, n_folds)) for i in range(0, n_folds, chunk_size)]
+    chunk_rows = [slice(bounds[folds[0]], bounds[folds[-1] + 1]) for folds in fold_chunks]
+    if buffer is None:
+        buffer = cross_validation_buffer(fold_ids, len(orders), targets.shape[1])
+    elif buffer.shape[:2] != (len(fold_rows), len(orders)) or buffer.shape[2] < fold_sizes.max() or \
+            buffer.shape[3] != targets.shape[1]:
+        raise ValueError("The buffer does not have the dimensions of these folds and orders.")
+    with timed_stage("compress_folds"):
+        compressed = map_jobs(_compress_fold_chunk_job, [(features[rows], targets[rows], fold_sizes[folds])
+                                                         for folds, rows in zip(fold_chunks, chunk_rows)],
+                              executor, n_workers)
+        blocks = np.concatenate([chunk_blocks for chunk_blocks, _ in compressed])
+        block_targets = np.concatenate([chunk_targets for _, chunk_targets in compressed])
+    n_terms = [len(polynomial_terms(X.shape[1], order)) for order in orders]
+    # Jobs in this process write straight into the buffer, while a pool of processes returns copies to be written back
+    jobs = [(blocks, block_targets, folds, n_terms, features[rows], X[rows], evaluations[rows],
+             bounds[folds[0]:folds[-1] + 2] - rows.start, from_targets, post_process, performance_metric_function,
+             None if executor == "process" else buffer[folds[0]:folds[-1] + 1])
+            for folds, rows in zip(fold_chunks, chunk_rows)]
+    scores = [[] for _ in orders]
+    with timed_stage("fold_scores"):
+        for folds, (predictions, chunk_scores) in zip(fold_chunks, map_jobs(_score_fold_chunk_job, jobs, executor,
+                                                                              n_workers)):
+            if executor == "process":
+                buffer[folds[0]:folds[-1] + 1, :, :predictions.shape[2]] = predictions
+            for j in range(len(orders)):
+                scores[j].extend(chunk_scores[j])
+    return {
+        "predictions": buffer,
+        "fold_rows": fold_rows,
+        "scores": scores,
+        "mean": {order: np.mean(scores[j], axis=0) for j, order in enumerate(orders)}
+    }
+
+
+def _column_metric(performance_metric_function, predictions, actual_y):
+    """
+    This function calls a performance metric function with the columns of the predictions and actual values.
+    """
+    return performance_metric_function(list(predictions.T), list(actual_y.T))
+
+
+def column_metric(performance_metric_function):
+    """
+    This function adapts a performance metric function that is called with lists of numpy arrays (the columns), as in
+    cross_validation, to the numpy arrays of dimensions (n_rows, k) that cross_validation_engine passes.
+    :param performance_metric_function: A function of a list of the columns of the predictions and a list of the
+    columns of the actual values.
+    :return: A function of numpy arrays of dimensions (n_rows, k) of the predictions and actual values, which can be
+    pickled if performance_metric_function can.
+    """
+    return partial(_column_metric, performance_metric_function)
+
+
+def stack_folds(folds, columns):
+    """
+    This function stacks a list of fold dataframes into a single numpy array, along with the fold of each row.
+    :param folds: A list of dataframes which represent the k folds in the dataset.
+    :param columns: The columns in the dataframes to be stacked.
+    :return: A tuple of a numpy array of dimensions (n,len(columns)) and an integer numpy array of length n.
+    """
+    values = np.concatenate([fold[columns].to_numpy(dtype=float) for fold in folds])
+    fold_ids = np.repeat(np.arange(len(folds)), [len(fold) for fold in folds])
+    return values, fold_ids
+
+
+def cross_validation(folds, X_columns, y_columns, orders, performance_metric_function, executor=None, n_workers=None,
+                     chunk_size=None):
     """
     This function that runs cross-validation on k-folds, where k is the length of the folds list, and then returns the
     mean values of the performance metric for each model.
@@ -29,44 +392,24 @@ def cross_validation(folds, X_columns, y_columns, orders, performance_metric_fun
     :param X_columns: The columns in the dataframes that represent the X input variables.
     :param y_columns: The columns in the dataframes that represent the y output variables.
     :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
-    :param performance_metric_function: A function from which the performance is to be measured.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    a list of numpy arrays (the columns) of the predictions and a list of the actual values for each fold.
+    :param executor: None to run the folds serially, or "process" or "thread" to run them across a pool. The functions
+    and metric must be picklable for a pool of processes, e.g. functions of a module or from column_metric.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param chunk_size: An optional integer for the number of folds in each job. By default every fold is in one job when
+    run serially, and the folds are shared evenly between the workers of a pool.
     :return: A dictionary containing the mean values across the folds of the data of the performance metric, for each
     order of model.
     """
-    performances = {order: [] for order in orders}
-    for i, fold in enumerate(folds):
-        # Given the selected fold, create the training and validation sets, and separate into X,y numpy arrays
-        validation_set = fold
-        validation_xys = convert_to_xys(validation_set, X_columns, y_columns)
-        training_folds = [folds[j] for j in range(len(folds)) if j != i]
-        training_set = pd.concat(training_folds)
-        training_xys = convert_to_xys(training_set, X_columns, y_columns)
-        for order in orders:
-            # Iterate for each model
-            predictions_list = [0 for _ in range(len(training_xys))]  # i.e. [0, 0, 0]
-            list_y_validate = [0 for _ in range(len(validation_xys))]  # i.e. [0, 0, 0]
-            for j in range(len(training_xys)):  # also equal to the len of y_columns (i.e. 3)
-                # Create, train and predict from the model for each y output variable
-                X_train, y_train = training_xys[j]
-                X_validate, y_validate = validation_xys[j]
-                list_y_validate[j] = y_validate
-                model = fit_model(X_train, y_train, order)
-                predictions_list[j] = model.predict(X_validate)  # an array of predictions for X in validation set
-            # Perform checks on predictions, and evaluate performance
-            """
-            if check_predictions(predictions_list):
-                print(f'The predictions from order {order} passed the checks.')
-            else:
-                print(f'The predictions from order {order} failed the checks.')
-            """
-            performances[order].append(performance_metric_function(predictions_list, list_y_validate))
-    average_performances = {}
-    for order, performance_list in performances.items():
-        average_performances[order] = np.mean(performance_list, axis=0)
-    return average_performances
-
-
-def bespoke_cross_validation(folds, X_columns, y_columns, evaluation_columns, orders, performance_metric_function):
+    X, fold_ids = stack_folds(folds, X_columns)
+    Y, _ = stack_folds(folds, y_columns)
+    return cross_validation_engine(X, Y, fold_ids, orders, column_metric(performance_metric_function),
+                                   executor=executor, n_workers=n_workers, chunk_size=chunk_size)["mean"]
+
+
+def bespoke_cross_validation(folds, X_columns, y_columns, evaluation_columns, orders, performance_metric_function,
+                             executor=None, n_workers=None, chunk_size=None):
     """
     This function runs cross validation across k folds for the various models, with predictions being adjusted before
     being assessed. The models predict the multiplier adjusters to be applied to the input variables in order to obtain
@@ -77,48 +420,27 @@ def bespoke_cross_validation(folds, X_columns, y_columns, evaluation_columns, or
     :param evaluation_columns: The columns in the dataframes that contain the values against which performance is to be
     evaluated.
     :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
-    :param performance_metric_function: A function from which the performance is to be measured.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    a list of numpy arrays (the columns) of the predictions and a list of the actual values for each fold.
+    :param executor: None to run the folds serially, or "process" or "thread" to run them across a pool. The functions
+    and metric must be picklable for a pool of processes, e.g. functions of a module or from column_metric.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param chunk_size: An optional integer for the number of folds in each job. By default every fold is in one job when
+    run serially, and the folds are shared evenly between the workers of a pool.
     :return: A dictionary containing the mean values across the folds of the data of the performance metric, for each
     order of model.
     """
-    performances = {order: [] for order in orders}
-    input_columns = X_columns + [X_columns[-1]]
-    for i, fold in enumerate(folds):
-        # Given the selected fold, create the training and validation sets, and separate into X,y numpy arrays
-        validation_set = fold
-        validation_xys = convert_to_xys(validation_set, X_columns, y_columns)
-        training_folds = [folds[j] for j in range(len(folds)) if j != i]
-        training_set = pd.concat(training_folds)
-        training_xys = convert_to_xys(training_set, X_columns, y_columns)
-        for order in orders:
-            # Iterate for each model
-            predictions_list = [np.zeros(1) for _ in range(len(training_xys))]  # i.e. [[0], [0], [0], [0]]
-            list_y_validate = [0 for _ in range(len(validation_xys))]  # i.e. [0, 0, 0, 0]
-            for j in range(len(training_xys)):  # also equal to the len of y_columns (i.e. 4)
-                # Create, train and predict from the model for each y output variable
-                X_train, y_train = training_xys[j]
-                X_validate, y_validate = validation_xys[j]
-                list_y_validate[j] = validation_set[evaluation_columns[j]].to_numpy()
-                model = fit_model(X_train, y_train, order)
-                predictions = model.predict(X_validate)  # an array of predictions for X in validation set
-                predictions_list[j] = predictions * validation_set[input_columns[j]].to_numpy()
-            # Adjust the predictions and evaluate performance over the fold for the model
-            for k in range(len(predictions_list[0])):
-                # sum_preds = predictions_list[0][k] + predictions_list[1][k] + predictions_list[2][k] + \
-                #             predictions_list[3][k]
-                sum_preds = predictions_list[0][k] + predictions_list[1][k] + predictions_list[2][k]
-                predictions_list[0][k] /= sum_preds
-                predictions_list[1][k] /= sum_preds
-                predictions_list[2][k] /= sum_preds
-                # predictions_list[3][k] /= sum_preds
-            performances[order].append(performance_metric_function(predictions_list, list_y_validate))
-    average_performances = {}
-    for order, performance_list in performances.items():
-        average_performances[order] = np.mean(performance_list, axis=0)
-    return average_performances
-
-
-def bespoke_cross_validation_2(folds, X_columns, y_columns, orders, performance_metric_function):
+    X, fold_ids = stack_folds(folds, X_columns)
+    Y, _ = stack_folds(folds, y_columns)
+    evaluations, _ = stack_folds(folds, evaluation_columns[:len(y_columns)])
+    # The y columns are already the multipliers, so only the predictions are transformed
+    return cross_validation_engine(X, Y, fold_ids, orders, column_metric(performance_metric_function),
+                                   (None, apply_multipliers), normalise_in_place, evaluations, executor=executor,
+                                   n_workers=n_workers, chunk_size=chunk_size)["mean"]
+
+
+def bespoke_cross_validation_2(folds, X_columns, y_columns, orders, performance_metric_function, executor=None,
+                               n_workers=None, chunk_size=None):
     """
     This function runs cross validation across k folds for the various models, with predictions being adjusted before
     being assessed. The models predict the  vote share %s, which in turn need to be adjusted so that the sum of vote
@@ -127,40 +449,21 @@ def bespoke_cross_validation_2(folds, X_columns, y_columns, orders, performance_
     :param X_columns: The columns in the dataframes that represent the X input variables.
     :param y_columns: The columns in the dataframes that represent the y output variables.
     :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
-    :param performance_metric_function: A function from which the performance is to be measured.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    a list of numpy arrays (the columns) of the predictions and a list of the actual values for each fold.
+    :param executor: None to run the folds serially, or "process" or "thread" to run them across a pool. The functions
+    and metric must be picklable for a pool of processes, e.g. functions of a module or from column_metric.
+    :param n_workers: An optional integer for the number of workers in the pool.
+    :param chunk_size: An optional integer for the number of folds in each job. By default every fold is in one job when
+    run serially, and the folds are shared evenly between the workers of a pool.
     :return: A dictionary containing the mean values across the folds of the data of the performance metric, for each
     order of model.
     """
-    performances = {order: [] for order in orders}
-    for i, fold in enumerate(folds):
-        # Given the selected fold, create the training and validation sets, and separate into X,y numpy arrays
-        validation_set = fold
-        validation_xys = convert_to_xys(validation_set, X_columns, y_columns)
-        training_folds = [folds[j] for j in range(len(folds)) if j != i]
-        training_set = pd.concat(training_folds)
-        training_xys = convert_to_xys(training_set, X_columns, y_columns)
-        for order in orders:
-            # Iterate for each model
-            predictions_list = [np.zeros(1) for _ in range(len(training_xys))]  # i.e. [[0], [0], [0]]
-            list_y_validate = [0 for _ in range(len(validation_xys))]  # i.e. [0, 0, 0]
-            for j in range(len(training_xys)):  # also equal to the len of y_columns (i.e. 3)
-                # Create, train and predict from the model for each y output variable
-                X_train, y_train = training_xys[j]
-                X_validate, y_validate = validation_xys[j]
-                list_y_validate[j] = validation_set[y_columns[j]].to_numpy()
-                model = fit_model(X_train, y_train, order)
-                predictions_list[j] = model.predict(X_validate)  # an array of predictions for X in validation set
-            # Adjust the predictions and evaluate performance over the fold for the model
-            for k in range(len(predictions_list[0])):  # i.e. range(3)
-                sum_preds = predictions_list[0][k] + predictions_list[1][k] + predictions_list[2][k]
-                predictions_list[0][k] /= sum_preds
-                predictions_list[1][k] /= sum_preds
-                predictions_list[2][k] /= sum_preds
-            performances[order].append(performance_metric_function(predictions_list, list_y_validate))
-    average_performances = {}
-    for order, performance_list in performances.items():
-        average_performances[order] = np.mean(performance_list, axis=0)
-    return average_performances
+    X, fold_ids = stack_folds(folds, X_columns)
+    Y, _ = stack_folds(folds, y_columns)
+    return cross_validation_engine(X, Y, fold_ids, orders, column_metric(performance_metric_function),
+                                   post_process=normalise_in_place, executor=executor, n_workers=n_workers,
+                                   chunk_size=chunk_size)["mean"]
 
 
 def check_predictions(predictions_list, tolerance=0.01):
@@ -174,17 +477,8 @@ def check_predictions(predictions_list, tolerance=0.01):
     for i in range(1, len(predictions_list)):
         if len(predictions_list[i]) != len(predictions_list[0]):
             print("The predictions should be of equal length")
-            checks = False
-    less_than_0_count = 0
-    sum_more_than_1_count = 0
-    for j in range(len(predictions_list[0])):
-        sum_prediction = 0
-        for i in range(len(predictions_list)):
-            if predictions_list[i][j] < -tolerance:
-                less_than_0_count += 1
-            sum_prediction += predictions_list[i][j]
-        if sum_prediction > 1 + tolerance:
-            sum_more_than_1_count += 1
+            return False
+    less_than_0_count, sum_more_than_1_count = prediction_check_counts(predictions_list, tolerance)
     if less_than_0_count > 0:
         print(f"Some predictions had values of less than 0: {less_than_0_count} instances")
         checks = False
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import pathlib as pl
+import numpy as np
+import pandas as pd
+import data_tools
+from model_tools import polynomial_terms
+
+
+MODEL_FORMAT_VERSION = 2
+MODEL_REGISTRY_DIRECTORY = ".model_registry"
+
+
+def model_fingerprint(df, X_columns, y_columns, **training_options):
+    """
+    This function hashes everything that determines a trained model: the training data, the X and y columns, and the
+    options passed to train_model (e.g. the orders, number of folds and seeds).
+    :param df: The training data as a Pandas dataframe.
+    :param X_columns: A list of the column names of the X input variables.
+    :param y_columns: A list of the column names of the y output variables.
+    :param training_options: The keyword arguments used to train the model.
+    :return: A string of the hexadecimal SHA-256 hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    configuration = {
+        "format_version": MODEL_FORMAT_VERSION,
+        "columns": list(df.columns),
+        "X_columns": list(X_columns),
+        "y_columns": list(y_columns),
+        "training_options": training_options
+    }
+    digest.update(json.dumps(configuration, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def model_path(fingerprint, registry_directory=None):
+    """
+    This function gives the path of the file of the model with the given fingerprint.
+    :param fingerprint: A string of the fingerprint of the model, as returned by model_fingerprint.
+    :param registry_directory: An optional path of the directory of saved models. By default this is a directory within
+    the data directory.
+    :return: A pathlib Path of the model file.
+    """
+    if registry_directory is None:
+        registry_directory = data_tools.DATA_ROOT / MODEL_REGISTRY_DIRECTORY
+    return pl.Path(registry_directory) / f"model-{fingerprint[:32]}.npz"
+
+
+def save_model(model, fingerprint, X_columns, y_columns, registry_directory=None):
+    """
+    This function saves a trained model to a compact, versioned .npz file in the registry.
+    :param model: A model dictionary as returned by train_model.
+    :param fingerprint: A string of the fingerprint of the model, as returned by model_fingerprint.
+    :param X_columns: A list of the column names of the X input variables.
+    :param y_columns: A list of the column names of the y output variables.
+    :param registry_directory: An optional path of the directory of saved models.
+    :return: A pathlib Path of the saved model file.
+    """
+    path = model_path(fingerprint, registry_directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # The layout of the features is saved as the names of the columns multiplied together in each term
+    feature_terms = ["*".join(X_columns[i] for i in term) or "1"
+                     for term in polynomial_terms(len(X_columns), model["order"])]
+    with open(path, 'wb') as model_file:
+        np.savez(model_file,
+                 format_version=MODEL_FORMAT_VERSION,
+                 fingerprint=fingerprint,
+                 order=model["order"],
+                 coefficients=model["coefficients"],
+                 feature_terms=np.array(feature_terms),
+                 X_columns=np.array(X_columns),
+                 y_columns=np.array(y_columns),
+                 error_margin=model["error_margin"],
+                 cv_residuals=model["cv_residuals"],
+                 test_residuals=model["test_residuals"])
+    return path
+
+
+def load_model(fingerprint, registry_directory=None):
+    """
+    This function loads a trained model from the registry.
+    :param fingerprint: A string of the fingerprint of the model, as returned by model_fingerprint.
+    :param registry_directory: An optional path of the directory of saved models.
+    :return: A model dictionary in the same form as returned by train_model, or None if there is no saved model with the
+    fingerprint in the current format.
+    """
+    path = model_path(fingerprint, registry_directory)
+    try:
+        with np.load(path) as model_file:
+            if int(model_file["format_version"]) != MODEL_FORMAT_VERSION or \
+                    str(model_file["fingerprint"]) != fingerprint:
+                return None
+            return {
+                "order": int(model_file["order"]),
+                "coefficients": model_file["coefficients"],
+                "error_margin": float(model_file["error_margin"]),
+                "cv_residuals": model_file["cv_residuals"],
+                "test_residuals": model_file["test_residuals"]
+            }
+    except (OSError, KeyError, ValueError):
+        return None
@@ -1,93 +1,132 @@
+import inspect
 import pandas as pd
 import numpy as np
-from model_tools import fit_model, cross_validation, bespoke_cross_validation_2
-from data_tools import data, get_poll_data, split_dataframe, k_folds, convert_to_xys
-from math_tools import performance_metric, rmse
+from model_tools import polynomial_features, fit_coefficients
+from data_tools import ColumnarDataset, load_data, get_poll_data, split_indices
+from math_tools import performance_metric, rmse, normalise_predictions
+from registry_tools import model_fingerprint, load_model, save_model
+from selection_tools import repeated_cross_validation, cross_validation_residuals
+from simulation_tools import ELECTORAL_VOTES, PARTIES, simulate_electoral_college
+from timing_tools import timed_stage
 
 
-def classify_predictions(predictions_list, error_margin):
+LIKELIHOOD_RATINGS = ["Tilt", "Lean", "Likely", "Safe"]
+# The margins, as multiples of the error margin, at which each likelihood rating after Tilt begins
+LIKELIHOOD_BANDS = [1, 2, 4]
+
+
+def classify_predictions(predictions_list, error_margin, parties=None, bands=None, ratings=None, output="labels"):
     """
-    This function takes a list of numpy arrays containing the predictions output from a model, and determines which
-    party wins each row (state), and classifies the likelihood rating based on the error_margin.
-    :param predictions_list: A list of numpy arrays containing the predictions output from a model.
+    This function takes the predictions output from a model, and determines which party wins each row (state), and
+    classifies the likelihood rating based on the error_margin. The margin of each row is the difference between the
+    shares of the winning party and the runner-up, and a row with a tie for the largest share has no winner and a
+    margin of 0.
+    :param predictions_list: A list of numpy arrays containing the predictions for each party, or a numpy array with
+    the parties along the last axis, e.g. of dimensions (n_rows, n_parties) or (n_draws, n_rows, n_parties).
     :param error_margin: The error margin of the model, determined from the performance metric evaluated against the
     test set.
+    :param parties: An optional list of the names of the parties, by default D, R and Other.
+    :param bands: An optional increasing list of the margins, as multiples of error_margin, at which each rating after
+    the first begins, by default LIKELIHOOD_BANDS.
+    :param ratings: An optional list of the names of the ratings, one longer than bands, by default LIKELIHOOD_RATINGS.
+    :param output: A string for the form of the parties and ratings: "labels" for numpy arrays of strings (with "Tie"
+    for a tie), "codes" for integer numpy arrays of the positions in parties and ratings (with -1 for a tie), or
+    "categorical" for pandas Categoricals of the flattened rows (with a missing value for a tie), along with the
+    flattened margins.
     :return: A tuple of numpy arrays for the list of parties winning each row, the list of likelihood ratings, and the
     margins for each row
     """
-    n = len(predictions_list[0])  # number of rows
-    parties = np.array(["A" for _ in range(n)])
-    likelihoods = np.array(["AAAAAA" for _ in range(n)])
-    margins = np.zeros(n)
-    for i in range(n):
-        D_opposition = max(predictions_list[1][i], predictions_list[2][i])
-        R_opposition = max(predictions_list[0][i], predictions_list[2][i])
-        Other_opposition = max(predictions_list[0][i], predictions_list[1][i])
-        margin = 0
-        if predictions_list[0][i] > D_opposition:  # Democrat win
-            parties[i] = "D"
-            margin = predictions_list[0][i] - D_opposition
-        elif predictions_list[1][i] > R_opposition:  # Republican win
-            parties[i] = "R"
-            margin = predictions_list[1][i] - R_opposition
-        elif predictions_list[2][i] > Other_opposition:  # Other win
-            parties[i] = "Other"
-            margin = predictions_list[2][i] - Other_opposition
-        margins[i] = margin
-        if margin < error_margin:
-            likelihoods[i] = "Tilt"
-        elif margin < 2 * error_margin:
-            likelihoods[i] = "Lean"
-        elif margin < 4 * error_margin:
-            likelihoods[i] = "Likely"
-        else:
-            likelihoods[i] = "Safe"
-    return parties, likelihoods, margins
+    if isinstance(predictions_list, np.ndarray):
+        predictions = predictions_list
+    else:
+        predictions = np.stack([np.asarray(predictions) for predictions in predictions_list], axis=-1)
+    parties = PARTIES if parties is None else parties
+    bands = LIKELIHOOD_BANDS if bands is None else bands
+    ratings = LIKELIHOOD_RATINGS if ratings is None else ratings
+    if predictions.shape[-1] != len(parties):
+        raise ValueError("There must be one column of predictions for each party.")
+    if len(ratings) != len(bands) + 1:
+        raise ValueError("There must be one more rating than there are bands.")
+    if np.any(np.diff(bands) <= 0):
+        raise ValueError("The bands must be increasing.")
+    if predictions.shape[-1] > 1:
+        # The two largest shares of each row, in increasing order
+        top_two = np.partition(predictions, -2, axis=-1)[..., -2:]
+        margins = top_two[..., 1] - top_two[..., 0]
+    else:
+        margins = predictions[..., 0].astype(float)
+    party_codes = np.where(margins > 0, np.argmax(predictions, axis=-1), -1)
+    # A margin equal to a band boundary is given the rating of the band it begins
+    rating_codes = np.searchsorted(error_margin * np.asarray(bands, dtype=float), margins, side="right")
+    if output == "codes":
+        return party_codes, rating_codes, margins
+    if output == "categorical":
+        return (pd.Categorical.from_codes(party_codes.ravel(), parties),
+                pd.Categorical.from_codes(rating_codes.ravel(), ratings, ordered=True), margins.ravel())
+    if output != "labels":
+        raise ValueError('The output must be one of "labels", "codes" or "categorical".')
+    return np.append(np.asarray(parties), "Tie")[party_codes], np.asarray(ratings)[rating_codes], margins
 
 
-def script():
+X_COLUMNS = ["Poll-D", "Poll-R", "Poll-Other"]
+Y_COLUMNS = ['Result-D', 'Result-R', 'Result-Other']
+MODEL_NAMES = ["Democrat", "Republican", "Other"]
+DEFAULT_ORDERS = [0, 1, 2, 3, 4]
+DEFAULT_SEEDS = list(range(20))
+
+
+def train_model(df, verbose=True, orders=None, n_folds=20, seeds=None, random_state=20):
+    """
+    This function selects the polynomial order of the model by cross-validation on 70% of the data, evaluates the error
+    margin of the chosen model against the other 30%, and then fits the chosen model to all of the data.
+    :param df: The training data as a Pandas dataframe, e.g. from load_data().
+    :param verbose: A boolean for whether to print out the progress and results of each step.
+    :param orders: An optional list of integers for the polynomial orders to be considered, by default DEFAULT_ORDERS.
+    :param n_folds: An integer for the number of folds in the cross-validation.
+    :param seeds: An optional list of integer seeds for the repeats of the cross-validation, by default DEFAULT_SEEDS.
+    :param random_state: An integer seed for the split into training and test data, so that the same data always gives
+    the same model, or None for a random split.
+    :return: A dictionary containing the order, the coefficients fit to all of the data as a numpy array of dimensions
+    (p,3), the error margin, and the errors on the Republican margin for the cross-validation of the chosen order and
+    for the test set.
+    """
+    log = print if verbose else lambda *args: None
     # SET UP TRAINING AND TEST DATA
-    df = data.copy()
-    train_data, test_data = split_dataframe(df, [0.7, 0.3])  # 70% into training, 30% into testing
-    X_columns = ["Poll-D", "Poll-R", "Poll-Other"]
-    y_columns = ['Result-D', 'Result-R', 'Result-Other']
+    # The columns are pulled out of the dataframe once, and the training and test sets are subsets of the rows
+    dataset = ColumnarDataset.from_dataframe(df, X_COLUMNS, Y_COLUMNS)
+    with timed_stage("split_dataframe"):
+        train_rows, test_rows = split_indices(len(df), [0.7, 0.3], random_state)  # 70% training, 30% testing
+        train_data, test_data = dataset.subset(train_rows), dataset.subset(test_rows)
+    X_train, Y_train = train_data.X, train_data.Y
     # CROSS-VALIDATION OF MODELS
-    train_folds = k_folds(train_data, 20)  # Consider 20 folds of the training data
-    orders = [i for i in range(5)]
-    print("Perform cross-validation across 20 folds of the training data.")
-    performances = bespoke_cross_validation_2(train_folds, X_columns, y_columns, orders, performance_metric)
-    optimal_performance = 100  # dummy number, trying to minimise
-    optimal_order = -1  # dummy number, refers to the model order
-    for order, performance in performances.items():
-        print(f'The performance for the model of order {order} was: {performance}')
-        if performance < optimal_performance:
-            optimal_performance = performance
-            optimal_order = order
-    print(f'Best performing model is of order {optimal_order}.')
+    orders = DEFAULT_ORDERS if orders is None else orders
+    seeds = DEFAULT_SEEDS if seeds is None else seeds
+    log(f"Perform cross-validation across {n_folds} folds of the training data, repeated for {len(seeds)} assignments "
+        f"of the folds.")
+    with timed_stage("cross_validation"):
+        selection = repeated_cross_validation(X_train, Y_train, orders, n_folds, seeds)
+    for order in orders:
+        log(f'The performance for the model of order {order} was: {selection["mean"][order]} '
+            f'(standard deviation across repeats: {selection["std"][order]})')
+    optimal_order = selection["selected_order"]
+    log(f'Best performing model is of order {optimal_order}.')
+    # The held out errors of the chosen order, from the first assignment of the folds, for the simulation
+    with timed_stage("cross_validation_residuals"):
+        cv_residuals = cross_validation_residuals(X_train, Y_train, optimal_order, n_folds, seeds[0])
     # TEST THE BEST MODEL
-    print("Evaluate performance of chosen model against the test set.")
-    training_xys = convert_to_xys(train_data, X_columns, y_columns)
-    test_xys = convert_to_xys(test_data, X_columns, y_columns)
-    result_D_array = test_data['Result-D'].to_numpy()
-    result_R_array = test_data['Result-R'].to_numpy()
-    result_O_array = test_data['Result-Other'].to_numpy()
-    results_list = [result_D_array, result_R_array, result_O_array]
-    predictions_list = [np.zeros(len(result_D_array)) for _ in range(len(training_xys))]
-    model_names = ["Democrat", "Republican", "Other"]
-    for i in range(len(training_xys)):  # i.e. range(3)
-        print(f'Model: {model_names[i]}')
-        X_train, y_train = training_xys[i]
-        X_test, y_test = test_xys[i]
-        model = fit_model(X_train, y_train, order=optimal_order)
-        print(f'Coefficients: {model.named_steps["linear"].coef_}')
-        print(f'Intercept: {model.named_steps["linear"].intercept_}')
-        predictions_list[i] = model.predict(X_test)
+    log("Evaluate performance of chosen model against the test set.")
+    X_test, Y_test = test_data.X, test_data.Y
+    results_list = list(Y_test.T)
+    result_D_array, result_R_array, result_O_array = results_list
+    # Fit the models for all parties at once, with one column of coefficients per party
+    with timed_stage("fit_model"):
+        coefficients = fit_coefficients(polynomial_features(X_train, optimal_order), Y_train)
+    for i in range(len(Y_COLUMNS)):  # i.e. range(3)
+        log(f'Model: {MODEL_NAMES[i]}')
+        log(f'Coefficients: {coefficients[:, i]}')
+    predictions_list = list((polynomial_features(X_test, optimal_order) @ coefficients).T)
     # Rescale predictions to sum to 1
-    for i in range(len(predictions_list[0])):
-        sum_preds = predictions_list[0][i] + predictions_list[1][i] + predictions_list[2][i]
-        predictions_list[0][i] /= sum_preds
-        predictions_list[1][i] /= sum_preds
-        predictions_list[2][i] /= sum_preds
+    predictions_list = list(normalise_predictions(predictions_list).T)
     df_predictions = pd.DataFrame({
         'pred-D': predictions_list[0],
         'pred-R': predictions_list[1],
@@ -97,33 +136,113 @@ def script():
         'Result-Other': result_O_array
     })
     pd.set_option('display.max_columns', None)
-    print(df_predictions)
-    print(rmse(predictions_list, results_list))
+    log(df_predictions)
+    log(rmse(predictions_list, results_list))
     error_margin = performance_metric(predictions_list, results_list)
-    print(error_margin)
+    log(error_margin)
+    test_residuals = predictions_list[1] - predictions_list[0] - result_R_array + result_D_array
+    # FIT THE BEST MODEL TO ALL OF THE DATA
+    with timed_stage("fit_model"):
+        coefficients = fit_coefficients(polynomial_features(dataset.X, optimal_order), dataset.Y)
+    for i in range(len(Y_COLUMNS)):
+        log(f'Model: {MODEL_NAMES[i]}')
+        log(f'Coefficients: {coefficients[:, i]}')
+    return {
+        "order": optimal_order,
+        "coefficients": coefficients,
+        "error_margin": error_margin,
+        "cv_residuals": cv_residuals,
+        "test_residuals": test_residuals
+    }
+
+
+def resolve_training_options(**training_options):
+    """
+    This function fills in every argument of train_model that was not given with its default, so that the fingerprint
+    of a model changes whenever the defaults do.
+    :param training_options: Any of the orders, n_folds, seeds and random_state arguments of train_model.
+    :return: A dictionary of the orders, n_folds, seeds and random_state used to train the model.
+    """
+    arguments = inspect.signature(train_model).bind(None, **training_options)
+    arguments.apply_defaults()
+    options = {name: value for name, value in arguments.arguments.items() if name not in ["df", "verbose"]}
+    options["orders"] = DEFAULT_ORDERS if options["orders"] is None else list(options["orders"])
+    options["seeds"] = DEFAULT_SEEDS if options["seeds"] is None else list(options["seeds"])
+    return options
+
+
+def load_or_train_model(df, verbose=True, registry_directory=None, **training_options):
+    """
+    This function loads the model for the training data and options from the model registry, and only trains (and
+    saves) the model if there is no saved model with the same fingerprint. A model trained with a random split
+    (random_state=None) is never saved or loaded, since it cannot be reproduced.
+    :param df: The training data as a Pandas dataframe, e.g. from load_data().
+    :param verbose: A boolean for whether to print out the progress and results of each step.
+    :param registry_directory: An optional path of the directory of saved models.
+    :param training_options: Any of the orders, n_folds, seeds and random_state arguments of train_model.
+    :return: A model dictionary as returned by train_model.
+    """
+    training_options = resolve_training_options(**training_options)
+    if training_options["random_state"] is None:
+        return train_model(df, verbose, **training_options)
+    fingerprint = model_fingerprint(df, X_COLUMNS, Y_COLUMNS, **training_options)
+    model = load_model(fingerprint, registry_directory)
+    if model is not None:
+        if verbose:
+            print(f'Loaded the model of order {model["order"]} from the registry, with an error margin of '
+                  f'{model["error_margin"]}.')
+        return model
+    model = train_model(df, verbose, **training_options)
+    save_model(model, fingerprint, X_COLUMNS, Y_COLUMNS, registry_directory)
+    return model
+
+
+def latest_result_winners(df, states):
+    """
+    This function finds the winner of the most recent result of each state in the data, e.g. for the states with no
+    polls, whose electoral votes are then allocated to that party in the simulation of the electoral college.
+    :param df: The data as a Pandas dataframe indexed by State Alpha and Year, e.g. from load_data().
+    :param states: A list of state codes.
+    :return: A dictionary of each state code to the party ("D", "R" or "Other") with the largest share of the vote in
+    its most recent result.
+    """
+    latest_results = df[Y_COLUMNS].sort_index(level="Year").groupby(level="State Alpha").last()
+    missing = [state for state in states if state not in latest_results.index]
+    if missing:
+        raise ValueError(f"States missing from the results: {missing}")
+    winners = np.argmax(latest_results.loc[states].to_numpy(), axis=1)
+    return {state: PARTIES[winner] for state, winner in zip(states, winners)}
+
+
+def script():
+    df = load_data()
+    with timed_stage("load_or_train_model"):
+        model = load_or_train_model(df)
+    optimal_order, coefficients, error_margin = model["order"], model["coefficients"], model["error_margin"]
     # MAKE PREDICTIONS ON CURRENT POLLING DATA
     print("Use chosen model to predict outcome based on current data.")
     current_polls_date = "20-Jul-24"  # To be changed with each review
-    polls_data = get_poll_data(current_polls_date)
+    with timed_stage("get_poll_data"):
+        polls_data = get_poll_data(current_polls_date)
     print(polls_data.head())
-    polls_X = polls_data[X_columns].to_numpy()
-    overall_xys = convert_to_xys(df, X_columns, y_columns)
-    predictions_list = [np.zeros(1) for _ in range(len(overall_xys))]
-    for i in range(len(overall_xys)):
-        print(f'Model: {model_names[i]}')
-        overall_X, overall_y = overall_xys[i]
-        model = fit_model(overall_X, overall_y, order=optimal_order)
-        print(f'Coefficients: {model.named_steps["linear"].coef_}')
-        print(f'Intercept: {model.named_steps["linear"].intercept_}')
-        predictions_list[i] = model.predict(polls_X)
+    polls_X = polls_data[X_COLUMNS].to_numpy()
+    predictions_list = list((polynomial_features(polls_X, optimal_order) @ coefficients).T)
     # Rescale predictions to sum to 1
-    for i in range(len(predictions_list[0])):
-        sum_preds = predictions_list[0][i] + predictions_list[1][i] + predictions_list[2][i]
-        predictions_list[0][i] /= sum_preds
-        predictions_list[1][i] /= sum_preds
-        predictions_list[2][i] /= sum_preds
+    predictions_list = list(normalise_predictions(predictions_list).T)
     # Determine whether each state prediction gives to D or R, and give a rating from tilt to safe based on error margin
-    parties, likelihoods, margins = classify_predictions(predictions_list, error_margin)
+    with timed_stage("classify_predictions"):
+        parties, likelihoods, margins = classify_predictions(predictions_list, error_margin)
+    # Simulate the electoral college, with states that have no polls allocated to the winner of their last election
+    print("Simulate the electoral college from the predictions.")
+    unpolled_winners = latest_result_winners(df, [state for state in ELECTORAL_VOTES if state not in polls_data.index])
+    residuals = np.concatenate([model["cv_residuals"], model["test_residuals"]])
+    with timed_stage("simulate_electoral_college"):
+        simulation = simulate_electoral_college(list(polls_data.index.values), predictions_list, error_margin,
+                                                residuals=residuals, n_simulations=100000,
+                                                fixed_winners=unpolled_winners, seed=20)
+    print(f'Win probabilities: {simulation["win_probabilities"]}')
+    tipping_points = sorted(simulation["tipping_point_probabilities"].items(), key=lambda item: item[1], reverse=True)
+    print(f'Most likely tipping point states: {tipping_points[:5]}')
     # Express predictions as a percentage to 2 d.p.
     for i in range(len(predictions_list)):
         predictions_list[i] = np.around(100 * predictions_list[i], 2)
@@ -139,5 +258,6 @@ def script():
     }).set_index("State Alpha")
     df_results = df_results.sort_values(by="margin", ascending=False)
     df_results = df_results.drop("margin", axis=1)
-    print(df_results)
-    print([round(100*i*error_margin, 2) for i in [1, 2, 4]])
+    with timed_stage("print_results"):
+        print(df_results)
+    print([round(100*i*error_margin, 2) for i in LIKELIHOOD_BANDS])
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import pathlib as pl
+import numpy as np
+import pandas as pd
+import data_tools
+from data_tools import fold_assignments, load_data
+from math_tools import normalise_predictions, performance_metric
+from model_tools import polynomial_terms, polynomial_features, multiplier_targets, apply_multipliers
+from script import X_COLUMNS, Y_COLUMNS
+from timing_tools import timed_stage
+
+
+TARGETS = ["shares", "multipliers"]
+PENALTIES = ["none", "ridge", "lasso"]
+RIDGE_ALPHAS = list(np.logspace(-6, 2, 25))
+LASSO_ALPHAS = list(np.logspace(-5, -1, 25))
+SEARCH_LOG_FILE = ".search_log.jsonl"
+
+
+def interaction_columns(d, order, max_interaction=None):
+    """
+    This function selects the polynomial features in which at most max_interaction of the input variables are
+    multiplied together, e.g. with a limit of 1 there are no interaction terms, only the powers of each variable.
+    :param d: An integer for the number of input variables.
+    :param order: The order of the polynomial features.
+    :param max_interaction: An optional integer for the largest number of distinct input variables in a term. There is
+    no limit by default.
+    :return: A list of the positions of the selected columns of polynomial_features, which are the same positions in
+    the polynomial features of any higher order.
+    """
+    return [i for i, term in enumerate(polynomial_terms(d, order))
+            if max_interaction is None or len(set(term)) <= max_interaction]
+
+
+def search_space(d, orders=None, max_interactions=None, targets=None, penalties=None, ridge_alphas=None,
+                 lasso_alphas=None):
+    """
+    This function lists the groups of configurations to be searched. The configurations in a group differ only in the
+    strength of their penalty, so a group is fitted along its whole regularisation path at once. Interaction limits
+    that select the same features as a lower limit are left out.
+    :param d: An integer for the number of input variables.
+    :param orders: An optional list of integers for the polynomial orders, by default 0 to 6.
+    :param max_interactions: An optional list of integers for the interaction limits, by default 1 to d.
+    :param targets: An optional list of the targets, by default TARGETS: "shares" to predict the vote shares directly as
+    in bespoke_cross_validation_2, and "multipliers" to predict the multipliers of the poll shares as in
+    bespoke_cross_validation.
+    :param penalties: An optional list of the penalties, by default PENALTIES.
+    :param ridge_alphas: An optional list of the ridge penalty strengths, by default RIDGE_ALPHAS.
+    :param lasso_alphas: An optional list of the lasso penalty strengths, by default LASSO_ALPHAS.
+    :return: A list of dictionaries of the order, interaction limit, target, penalty and penalty strengths of each
+    group.
+    """
+    orders = [i for i in range(7)] if orders is None else orders
+    max_interactions = [i for i in range(1, d + 1)] if max_interactions is None else max_interactions
+    alphas = {
+        "none": [0.0],
+        "ridge": RIDGE_ALPHAS if ridge_alphas is None else ridge_alphas,
+        "lasso": LASSO_ALPHAS if lasso_alphas is None else lasso_alphas
+    }
+    groups = []
+    for order in orders:
+        # A limit of min(order, d) or more does not limit the terms of this order
+        for max_interaction in sorted(set(min(limit, max(1, min(order, d))) for limit in max_interactions)):
+            for target in (TARGETS if targets is None else targets):
+                for penalty in (PENALTIES if penalties is None else penalties):
+                    groups.append({
+                        "order": order,
+                        "max_interaction": max_interaction,
+                        "target": target,
+                        "penalty": penalty,
+                        "alphas": [float(alpha) for alpha in alphas[penalty]]
+                    })
+    return groups
+
+
+def fit_penalty_path(features, T, weights, penalty, alphas, rcond=1e-6, max_iter=1000, tol=1e-7):
+    """
+    This function fits a (possibly penalised) linear model for every training set and every penalty strength. The
+    features of the penalised models are centred and scaled on each training set, so that the penalty does not apply to
+    the intercept and treats every feature alike. Ridge and unpenalised models take one singular value decomposition
+    per training set for the whole path, with the unpenalised model taking the same minimum norm solution as
+    fit_coefficients. Lasso models are fitted by accelerated proximal gradient descent (FISTA, with restarts) on one
+    Gram matrix per training set, with every penalty strength solved at once. The training sets are fitted together, so
+    the number of numpy calls does not depend on their number, or on the number of penalty strengths.
+    :param features: The features as a numpy array of dimensions (n,p).
+    :param T: The targets as a numpy array of dimensions (n,k).
+    :param weights: A numpy array of dimensions (b,n) of 1 for the rows in each training set and 0 otherwise.
+    :param penalty: A string for the penalty, one of "none", "ridge" (alpha times the sum of squared coefficients,
+    added to the sum of squared errors) or "lasso" (alpha times the sum of absolute coefficients, added to half the
+    mean squared error).
+    :param alphas: A list of the penalty strengths.
+    :param rcond: The cutoff for small singular values, relative to the largest, of the unpenalised model.
+    :param max_iter: An integer for the largest number of iterations of the lasso solver.
+    :param tol: The largest change of a (scaled) coefficient at which the lasso solver has converged.
+    :return: A tuple of numpy arrays of the coefficients (b,len(alphas),p,k) and intercepts (b,len(alphas),k).
+    """
+    weights = np.asarray(weights, dtype=float)
+    n_rows = weights.sum(axis=1)[:, np.newaxis]
+    if penalty == "none":
+        # As in fit_coefficients, the bias column is fitted along with the other features
+        feature_means = np.zeros((len(weights), features.shape[1]))
+        target_means = np.zeros((len(weights), T.shape[1]))
+    else:
+        feature_means = weights @ features / n_rows
+        target_means = weights @ T / n_rows
+    centred = (features[np.newaxis] - feature_means[:, np.newaxis]) * weights[:, :, np.newaxis]
+    scales = np.sqrt(np.sum(np.square(centred), axis=1) / n_rows)
+    scales[(scales < 1e-12) | (penalty == "none")] = 1  # e.g. the bias column, which is zero once centred
+    scaled = centred / scales[:, np.newaxis]
+    centred_T = (T[np.newaxis] - target_means[:, np.newaxis]) * weights[:, :, np.newaxis]
+    alphas = np.asarray(alphas, dtype=float)
+    if penalty in ["none", "ridge"]:
+        u, s, vh = np.linalg.svd(scaled, full_matrices=False)
+        projected = np.swapaxes(u, 1, 2) @ centred_T  # i.e. (b, p, k)
+        if penalty == "none":
+            keep = s > rcond * s[:, :1]
+            filters = np.where(keep, 1 / np.where(keep, s, 1), 0)[:, np.newaxis, :].repeat(len(alphas), axis=1)
+        else:
+            filters = s[:, np.newaxis, :] / (np.square(s)[:, np.newaxis, :] + alphas[np.newaxis, :, np.newaxis])
+        coefficients = np.einsum('bqp,baq,bqk->bapk', vh, filters, projected)
+    elif penalty == "lasso":
+        gram = np.swapaxes(scaled, 1, 2) @ scaled / n_rows[:, :, np.newaxis]
+        correlations = (np.swapaxes(scaled, 1, 2) @ centred_T / n_rows[:, :, np.newaxis])[:, np.newaxis]
+        largest_eigenvalues = np.linalg.eigvalsh(gram)[:, -1]
+        steps = (1 / np.where(largest_eigenvalues > 0, largest_eigenvalues, 1))[:, np.newaxis, np.newaxis, np.newaxis]
+        thresholds = steps * alphas[np.newaxis, :, np.newaxis, np.newaxis]
+        gram = gram[:, np.newaxis]
+        coefficients = np.zeros((len(weights), len(alphas)) + correlations.shape[2:])
+        momentum, t = coefficients, np.ones((len(weights), len(alphas), 1, 1))
+        for _ in range(max_iter):
+            step = momentum - steps * (gram @ momentum - correlations)
+            updated = np.sign(step) * np.maximum(np.abs(step) - thresholds, 0)
+            change = updated - coefficients
+            t_next = (1 + np.sqrt(1 + 4 * np.square(t))) / 2
+            # The acceleration of each problem is restarted when it stops decreasing the objective
+            restart = np.sum((momentum - updated) * change, axis=(2, 3), keepdims=True) > 0
+            t_next = np.where(restart, 1, t_next)
+            momentum = updated + np.where(restart, 0, (t - 1) / t_next) * change
+            coefficients, t = updated, t_next
+            if np.max(np.abs(change)) < tol:
+                break
+    else:
+        raise ValueError(f"The penalty must be one of: {PENALTIES}")
+    coefficients = coefficients / scales[:, np.newaxis, :, np.newaxis]
+    intercepts = target_means[:, np.newaxis] - np.einsum('bp,bapk->bak', feature_means, coefficients)
+    return coefficients, intercepts
+
+
+def _targets(X, Y, target):
+    """
+    This function gives the targets that the models of a group are fitted to.
+    :return: A tuple of the targets as a numpy array of dimensions (n,k), and the numpy array of dimensions (n,k) by
+    which predictions of the targets are multiplied to give predictions of Y.
+    """
+    if target == "shares":
+        return Y, np.ones_like(Y)
+    if target != "multipliers":
+        raise ValueError(f"The target must be one of: {TARGETS}")
+    return multiplier_targets(Y, X), apply_multipliers(np.ones_like(Y), X)
+
+
+def _group_fold_scores(X, Y, features, fold_ids, folds, group, performance_metric_function):
+    """
+    This function scores every penalty strength of a group on each of the given folds, with the models trained on the
+    other folds.
+    :return: A numpy array of the scores of dimensions (len(folds), len(alphas)).
+    """
+    columns = interaction_columns(X.shape[1], group["order"], group["max_interaction"])
+    group_features = features[:, columns]
+    T, multipliers = _targets(X, Y, group["target"])
+    weights = fold_ids[np.newaxis, :] != np.asarray(folds)[:, np.newaxis]
+    coefficients, intercepts = fit_penalty_path(group_features, T, weights, group["penalty"], group["alphas"])
+    scores = np.zeros((len(folds), len(group["alphas"])))
+    for i, fold in enumerate(folds):
+        in_fold = fold_ids == fold
+        predictions = group_features[in_fold] @ coefficients[i] + intercepts[i][:, np.newaxis]  # i.e. (a, m, k)
+        for a in range(len(group["alphas"])):
+            scores[i, a] = performance_metric_function(normalise_predictions(predictions[a] * multipliers[in_fold]),
+                                                       Y[in_fold])
+    return scores
+
+
+def _group_key(group, k, seed, data_hash):
+    """
+    This function gives the key of a group in the search log, which changes with anything that changes its scores.
+    :return: A string of the key.
+    """
+    return json.dumps({**group, "k": k, "seed": seed, "data": data_hash}, sort_keys=True)
+
+
+def _read_search_log(log_path):
+    """
+    This function reads the fold scores saved in a search log.
+    :return: A dictionary of the key of each group, to a dictionary of each fold to its numpy array of scores.
+    """
+    fold_scores = {}
+    if log_path is None or not pl.Path(log_path).exists():
+        return fold_scores
+    with open(log_path, 'r') as log_file:
+        for line in log_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # e.g. a line cut short when a search was interrupted
+            fold_scores.setdefault(record["key"], {})[record["fold"]] = np.array(record["scores"])
+    return fold_scores
+
+
+def successive_halving_search(X, Y, k=20, seed=20, eta=3, min_folds=2, log_path=None,
+                              performance_metric_function=performance_metric, **space_options):
+    """
+    This function searches over the polynomial order, interaction limit, target, penalty and penalty strength of the
+    model by successive halving: every configuration is scored on a few folds, only the best 1/eta of them are scored on
+    eta times as many folds, and so on until the survivors have been scored on all k folds. The scores of each group of
+    configurations on each fold are appended to the log as they are calculated, and a search with the same log, data
+    and settings picks up from where it stopped.
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :param Y: The output variables as a numpy array of dimensions (n,k), with the vote shares in the first 3.
+    :param k: An integer for the number of folds.
+    :param seed: An integer seed for the assignment of the rows to folds.
+    :param eta: An integer for the factor by which the number of configurations is cut, and the number of folds grown,
+    at each round.
+    :param min_folds: An integer for the number of folds on which every configuration is scored.
+    :param log_path: An optional path of a file to log the scores to, and to resume the search from.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values.
+    :param space_options: Any of the orders, max_interactions, targets, penalties, ridge_alphas and lasso_alphas
+    arguments of search_space.
+    :return: A dictionary containing a pandas Dataframe of every configuration with the number of folds it was scored
+    on and its mean score, sorted from the best, the best configuration, and the number of configurations searched.
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    groups = search_space(X.shape[1], **space_options)
+    fold_ids = fold_assignments(len(X), k, seed)
+    features = polynomial_features(X, max(group["order"] for group in groups))
+    data_hash = hashlib.sha256(X.tobytes() + Y.tobytes()).hexdigest()[:16]
+    keys = [_group_key(group, k, seed, data_hash) for group in groups]
+    fold_scores = _read_search_log(log_path)
+    log_file = None if log_path is None else open(log_path, 'a')
+    # Each configuration is a group and the position of its penalty strength
+    survivors = [(g, a) for g, group in enumerate(groups) for a in range(len(group["alphas"]))]
+    n_folds = min(min_folds, k)
+    try:
+        while True:
+            with timed_stage("successive_halving_round"):
+                for g in sorted(set(g for g, _ in survivors)):
+                    missing = [fold for fold in range(n_folds) if fold not in fold_scores.get(keys[g], {})]
+                    if not missing:
+                        continue
+                    scores = _group_fold_scores(X, Y, features, fold_ids, missing, groups[g],
+                                                performance_metric_function)
+                    for fold, fold_score in zip(missing, scores):
+                        fold_scores.setdefault(keys[g], {})[fold] = fold_score
+                        if log_file is not None:
+                            log_file.write(json.dumps({"key": keys[g], "fold": fold,
+                                                       "scores": fold_score.tolist()}) + "\n")
+                if log_file is not None:
+                    log_file.flush()
+            if n_folds == k:
+                break
+            mean_scores = [np.mean([fold_scores[keys[g]][fold][a] for fold in range(n_folds)]) for g, a in survivors]
+            n_survivors = max(1, int(np.ceil(len(survivors) / eta)))
+            survivors = [survivors[i] for i in np.argsort(mean_scores, kind="stable")[:n_survivors]]
+            n_folds = min(n_folds * eta, k)
+    finally:
+        if log_file is not None:
+            log_file.close()
+    rows = []
+    for g, group in enumerate(groups):
+        for a, alpha in enumerate(group["alphas"]):
+            scored_folds = sorted(fold_scores.get(keys[g], {}))
+            rows.append({
+                "order": group["order"],
+                "max_interaction": group["max_interaction"],
+                "target": group["target"],
+                "penalty": group["penalty"],
+                "alpha": alpha,
+                "n_folds": len(scored_folds),
+                "score": np.mean([fold_scores[keys[g]][fold][a] for fold in scored_folds])
+            })
+    results = pd.DataFrame(rows).sort_values(["n_folds", "score"], ascending=[False, True], ignore_index=True)
+    return {
+        "results": results,
+        "best": results.iloc[0][["order", "max_interaction", "target", "penalty", "alpha"]].to_dict(),
+        "n_configurations": len(results)
+    }
+
+
+def fit_search_configuration(X, Y, configuration):
+    """
+    This function fits a configuration found by successive_halving_search to all of the data.
+    :param X: The input variables as a numpy array of dimensions (n,d).
+    :param Y: The output variables as a numpy array of dimensions (n,k).
+    :param configuration: A dictionary of the order, max_interaction, target, penalty and alpha of the configuration,
+    e.g. the best configuration of successive_halving_search.
+    :return: A dictionary containing the configuration, the positions of its columns in polynomial_features, and the
+    coefficients (p,k) and intercepts (k,) of the model.
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    columns = interaction_columns(X.shape[1], int(configuration["order"]), int(configuration["max_interaction"]))
+    T, _ = _targets(X, Y, configuration["target"])
+    coefficients, intercepts = fit_penalty_path(polynomial_features(X, int(configuration["order"]))[:, columns], T,
+                                                np.ones((1, len(X))), configuration["penalty"],
+                                                [configuration["alpha"]])
+    return {
+        "configuration": configuration,
+        "columns": columns,
+        "coefficients": coefficients[0, 0],
+        "intercepts": intercepts[0, 0]
+    }
+
+
+def predict_search_configuration(model, X):
+    """
+    This function makes predictions from a model fitted by fit_search_configuration.
+    :param model: A dictionary as returned by fit_search_configuration.
+    :param X: The input variables as a numpy array of dimensions (m,d).
+    :return: A numpy array of the normalised predictions of dimensions (m,k).
+    """
+    X = np.asarray(X, dtype=float)
+    predictions = polynomial_features(X, int(model["configuration"]["order"]))[:, model["columns"]] \
+        @ model["coefficients"] + model["intercepts"]
+    if model["configuration"]["target"] == "multipliers":
+        apply_multipliers(predictions, X)
+    return normalise_predictions(predictions)
+
+
+def search_script(log_path=None, **search_options):
+    """
+    This function searches the configurations of the model on all of the training data, resuming from the search log,
+    and prints out the best configurations.
+    :param log_path: An optional path of the search log. By default it is a file within the data directory.
+    :param search_options: Any of the arguments of successive_halving_search.
+    :return: A dictionary as returned by successive_halving_search.
+    """
+    log_path = data_tools.DATA_ROOT / SEARCH_LOG_FILE if log_path is None else log_path
+    df = load_data()
+    search = successive_halving_search(df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy(), log_path=log_path,
+                                       **search_options)
+    print(f'Searched {search["n_configurations"]} configurations, with the scores logged to: {log_path}')
+    print(search["results"].head(10))
+    print(f'Best configuration: {search["best"]}')
+    return search
@@ -0,0 +1,171 @@
+import numpy as np
+from data_tools import fold_assignments
+from math_tools import performance_metric, normalise_predictions, margin_errors
+from model_tools import polynomial_features, fit_coefficients, cross_validation_buffer, cross_validation_engine, \
+    normalise_in_place
+
+
+def cross_validation_scores(X, Y, fold_ids, orders, performance_metric_function=performance_metric, rows=None,
+                            buffer=None, features=None, **schedule_options):
+    """
+    This function runs cross-validation over the given fold assignments for each order, with the predictions normalised
+    to sum to 1 as in bespoke_cross_validation_2, and returns the mean of the performance metric across the folds.
+    :param X: The input variables for all of the data as a numpy array of dimensions (n,d).
+    :param Y: The output variables for all of the data as a numpy array of dimensions (n,k).
+    :param fold_ids: An integer numpy array giving the fold of each row used, i.e. of the same length as rows.
+    :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values.
+    :param rows: An optional integer numpy array of the row positions in X and Y to be used. All rows by default.
+    :param buffer: An optional numpy array from cross_validation_buffer for the predictions to be written to.
+    :param features: An optional numpy array of the polynomial features of the rows used at the highest order.
+    :param schedule_options: Any of the executor, n_workers and chunk_size arguments of cross_validation_engine.
+    :return: A numpy array of the mean performance for each order, in the same order as orders.
+    """
+    rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+    X, Y = np.asarray(X)[rows], np.asarray(Y)[rows]
+    results = cross_validation_engine(X, Y, fold_ids, orders, performance_metric_function,
+                                      post_process=normalise_in_place, buffer=buffer, features=features,
+                                      **schedule_options)
+    return np.array([results["mean"][order] for order in orders])
+
+
+def repeated_cross_validation(X, Y, orders, k, seeds, performance_metric_function=performance_metric, rows=None,
+                              **schedule_options):
+    """
+    This function runs k-fold cross-validation once for each seed, with a new assignment of rows to folds each time, and
+    selects the order with the best mean performance across the repeats. Only the scores of each repeat are kept, so
+    the memory used does not depend on the number of repeats beyond one float per order per repeat.
+    :param X: The input variables for all of the data as a numpy array of dimensions (n,d).
+    :param Y: The output variables for all of the data as a numpy array of dimensions (n,k).
+    :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
+    :param k: An integer for the number of folds.
+    :param seeds: A list of integer seeds, one for each repeat.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values.
+    :param rows: An optional integer numpy array of the row positions in X and Y to be used. All rows by default.
+    :param schedule_options: Any of the executor, n_workers and chunk_size arguments of cross_validation_engine.
+    :return: A dictionary containing the scores of each repeat (n_repeats, n_orders), the mean and standard deviation
+    of the scores for each order, and the selected order.
+    """
+    rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+    scores = np.zeros((len(seeds), len(orders)))
+    buffer = None
+    # The features of the rows do not depend on the assignment of the folds, so they are computed once for every repeat
+    features = polynomial_features(np.asarray(X, dtype=float)[rows], max(orders))
+    for i, seed in enumerate(seeds):
+        fold_ids = fold_assignments(len(rows), k, seed)
+        # The folds of every repeat have the same sizes, so their predictions are all written to the same buffer
+        buffer = cross_validation_buffer(fold_ids, len(orders), np.shape(Y)[1]) if buffer is None else buffer
+        scores[i] = cross_validation_scores(X, Y, fold_ids, orders, performance_metric_function, rows, buffer, features,
+                                            **schedule_options)
+    mean_scores = scores.mean(axis=0)
+    return {
+        "scores": scores,
+        "mean": dict(zip(orders, mean_scores)),
+        "std": dict(zip(orders, scores.std(axis=0))),
+        "selected_order": orders[int(np.argmin(mean_scores))]
+    }
+
+
+def cross_validation_residuals(X, Y, order, k, seed, rows=None, **schedule_options):
+    """
+    This function runs k-fold cross-validation for a single order, with the predictions normalised to sum to 1 as in
+    cross_validation_scores, and returns the error on the Republican margin of each row when it was held out.
+    :param X: The input variables for all of the data as a numpy array of dimensions (n,d).
+    :param Y: The output variables for all of the data as a numpy array of dimensions (n,3).
+    :param order: An integer for the polynomial order of the model.
+    :param k: An integer for the number of folds.
+    :param seed: An integer seed for the assignment of rows to folds.
+    :param rows: An optional integer numpy array of the row positions in X and Y to be used. All rows by default.
+    :param schedule_options: Any of the executor, n_workers and chunk_size arguments of cross_validation_engine.
+    :return: A numpy array of the margin errors of the rows used, in the same order as rows.
+    """
+    rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+    X, Y = np.asarray(X, dtype=float)[rows], np.asarray(Y, dtype=float)[rows]
+    results = cross_validation_engine(X, Y, fold_assignments(len(rows), k, seed), [order], performance_metric,
+                                      post_process=normalise_in_place, **schedule_options)
+    residuals = np.empty(len(rows))
+    for i, fold in enumerate(results["fold_rows"]):
+        residuals[fold] = margin_errors(results["predictions"][i, 0, :len(fold)], Y[fold])
+    return residuals
+
+
+def nested_cross_validation(X, Y, orders, outer_k, inner_k, seeds, performance_metric_function=performance_metric,
+                            rows=None, outer_seed=20):
+    """
+    This function estimates the performance of the whole model selection procedure. For each outer fold, the order is
+    selected by repeated cross-validation on the other outer folds, and the selected model is then scored on the outer
+    fold.
+    :param X: The input variables for all of the data as a numpy array of dimensions (n,d).
+    :param Y: The output variables for all of the data as a numpy array of dimensions (n,k).
+    :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
+    :param outer_k: An integer for the number of outer folds.
+    :param inner_k: An integer for the number of inner folds used to select the order.
+    :param seeds: A list of integer seeds for the inner repeats.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values.
+    :param rows: An optional integer numpy array of the row positions in X and Y to be used. All rows by default.
+    :param outer_seed: An optional integer seed for the outer fold assignment.
+    :return: A dictionary containing the order selected and the score for each outer fold, and the mean and standard
+    deviation of the outer scores.
+    """
+    rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+    outer_ids = fold_assignments(len(rows), outer_k, outer_seed)
+    selected_orders = []
+    outer_scores = np.zeros(outer_k)
+    for i in range(outer_k):
+        inner_rows, outer_rows = rows[outer_ids != i], rows[outer_ids == i]
+        selected_order = repeated_cross_validation(X, Y, orders, inner_k, seeds, performance_metric_function,
+                                                   inner_rows)["selected_order"]
+        coefficients = fit_coefficients(polynomial_features(X[inner_rows], selected_order), Y[inner_rows])
+        predictions = normalise_predictions(polynomial_features(X[outer_rows], selected_order) @ coefficients)
+        selected_orders.append(selected_order)
+        outer_scores[i] = performance_metric_function(predictions, Y[outer_rows])
+    return {
+        "selected_orders": selected_orders,
+        "scores": outer_scores,
+        "mean": outer_scores.mean(),
+        "std": outer_scores.std()
+    }
+
+
+def bootstrap_error(X, Y, order, n_bootstrap, performance_metric_function=performance_metric, rows=None, seed=None,
+                    batch_size=100):
+    """
+    This function estimates the spread of the error of a model of the given order with out-of-bag bootstrapping. Each
+    resample is fitted by weighting the rows by the number of times they were drawn, with the resamples fitted in
+    batches so that the memory used is bounded by the batch size, and the model is scored on the rows not drawn.
+    :param X: The input variables for all of the data as a numpy array of dimensions (n,d).
+    :param Y: The output variables for all of the data as a numpy array of dimensions (n,k).
+    :param order: The order of the polynomial that the models are being fit to.
+    :param n_bootstrap: An integer for the number of bootstrap resamples.
+    :param performance_metric_function: A function from which the performance is to be measured, which is called with
+    numpy arrays of dimensions (n_rows, k) of the predictions and actual values.
+    :param rows: An optional integer numpy array of the row positions in X and Y to be used. All rows by default.
+    :param seed: An optional integer seed for the random number generator.
+    :param batch_size: An integer for the number of resamples fitted at once.
+    :return: A dictionary containing the out-of-bag score of each resample, and their mean, standard deviation and
+    2.5% and 97.5% percentiles.
+    """
+    rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+    X, Y = np.asarray(X)[rows], np.asarray(Y)[rows]
+    features = polynomial_features(X, order)
+    rng = np.random.default_rng(seed)
+    scores = np.full(n_bootstrap, np.nan)
+    for start in range(0, n_bootstrap, batch_size):
+        size = min(batch_size, n_bootstrap - start)
+        counts = np.stack([np.bincount(rng.integers(0, len(rows), len(rows)), minlength=len(rows))
+                           for _ in range(size)])
+        predictions = features @ fit_coefficients(features, Y, counts)  # i.e. (size, n, k)
+        for i in range(size):
+            out_of_bag = counts[i] == 0
+            if out_of_bag.any():
+                scores[start + i] = performance_metric_function(normalise_predictions(predictions[i][out_of_bag]),
+                                                                Y[out_of_bag])
+    return {
+        "scores": scores,
+        "mean": np.nanmean(scores),
+        "std": np.nanstd(scores),
+        "interval": tuple(np.nanpercentile(scores, [2.5, 97.5]))
+    }
@@ -0,0 +1,288 @@
+import asyncio
+import collections
+import io
+import json
+import time
+import numpy as np
+import pandas as pd
+from data_tools import load_data
+from forecast_tools import forecast_arrays
+from script import X_COLUMNS, load_or_train_model
+
+
+STATE_COLUMN = "State Alpha"
+MAX_BODY_BYTES = 10000000
+_STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def new_service_state(model, max_batch_rows=100000, max_delay=0.001, latency_window=10000):
+    """
+    This function creates the state kept in memory by the forecast service.
+    :param model: A model dictionary as returned by train_model.
+    :param max_batch_rows: An integer for the largest number of poll rows predicted in one batch.
+    :param max_delay: The number of seconds the batcher waits for more requests to join a batch once it has one.
+    :param latency_window: An integer for the number of recent requests whose latencies are kept for the metrics.
+    :return: A dictionary containing the model, the batching options, the queue of pending requests (created when the
+    service starts), and the counters and recent latencies for the metrics.
+    """
+    return {
+        "model": model,
+        "max_batch_rows": max_batch_rows,
+        "max_delay": max_delay,
+        "queue": None,
+        "started": time.time(),
+        "requests": 0,
+        "errors": 0,
+        "batches": 0,
+        "batched_rows": 0,
+        "max_queue_depth": 0,
+        "latencies": collections.deque(maxlen=latency_window),
+        "batch_seconds": collections.deque(maxlen=latency_window)
+    }
+
+
+def parse_poll_rows(body, content_type):
+    """
+    This function reads poll rows sent to the service, with the same columns as the poll data files.
+    :param body: The bytes of the request body.
+    :param content_type: The content type of the request. CSV is read if it is text/csv, and JSON otherwise, as either a
+    list of objects or an object with a "polls" list of objects.
+    :return: A tuple of a list of the State Alpha of each row (or None for rows without one) and a numpy array of the
+    poll shares of dimensions (n,3).
+    """
+    states, X = _read_poll_rows(body, content_type)
+    if not np.isfinite(X).all():
+        raise ValueError("Every poll share must be a finite number.")
+    return states, X
+
+
+def _read_poll_rows(body, content_type):
+    """
+    This function reads the State Alpha and poll shares of the rows of a request body, as in parse_poll_rows.
+    :return: A tuple of a list of the State Alpha of each row (or None for rows without one) and a numpy array of the
+    poll shares of dimensions (n,3).
+    """
+    if content_type.split(";")[0].strip().lower() == "text/csv":
+        polls_data = pd.read_csv(io.BytesIO(body), dtype={STATE_COLUMN: str})
+        missing = [column for column in X_COLUMNS if column not in polls_data.columns]
+        if missing:
+            raise ValueError(f"Columns missing from the poll rows: {missing}")
+        states = [None] * len(polls_data)
+        if STATE_COLUMN in polls_data.columns:
+            # Empty cells are read as NaN, which is not valid JSON, so they are returned as None
+            states = [None if pd.isna(state_alpha) else state_alpha for state_alpha in polls_data[STATE_COLUMN]]
+        return states, polls_data[X_COLUMNS].to_numpy(dtype=float)
+    rows = json.loads(body)
+    if isinstance(rows, dict):
+        rows = rows.get("polls")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('The poll rows must be a list of objects, or an object with a "polls" list of objects.')
+    try:
+        shares = [[row[column] for column in X_COLUMNS] for row in rows]
+    except KeyError as error:
+        raise ValueError(f"Column missing from a poll row: {error.args[0]}") from None
+    if not all(isinstance(share, (int, float)) and not isinstance(share, bool) for row in shares for share in row):
+        raise ValueError(f"Every poll share must be a number: {X_COLUMNS}")
+    states = [row.get(STATE_COLUMN) for row in rows]
+    if not all(state_alpha is None or isinstance(state_alpha, str) for state_alpha in states):
+        raise ValueError(f"Every {STATE_COLUMN} must be a string or null.")
+    return states, np.array(shares, dtype=float).reshape(-1, len(X_COLUMNS))
+
+
+async def submit_polls(state, X):
+    """
+    This function queues poll shares to be forecast in the next batch, and waits for their forecasts.
+    :param state: The service state, as created by new_service_state, of a running service.
+    :param X: The poll shares as a numpy array of dimensions (n,3).
+    :return: A dictionary of numpy arrays of the forecasts, as returned by forecast_arrays.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await state["queue"].put((X, future))
+    state["max_queue_depth"] = max(state["max_queue_depth"], state["queue"].qsize())
+    return await future
+
+
+async def _batch_worker(state):
+    """
+    This function forecasts the queued requests in batches, taking every request that arrives within max_delay of the
+    first (up to max_batch_rows) and predicting them all with a single matrix product.
+    """
+    queue = state["queue"]
+    while True:
+        requests = [await queue.get()]
+        n_rows = len(requests[0][0])
+        deadline = time.perf_counter() + state["max_delay"]
+        while n_rows < state["max_batch_rows"]:
+            try:
+                if not queue.empty():
+                    requests.append(queue.get_nowait())
+                else:
+                    requests.append(await asyncio.wait_for(queue.get(), deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                break
+            n_rows += len(requests[-1][0])
+        start = time.perf_counter()
+        model = state["model"]
+        try:
+            forecasts = forecast_arrays(model["order"], model["coefficients"], model["error_margin"],
+                                        np.concatenate([X for X, _ in requests]))
+        except Exception as error:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+            continue
+        state["batch_seconds"].append(time.perf_counter() - start)
+        state["batches"] += 1
+        state["batched_rows"] += n_rows
+        bounds = np.cumsum([0] + [len(X) for X, _ in requests])
+        for i, (_, future) in enumerate(requests):
+            if not future.done():
+                future.set_result({column: values[bounds[i]:bounds[i + 1]] for column, values in forecasts.items()})
+
+
+def service_metrics(state):
+    """
+    This function summarises the metrics of the service.
+    :param state: The service state, as created by new_service_state.
+    :return: A dictionary of the counts of requests, errors, batches and rows, the current and largest queue depths, and
+    the mean and percentiles of the latencies of recent requests and batches in milliseconds.
+    """
+    latencies = 1000 * np.array(state["latencies"])
+    batch_seconds = 1000 * np.array(state["batch_seconds"])
+    return {
+        "uptime_seconds": time.time() - state["started"],
+        "requests": state["requests"],
+        "errors": state["errors"],
+        "batches": state["batches"],
+        "batched_rows": state["batched_rows"],
+        "mean_batch_rows": state["batched_rows"] / state["batches"] if state["batches"] else None,
+        "queue_depth": 0 if state["queue"] is None else state["queue"].qsize(),
+        "max_queue_depth": state["max_queue_depth"],
+        "latency_ms": {
+            "mean": float(latencies.mean()) if len(latencies) else None,
+            **{f"p{q}": float(np.percentile(latencies, q)) if len(latencies) else None for q in [50, 95, 99]}
+        },
+        "batch_ms": {
+            "mean": float(batch_seconds.mean()) if len(batch_seconds) else None,
+            "p99": float(np.percentile(batch_seconds, 99)) if len(batch_seconds) else None
+        }
+    }
+
+
+async def _route(state, method, path, headers, body):
+    """
+    This function handles a single request to the service.
+    :return: A tuple of the status code and a JSON-serialisable response.
+    """
+    if path == "/forecast":
+        if method != "POST":
+            return 405, {"error": "Forecasts must be requested with POST."}
+        try:
+            states, X = parse_poll_rows(body, headers.get("content-type", "application/json"))
+        except (ValueError, TypeError, UnicodeDecodeError, pd.errors.ParserError) as error:
+            # Anything wrong with the payload is the client's error rather than the service's
+            return 400, {"error": str(error)}
+        forecasts = await submit_polls(state, X) if len(X) > 0 else {}
+        columns = {column: values.tolist() for column, values in forecasts.items()}
+        return 200, {"forecasts": [{STATE_COLUMN: state_alpha, **{column: values[i] for column, values in
+                                                                    columns.items()}}
+                                   for i, state_alpha in enumerate(states)]}
+    if path == "/metrics":
+        return 200, service_metrics(state)
+    if path == "/health":
+        return 200, {"status": "ok", "order": state["model"]["order"]}
+    return 404, {"error": f"Unknown path: {path}"}
+
+
+async def _handle_connection(state, reader, writer):
+    """
+    This function reads HTTP/1.1 requests from a connection and writes their responses, keeping the connection open
+    between requests unless the client asks for it to be closed.
+    """
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            start = time.perf_counter()
+            request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+            method, target, version = (request_line.split(" ") + ["", ""])[:3]
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = headers.get("content-length", "0") or "0"
+            if not (length.isascii() and length.isdigit()):
+                # Without a valid length the end of the body cannot be found, so the connection is closed
+                status, response = 400, {"error": f"The Content-Length must be a non-negative integer: {length}"}
+                keep_alive = False
+            elif int(length) > MAX_BODY_BYTES:
+                status, response = 413, {"error": f"The request body must be at most {MAX_BODY_BYTES} bytes."}
+                keep_alive = False
+            else:
+                body = await reader.readexactly(int(length)) if int(length) > 0 else b""
+                try:
+                    status, response = await _route(state, method, target.split("?")[0], headers, body)
+                except Exception as error:
+                    status, response = 500, {"error": str(error)}
+                keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+            payload = json.dumps(response).encode()
+            writer.write(f"HTTP/1.1 {status} {_STATUS_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}"
+                         f"\r\n\r\n".encode() + payload)
+            await writer.drain()
+            state["requests"] += 1
+            state["errors"] += status >= 400
+            state["latencies"].append(time.perf_counter() - start)
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(state, host="127.0.0.1", port=8000):
+    """
+    This function starts the forecast service and its batcher on the running event loop.
+    :param state: The service state, as created by new_service_state.
+    :param host: The host name or address to listen on, which is local only by default.
+    :param port: The port to listen on, or 0 for any free port.
+    :return: A tuple of the asyncio Server and the task of the batcher, which should be cancelled once the server is
+    closed.
+    """
+    state["queue"] = asyncio.Queue()
+    worker = asyncio.create_task(_batch_worker(state))
+    server = await asyncio.start_server(lambda reader, writer: _handle_connection(state, reader, writer), host, port)
+    return server, worker
+
+
+def run_service(host="127.0.0.1", port=8000, model=None, **service_options):
+    """
+    This function loads or trains the model once and runs the forecast service until interrupted. Forecasts are
+    requested by POSTing poll rows to /forecast as JSON or CSV, e.g.
+    [{"State Alpha": "PA", "Poll-D": 0.47, "Poll-R": 0.48, "Poll-Other": 0.05}], and the metrics are served at
+    /metrics.
+    :param host: The host name or address to listen on, which is local only by default.
+    :param port: The port to listen on.
+    :param model: An optional model dictionary as returned by train_model. By default it is loaded from the registry,
+    or trained.
+    :param service_options: Any of the max_batch_rows, max_delay and latency_window arguments of new_service_state.
+    """
+    model = load_or_train_model(load_data(), verbose=False) if model is None else model
+    state = new_service_state(model, **service_options)
+
+    async def main():
+        server, worker = await serve(state, host, port)
+        print(f'Serving forecasts from the model of order {model["order"]} at http://{host}:{port}/forecast')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
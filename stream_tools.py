@@ -0,0 +1,187 @@
+import pathlib as pl
+import numpy as np
+import pandas as pd
+from math_tools import margin_errors, normalise_predictions
+from model_tools import polynomial_terms, polynomial_features, fit_coefficients, compress_folds, \
+    solve_held_out_coefficients
+from timing_tools import timed_stage
+
+
+STREAM_CHUNK_SIZE = 100000
+
+
+def read_chunks(path, columns, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This function reads a CSV or Parquet file a chunk of rows at a time, so that the whole table is never held in
+    memory. Parquet files are read with pyarrow, which is only needed for Parquet.
+    :param path: The path of the file, which is read as Parquet if it ends in .parquet or .pq, and as CSV otherwise.
+    :param columns: A list of the names of the columns to be read.
+    :param chunk_size: An integer for the largest number of rows in each chunk.
+    :return: A generator of pandas Dataframes of the columns for each chunk of rows.
+    """
+    path = pl.Path(path)
+    if path.suffix.lower() in [".parquet", ".pq"]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet files requires the pyarrow package.") from None
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+
+
+def stream_fold_ids(positions, n_folds, seed=20):
+    """
+    This function assigns rows to folds from their position in the file, with a hash of the position rather than a
+    permutation of all of the rows, so that the fold of each row does not depend on the number of rows or the chunk
+    size.
+    :param positions: An integer numpy array of the positions of the rows in the file.
+    :param n_folds: An integer for the number of folds.
+    :param seed: An integer seed, which gives a different assignment of the rows to folds.
+    :return: An integer numpy array of the fold of each row.
+    """
+    with np.errstate(over="ignore"):
+        # The splitmix64 mixing function
+        z = np.asarray(positions, dtype=np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z ^= z >> np.uint64(31)
+    return (z % np.uint64(n_folds)).astype(np.int64)
+
+
+def _chunk_fold_ids(chunk, start, n_folds, fold_column, seed):
+    """
+    This function gives the fold of each row of a chunk, from the fold column if there is one.
+    :return: An integer numpy array of the fold of each row.
+    """
+    if fold_column is None:
+        return stream_fold_ids(np.arange(start, start + len(chunk)), n_folds, seed)
+    fold_ids = chunk[fold_column].to_numpy(dtype=np.int64)
+    if len(fold_ids) > 0 and (fold_ids.min() < 0 or fold_ids.max() >= n_folds):
+        raise ValueError(f"The values of the fold column must be between 0 and {n_folds - 1}.")
+    return fold_ids
+
+
+def stream_fold_blocks(path, X_columns, y_columns, order, n_folds=1, fold_column=None, seed=20,
+                       chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This function reads a file in chunks and accumulates the sufficient statistics of the least-squares fit of every
+    party in every fold, as the compressed blocks of compress_folds (R_f and Q_f^T y_f, where R_f^T R_f = X_f^T X_f).
+    The blocks of a polynomial order contain the blocks of every lower order as their leading rows and columns, so one
+    pass at the highest order is enough for every order.
+    :param path: The path of the CSV or Parquet file.
+    :param X_columns: A list of the column names of the X input variables.
+    :param y_columns: A list of the column names of the y output variables.
+    :param order: The highest order of the polynomial features.
+    :param n_folds: An integer for the number of folds, with 1 for a single block of all of the rows.
+    :param fold_column: An optional column of integer fold ids from 0 to n_folds-1, e.g. to hold out whole states or
+    cycles. By default the rows are assigned to folds by stream_fold_ids.
+    :param seed: An integer seed for stream_fold_ids.
+    :param chunk_size: An integer for the largest number of rows read at once, which bounds the memory used.
+    :return: A dictionary containing the order, the blocks (n_folds,p,p), the targets (n_folds,p,k) and the number of
+    rows in each fold.
+    """
+    columns = list(X_columns) + list(y_columns) + ([] if fold_column is None else [fold_column])
+    blocks = targets = None
+    counts = np.zeros(n_folds, dtype=np.int64)
+    start = 0
+    with timed_stage("stream_fold_blocks"):
+        for chunk in read_chunks(path, columns, chunk_size):
+            fold_ids = _chunk_fold_ids(chunk, start, n_folds, fold_column, seed)
+            features = polynomial_features(chunk[X_columns].to_numpy(dtype=float), order)
+            blocks, targets = compress_folds(features, chunk[y_columns].to_numpy(dtype=float), fold_ids, n_folds,
+                                             blocks, targets)
+            counts += np.bincount(fold_ids, minlength=n_folds)
+            start += len(chunk)
+    if start == 0:
+        raise ValueError(f"There are no rows in the file: {path}")
+    return {
+        "order": order,
+        "blocks": blocks,
+        "targets": targets,
+        "counts": counts
+    }
+
+
+def _order_blocks(statistics, n_inputs, order):
+    """
+    This function takes the leading blocks for a lower polynomial order out of the statistics of a higher order.
+    :return: A tuple of numpy arrays of dimensions (n_folds,p,p) and (n_folds,p,k) for the order.
+    """
+    p = len(polynomial_terms(n_inputs, order))
+    return statistics["blocks"][:, :p, :p], statistics["targets"][:, :p]
+
+
+def streaming_fit(path, X_columns, y_columns, order, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This function fits a model of the specified order to all of the rows of a file, reading it in chunks. The
+    coefficients are the same as those of fit_coefficients on the whole table.
+    :param path: The path of the CSV or Parquet file.
+    :param X_columns: A list of the column names of the X input variables.
+    :param y_columns: A list of the column names of the y output variables.
+    :param order: The order of the polynomial that the model is being fit to.
+    :param chunk_size: An integer for the largest number of rows read at once.
+    :return: A numpy array of coefficients of dimensions (p,k).
+    """
+    statistics = stream_fold_blocks(path, X_columns, y_columns, order, chunk_size=chunk_size)
+    return fit_coefficients(statistics["blocks"][0], statistics["targets"][0])
+
+
+def streaming_cross_validation(path, X_columns, y_columns, orders, n_folds=20, fold_column=None, seed=20,
+                               chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This function runs cross-validation on a file that is too large to be held in memory, with two passes over it in
+    chunks. The first pass accumulates the compressed blocks of every fold, from which the held out coefficients of
+    every fold and order are solved, and the second pass predicts each row from the model of its held out fold and
+    accumulates the errors. The predictions are normalised to sum to 1 as in bespoke_cross_validation_2, and the score
+    of each fold is the mean of |(y^_2-y^_1)-(y_2-y_1)| over its rows, i.e. the performance_metric, which (unlike a
+    general metric) can be summed a chunk at a time.
+    :param path: The path of the CSV or Parquet file.
+    :param X_columns: A list of the column names of the X input variables.
+    :param y_columns: A list of the column names of the y output variables, with the vote shares in the first 3.
+    :param orders: A list of integers for the polynomial orders of the models to be trained and validated.
+    :param n_folds: An integer for the number of folds.
+    :param fold_column: An optional column of integer fold ids from 0 to n_folds-1. By default the rows are assigned to
+    folds by stream_fold_ids.
+    :param seed: An integer seed for stream_fold_ids.
+    :param chunk_size: An integer for the largest number of rows read at once, which bounds the memory used.
+    :return: A dictionary containing the score of each fold and the mean score for each order, the RMSE of each y
+    column for each order, the number of rows in each fold, the selected order, and the coefficients of the selected
+    order fit to all of the rows.
+    """
+    statistics = stream_fold_blocks(path, X_columns, y_columns, max(orders), n_folds, fold_column, seed, chunk_size)
+    counts = statistics["counts"]
+    if np.any(counts == 0):
+        raise ValueError("Every fold must contain at least one row.")
+    held_out_coefficients = {}
+    for order in orders:
+        blocks, targets = _order_blocks(statistics, len(X_columns), order)
+        held_out_coefficients[order] = solve_held_out_coefficients(blocks, targets)
+    absolute_errors = {order: np.zeros(n_folds) for order in orders}
+    squared_errors = {order: np.zeros(len(y_columns)) for order in orders}
+    columns = list(X_columns) + list(y_columns) + ([] if fold_column is None else [fold_column])
+    start = 0
+    with timed_stage("stream_fold_errors"):
+        for chunk in read_chunks(path, columns, chunk_size):
+            fold_ids = _chunk_fold_ids(chunk, start, n_folds, fold_column, seed)
+            features = polynomial_features(chunk[X_columns].to_numpy(dtype=float), max(orders))
+            Y = chunk[y_columns].to_numpy(dtype=float)
+            for order, coefficients in held_out_coefficients.items():
+                p = coefficients.shape[1]
+                predictions = normalise_predictions(np.einsum('np,npk->nk', features[:, :p], coefficients[fold_ids]))
+                absolute_errors[order] += np.bincount(fold_ids, np.abs(margin_errors(predictions, Y)), n_folds)
+                squared_errors[order] += np.square(predictions - Y).sum(axis=0)
+            start += len(chunk)
+    fold_scores = {order: absolute_errors[order] / counts for order in orders}
+    mean_scores = {order: fold_scores[order].mean() for order in orders}
+    selected_order = min(orders, key=lambda order: mean_scores[order])
+    blocks, targets = _order_blocks(statistics, len(X_columns), selected_order)
+    return {
+        "fold_scores": fold_scores,
+        "mean": mean_scores,
+        "rmse": {order: list(np.sqrt(squared_errors[order] / counts.sum())) for order in orders},
+        "counts": counts,
+        "selected_order": selected_order,
+        "coefficients": fit_coefficients(blocks.reshape(-1, blocks.shape[2]), targets.reshape(-1, targets.shape[2]))
+    }
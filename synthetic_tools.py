@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def synthetic_data(df, scale, noise=0.01, seed=20, year_scale=1):
+    """
+    This function scales up the training data by repeating every row, with the copies given new state codes so that
+    they act as extra states, and normally distributed noise added to the polls and results before they are rescaled to
+    sum to 1. The data can also be repeated as extra election cycles before the earliest year, so that there are more
+    years for the per-cycle stages, e.g. the walk-forward backtest.
+    :param df: The training data as a Pandas dataframe, e.g. from load_data().
+    :param scale: An integer for the number of copies of each row as extra states.
+    :param noise: The standard deviation of the noise added to each vote share of the copies.
+    :param seed: An optional integer seed for the random number generator.
+    :param year_scale: An integer for the number of copies of the cycles, each copy ending one election cycle (four
+    years) before the earliest year of the last.
+    :return: A pandas Dataframe with scale * year_scale times as many rows as df, and the same columns and index levels.
+    """
+    if scale == 1 and year_scale == 1:
+        return df.copy()
+    rng = np.random.default_rng(seed)
+    states = df.index.get_level_values(0).to_numpy()
+    years = df.index.get_level_values(1).to_numpy()
+    span = years.max() - years.min() + 4
+    n_copies = scale * year_scale
+    copies = np.repeat(np.arange(n_copies), len(df))
+    state_copies, year_copies = copies % scale, copies // scale
+    state_codes = [f"{state}#{copy}" for state, copy in zip(np.tile(states, n_copies), state_copies)]
+    index = pd.MultiIndex.from_arrays([state_codes, np.tile(years, n_copies) - span * year_copies],
+                                      names=df.index.names)
+    synthetic = pd.DataFrame(np.tile(df.to_numpy(dtype=float), (n_copies, 1)), index=index, columns=df.columns)
+    for columns in [X_COLUMNS, Y_COLUMNS]:
+        shares = synthetic[columns].to_numpy(copy=True)
+        shares[copies > 0] += noise * rng.standard_normal((np.count_nonzero(copies > 0), len(columns)))
+        shares = np.clip(shares, 0, None)
+        synthetic[columns] = shares / shares.sum(axis=1, keepdims=True)
+    return synthetic
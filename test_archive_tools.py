@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from archive_tools import archive_day, open_archive, append_snapshot, convert_poll_snapshots, load_date_range, \
+    load_states, archive_polls_data
+from data_tools import get_poll_data, list_poll_snapshots
+from script import X_COLUMNS
+
+
+def _polls(states, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.dirichlet(np.ones(3), size=len(states)), columns=X_COLUMNS,
+                        index=pd.Index(states, name="State Alpha"))
+
+
+def test_date_ranges_and_states_select_the_appended_rows(tmp_path):
+    snapshots = {"01-Mar-24": _polls(["PA", "GA", "AZ"], 0), "01-Apr-24": _polls(["GA", "MI"], 1),
+                 "01-May-24": _polls(["PA", "MI", "WI", "AZ"], 2)}
+    for date, polls_data in snapshots.items():
+        append_snapshot(tmp_path, date, polls_data)
+    archive = open_archive(tmp_path)
+    assert len(archive["shares"]) == 9 and isinstance(archive["shares"], np.memmap)
+    np.testing.assert_array_equal(archive["snapshot_dates"], [archive_day(date) for date in snapshots])
+    everything = archive_polls_data(archive, load_date_range(archive))
+    np.testing.assert_array_equal(everything[X_COLUMNS].to_numpy(),
+                                  np.concatenate([polls_data.to_numpy() for polls_data in snapshots.values()]))
+    assert list(everything.index) == ["PA", "GA", "AZ", "GA", "MI", "PA", "MI", "WI", "AZ"]
+    # The range is inclusive of both ends and is a view of the memory map
+    selection = load_date_range(archive, "2024-04-01", "01-May-24")
+    assert isinstance(selection["shares"], np.memmap) and len(selection["shares"]) == 6
+    assert len(load_date_range(archive, "2024-03-02", "2024-03-31")["shares"]) == 0
+    polls_data = archive_polls_data(archive, load_states(archive, ["MI", "AZ"], start="2024-03-15"))
+    assert list(polls_data.index) == ["MI", "MI", "AZ"]
+    np.testing.assert_array_equal(polls_data.loc["AZ", X_COLUMNS].to_numpy(), snapshots["01-May-24"].loc["AZ"])
+    assert list(polls_data["Snapshot date"]) == [pd.Timestamp("2024-04-01")] + [pd.Timestamp("2024-05-01")] * 2
+
+
+def test_snapshots_must_be_appended_in_order(tmp_path):
+    append_snapshot(tmp_path, "01-Apr-24", _polls(["PA"], 0))
+    for date in ["01-Apr-24", "01-Mar-24"]:
+        with pytest.raises(ValueError):
+            append_snapshot(tmp_path, date, _polls(["PA"], 1))
+    assert len(open_archive(tmp_path)["shares"]) == 1
+
+
+def test_an_interrupted_append_is_overwritten(tmp_path):
+    append_snapshot(tmp_path, "01-Mar-24", _polls(["PA", "GA"], 0))
+    # Column bytes written without the index being replaced are not part of the archive
+    with open(tmp_path / "shares.bin", 'ab') as column_file:
+        column_file.write(b"\x00" * 20)
+    assert len(open_archive(tmp_path)["shares"]) == 2
+    append_snapshot(tmp_path, "01-Apr-24", _polls(["MI"], 1))
+    archive = open_archive(tmp_path)
+    assert (tmp_path / "shares.bin").stat().st_size == 3 * len(X_COLUMNS) * 8
+    np.testing.assert_array_equal(archive["shares"][2], _polls(["MI"], 1).to_numpy()[0])
+
+
+def test_converted_snapshots_match_the_poll_files(tmp_path):
+    dates = list_poll_snapshots()[:2]
+    assert convert_poll_snapshots(tmp_path, dates[::-1]) == dates
+    assert convert_poll_snapshots(tmp_path, dates) == []
+    archive = open_archive(tmp_path)
+    for date in dates:
+        polls_data = archive_polls_data(archive, load_date_range(archive, date, date))
+        expected = get_poll_data(date)
+        assert list(polls_data.index) == list(expected.index)
+        np.testing.assert_array_equal(polls_data[X_COLUMNS].to_numpy(), expected[X_COLUMNS].to_numpy())
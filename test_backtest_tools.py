@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import backtest_tools
+from backtest_tools import clear_backtest_cache, walk_forward_backtest, backtest_scenarios, score_cycle
+from data_tools import list_poll_snapshots, load_data
+from math_tools import normalise_predictions
+from model_tools import polynomial_features
+from script import X_COLUMNS, Y_COLUMNS, load_or_train_model
+from synthetic_tools import synthetic_data
+
+TRAINING_OPTIONS = {"orders": [0, 1, 2], "n_folds": 5, "seeds": [0]}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_backtest_cache()
+    yield
+    clear_backtest_cache()
+
+
+def test_each_cycle_is_trained_on_the_cycles_before_it(tmp_path):
+    df = load_data()
+    backtest = walk_forward_backtest(df, replay=False, registry_directory=tmp_path, **TRAINING_OPTIONS)
+    years = df.index.get_level_values("Year")
+    assert list(backtest["cycles"].index) == [2020]
+    assert backtest["cycles"].loc[2020, "training rows"] == np.count_nonzero(years < 2020)
+    model = load_or_train_model(df[years < 2020], verbose=False, registry_directory=tmp_path, random_state=20,
+                                **TRAINING_OPTIONS)
+    np.testing.assert_array_equal(backtest["models"][2020]["coefficients"], model["coefficients"])
+    X, Y = df.loc[years == 2020, X_COLUMNS].to_numpy(), df.loc[years == 2020, Y_COLUMNS].to_numpy()
+    predictions = normalise_predictions(polynomial_features(X, model["order"]) @ model["coefficients"])
+    np.testing.assert_allclose(backtest["predictions"][["pred-D", "pred-R", "pred-Other"]].to_numpy(), predictions)
+    scores = score_cycle(predictions, Y, model["error_margin"])
+    assert np.isclose(backtest["cycles"].loc[2020, "performance"], scores["performance"])
+    assert backtest["cycles"].loc[2020, "call accuracy"] == backtest["predictions"]["Correct call"].mean()
+
+
+def test_cached_cycles_are_not_trained_again(tmp_path, monkeypatch):
+    first = walk_forward_backtest(replay=False, registry_directory=tmp_path, **TRAINING_OPTIONS)
+
+    def fail(arguments):
+        raise AssertionError("The cycle was trained again")
+    monkeypatch.setattr(backtest_tools, "_cycle_job", fail)
+    second = walk_forward_backtest(replay=False, registry_directory=tmp_path, **TRAINING_OPTIONS)
+    assert first["cycles"].equals(second["cycles"])
+    monkeypatch.undo()
+    clear_backtest_cache()
+    threaded = walk_forward_backtest(replay=False, executor="thread", n_workers=2, registry_directory=tmp_path,
+                                     **TRAINING_OPTIONS)
+    assert first["cycles"].equals(threaded["cycles"])
+
+
+def test_snapshots_are_replayed_and_scored_where_results_are_known(tmp_path):
+    # The 2020 results are relabelled as 2024, so that the 2024 poll snapshots have results to be scored against
+    df = load_data().rename(index={2020: 2024}, level="Year")
+    dates = list_poll_snapshots()[:2]
+    backtest = walk_forward_backtest(df, snapshot_dates=dates, registry_directory=tmp_path, **TRAINING_OPTIONS)
+    replay, replay_scores = backtest["replay"], backtest["replay_scores"]
+    assert replay["Snapshot date"].nunique() == 2 and set(replay["Year"]) == {2024}
+    assert list(replay_scores["Snapshot date"]) == sorted(replay["Snapshot date"].unique())
+    known = replay["Result win"].notna()
+    assert known.any()
+    for date, scores in replay_scores.set_index("Snapshot date").iterrows():
+        rows = known & (replay["Snapshot date"] == date)
+        assert scores["states"] == rows.sum()
+        calls = replay.loc[rows, "Party win"] == replay.loc[rows, "Result win"]
+        assert np.isclose(scores["call accuracy"], calls.mean())
+
+
+def test_scenarios_match_backtests_of_the_synthetic_data(tmp_path):
+    df = load_data()
+    scenarios = backtest_scenarios(df, scenario_seeds=[0, 1], scale=2, registry_directory=tmp_path,
+                                   **TRAINING_OPTIONS)
+    assert list(scenarios.index) == [(0, 2020), (1, 2020)]
+    for seed in [0, 1]:
+        backtest = walk_forward_backtest(synthetic_data(df, 2, 0.01, seed), replay=False, registry_directory=tmp_path,
+                                         **TRAINING_OPTIONS)
+        assert np.isclose(scenarios.loc[(seed, 2020), "performance"], backtest["cycles"].loc[2020, "performance"])
+        assert scenarios.loc[(seed, 2020), "rows"] == backtest["cycles"].loc[2020, "rows"] == 2 * 56
@@ -0,0 +1,59 @@
+import numpy as np
+from data_tools import get_poll_data, load_data
+from ensemble_tools import fit_bootstrap_ensemble, predict_ensemble, ensemble_forecast, fit_data_ensemble
+from model_tools import polynomial_features, fit_coefficients
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def _data():
+    df = load_data()
+    return df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+
+
+def test_members_are_fits_to_bootstrap_resamples():
+    X, Y = _data()
+    ensemble = fit_bootstrap_ensemble(X, Y, 2, n_members=25, seed=3, batch_size=10)
+    rng = np.random.default_rng(3)
+    counts = np.concatenate([rng.multinomial(len(X), np.full(len(X), 1 / len(X)), size=size) for size in [10, 10, 5]])
+    for member in range(25):
+        rows = np.repeat(np.arange(len(X)), counts[member])
+        np.testing.assert_allclose(ensemble["coefficients"][member],
+                                   fit_coefficients(polynomial_features(X[rows], 2), Y[rows]), atol=1e-8)
+    np.testing.assert_allclose(fit_bootstrap_ensemble(X, Y, 2, n_members=25, seed=3, batch_size=25)["coefficients"],
+                               ensemble["coefficients"], atol=1e-12)
+
+
+def test_predictive_intervals_and_win_probabilities():
+    X, Y = _data()
+    ensemble = fit_bootstrap_ensemble(X, Y, 1, n_members=100, seed=3)
+    predictions = predict_ensemble(ensemble, X[:30], level=0.8, seed=4)
+    assert np.all(predictions["lower"] <= predictions["mean"]) and np.all(predictions["mean"] <= predictions["upper"])
+    assert np.all(predictions["margin_lower"] <= predictions["margin_upper"])
+    np.testing.assert_allclose(predictions["margin_mean"], predictions["mean"][:, 1] - predictions["mean"][:, 0])
+    np.testing.assert_allclose(predictions["win_probabilities"].sum(axis=1), 1)
+    # Most of the training results fall within their 80% intervals
+    covered = (predictions["lower"] <= Y[:30]) & (Y[:30] <= predictions["upper"])
+    assert covered[:, :2].mean() > 0.6
+    repeated = predict_ensemble(ensemble, X[:30], level=0.8, seed=4)
+    np.testing.assert_array_equal(repeated["lower"], predictions["lower"])
+
+
+def test_rows_unlike_the_training_data_are_out_of_distribution():
+    X, Y = _data()
+    ensemble = fit_bootstrap_ensemble(X, Y, 2, n_members=20, seed=3)
+    training = predict_ensemble(ensemble, X, seed=4)
+    assert not training["out_of_distribution"].any()
+    np.testing.assert_allclose(training["leverage"].max(), ensemble["max_leverage"])
+    new_rows = np.array([[0.45, 0.45, 0.1], [1.2, -0.1, -0.1], X[0] + 1e-12])
+    predictions = predict_ensemble(ensemble, new_rows, seed=4)
+    np.testing.assert_array_equal(predictions["out_of_range"], [False, True, False])
+    assert predictions["out_of_distribution"][1] and not predictions["out_of_distribution"][2]
+
+
+def test_ensemble_forecasts_of_the_polls():
+    ensemble = fit_data_ensemble(load_data(), 1, n_members=50, seed=3)
+    polls_data = get_poll_data("20-Jul-24")
+    forecasts = ensemble_forecast(ensemble, polls_data, seed=4)
+    assert forecasts.index.equals(polls_data.index)
+    assert np.all(forecasts["pred-D lower"] <= forecasts["pred-D upper"])
+    np.testing.assert_allclose(forecasts[["P(win-D)", "P(win-R)", "P(win-O)"]].sum(axis=1), 1)
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+from data_tools import get_poll_data, load_data
+from forecast_tools import forecast_polls
+from ingest_tools import new_ingestion_state, changed_states, ingest_polls, watch_polls
+from model_tools import fit_coefficients, polynomial_features
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def _model():
+    df = load_data()
+    coefficients = fit_coefficients(polynomial_features(df[X_COLUMNS].to_numpy(), 1), df[Y_COLUMNS].to_numpy())
+    return {"order": 1, "coefficients": coefficients, "error_margin": 0.01}
+
+
+def _changed_polls():
+    polls_data = get_poll_data("20-Jul-24")
+    polls_data.loc["PA", X_COLUMNS] = [0.55, 0.4, 0.05]
+    return polls_data.drop(index="GA")
+
+
+def test_changed_states_compares_by_state():
+    previous = get_poll_data("20-Jul-24")
+    updated, removed = changed_states(None, previous)
+    assert updated.equals(previous.index) and len(removed) == 0
+    updated, removed = changed_states(previous, _changed_polls())
+    assert list(updated) == ["PA"] and list(removed) == ["GA"]
+
+
+def test_only_changed_forecasts_are_reported():
+    model = _model()
+    state = new_ingestion_state(model)
+    polls_data = get_poll_data("20-Jul-24")
+    deltas = ingest_polls(state, polls_data)
+    assert len(deltas) == len(polls_data) and set(deltas["Change"]) == {"added"}
+    assert ingest_polls(state, polls_data.copy()).empty
+    deltas = ingest_polls(state, _changed_polls())
+    assert dict(deltas["Change"]) == {"PA": "changed", "GA": "removed"}
+    # The model was given, so it was not retrained, and the kept forecasts match forecasting every row again
+    assert state["model"] is model
+    expected = forecast_polls(model["order"], model["coefficients"], model["error_margin"], _changed_polls())
+    assert state["forecasts"].equals(expected)
+
+
+def test_watched_files_are_ingested_in_order_and_bad_files_skipped(tmp_path):
+    paths = [tmp_path / "first.csv", tmp_path / "bad.csv", tmp_path / "second.csv"]
+    get_poll_data("20-Jul-24").to_csv(paths[0])
+    paths[1].write_text("not,a\npoll,file\n")
+    _changed_polls().to_csv(paths[2])
+    for i, path in enumerate(paths):
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+    ingested = []
+    state = watch_polls(tmp_path, interval=0.01, on_deltas=lambda path, deltas: ingested.append((path, deltas)),
+                        max_updates=2, state=new_ingestion_state(_model()))
+    assert [path for path, deltas in ingested] == [paths[0], paths[2]]
+    assert dict(ingested[1][1]["Change"]) == {"PA": "changed", "GA": "removed"}
+    assert list(state["failed_stamps"]) == [paths[1]] and set(state["file_stamps"]) == {paths[0], paths[2]}
+    # Only the file that was rewritten is ingested again, and the bad file is not retried until it changes
+    get_poll_data("20-Jul-24").to_csv(paths[2])
+    ingested.clear()
+    watch_polls(tmp_path, interval=0.01, on_deltas=lambda path, deltas: ingested.append((path, deltas)),
+                max_updates=1, state=state)
+    assert [path for path, deltas in ingested] == [paths[2]]
+    assert dict(ingested[0][1]["Change"]) == {"PA": "changed", "GA": "added"}
@@ -0,0 +1,20 @@
+import numpy as np
+from math_tools import as_prediction_matrix, margin_errors, performance_metric, rmse
+
+
+def test_matrices_are_rows_by_columns_for_any_shape():
+    # Three rows of four output variables, which must not be mistaken for three stacked columns
+    predictions = np.array([[0.40, 0.50, 0.10, 0.0], [0.30, 0.60, 0.10, 0.0], [0.50, 0.45, 0.05, 0.0]])
+    actual_y = predictions + np.array([0.01, 0.0, -0.01, 0.0])
+    assert as_prediction_matrix(predictions) is predictions
+    np.testing.assert_allclose(margin_errors(predictions, actual_y), [0.01, 0.01, 0.01])
+    assert np.isclose(performance_metric(predictions, actual_y), 0.01)
+
+
+def test_lists_of_columns_match_matrices():
+    rng = np.random.default_rng(0)
+    predictions, actual_y = rng.random((10, 3)), rng.random((10, 3))
+    assert np.isclose(performance_metric(list(predictions.T), list(actual_y.T)),
+                      performance_metric(predictions, actual_y))
+    np.testing.assert_allclose(rmse(list(predictions.T), list(actual_y.T)), rmse(predictions, actual_y))
+    np.testing.assert_allclose(rmse(predictions, actual_y), np.sqrt(np.mean((predictions - actual_y) ** 2, axis=0)))
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from data_tools import load_data, fold_assignments, k_folds
+from math_tools import performance_metric
+from model_tools import fit_model, polynomial_features, fit_coefficients, compress_folds, solve_held_out_coefficients, \
+    cross_validation_engine, normalise_in_place, cross_validation, bespoke_cross_validation
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def test_fit_coefficients_matches_fit_model():
+    df = load_data()
+    X, Y = df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+    for order in range(5):
+        coefficients = fit_coefficients(polynomial_features(X, order), Y)
+        for i in range(len(Y_COLUMNS)):
+            model = fit_model(X, Y[:, i], order)
+            np.testing.assert_allclose(coefficients[:, i], model.named_steps["linear"].coef_, atol=1e-6)
+            np.testing.assert_allclose(polynomial_features(X, order) @ coefficients[:, i], model.predict(X), atol=1e-8)
+
+
+def test_held_out_coefficients_match_fit_model():
+    df = load_data()
+    X, Y = df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+    fold_ids = fold_assignments(len(X), 5, 20)
+    for order in range(5):
+        features = polynomial_features(X, order)
+        coefficients = solve_held_out_coefficients(*compress_folds(features, Y, fold_ids, 5))
+        for fold in range(5):
+            held_out = fold_ids == fold
+            for i in range(len(Y_COLUMNS)):
+                model = fit_model(X[~held_out], Y[~held_out, i], order)
+                np.testing.assert_allclose(features[held_out] @ coefficients[fold, :, i], model.predict(X[held_out]),
+                                           atol=1e-8)
+
+
+def test_compressing_rows_sorted_by_fold_matches_unsorted():
+    df = load_data()
+    X, Y = df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+    fold_ids = fold_assignments(len(X), 5, 20)
+    row_order = np.argsort(fold_ids, kind="stable")
+    features = polynomial_features(X, 3)
+    np.testing.assert_allclose(solve_held_out_coefficients(*compress_folds(features, Y, fold_ids, 5)),
+                               solve_held_out_coefficients(*compress_folds(features[row_order], Y[row_order],
+                                                                           fold_ids[row_order], 5)), atol=1e-10)
+
+
+def _baseline_bespoke_cross_validation(folds, X_columns, y_columns, evaluation_columns, orders,
+                                       performance_metric_function):
+    # The original loop over folds, orders and y output variables, with one sklearn pipeline per fit
+    performances = {order: [] for order in orders}
+    input_columns = X_columns + [X_columns[-1]]
+    for i, fold in enumerate(folds):
+        training_set = pd.concat([folds[j] for j in range(len(folds)) if j != i])
+        for order in orders:
+            predictions_list, list_y_validate = [], []
+            for j, y_column in enumerate(y_columns):
+                model = fit_model(training_set[X_columns].to_numpy(), training_set[y_column].to_numpy(), order)
+                predictions_list.append(model.predict(fold[X_columns].to_numpy()) * fold[input_columns[j]].to_numpy())
+                list_y_validate.append(fold[evaluation_columns[j]].to_numpy())
+            sum_predictions = predictions_list[0] + predictions_list[1] + predictions_list[2]
+            for j in range(3):
+                predictions_list[j] = predictions_list[j] / sum_predictions
+            performances[order].append(performance_metric_function(predictions_list, list_y_validate))
+    return {order: np.mean(performance_list, axis=0) for order, performance_list in performances.items()}
+
+
+def test_bespoke_cross_validation_matches_baseline_with_small_folds():
+    df = load_data()
+    # Four multiplier targets (the last also of the Other poll share) and folds of three rows each
+    y_columns = ["Multiplier-D", "Multiplier-R", "Multiplier-Other", "Multiplier-Other-2"]
+    for column, (result, poll) in zip(y_columns, [("Result-D", "Poll-D"), ("Result-R", "Poll-R"),
+                                                  ("Result-Other", "Poll-Other"), ("Result-Other", "Poll-Other")]):
+        df[column] = df[result] / df[poll]
+    df["Multiplier-Other-2"] **= 2
+    evaluation_columns = Y_COLUMNS + ["Result-Other"]
+    folds = k_folds(df, 37)
+    assert {len(fold) for fold in folds} == {3}
+    orders = [0, 1, 2]
+    expected = _baseline_bespoke_cross_validation(folds, X_COLUMNS, y_columns, evaluation_columns, orders,
+                                                  performance_metric)
+    actual = bespoke_cross_validation(folds, X_COLUMNS, y_columns, evaluation_columns, orders, performance_metric)
+    for order in orders:
+        assert np.isclose(actual[order], expected[order], rtol=1e-6)
+
+
+def test_cross_validation_passes_columns_to_the_metric():
+    df = load_data()
+    folds = k_folds(df, 37)
+
+    def first_column_error(predictions_list, list_y_validate):
+        assert len(predictions_list) == len(Y_COLUMNS) and len(predictions_list[0]) == 3
+        return np.mean(np.abs(predictions_list[0] - list_y_validate[0]))
+
+    expected = []
+    for i, fold in enumerate(folds):
+        training_set = pd.concat([folds[j] for j in range(len(folds)) if j != i])
+        model = fit_model(training_set[X_COLUMNS].to_numpy(), training_set[Y_COLUMNS[0]].to_numpy(), 1)
+        expected.append(np.mean(np.abs(model.predict(fold[X_COLUMNS].to_numpy()) - fold[Y_COLUMNS[0]].to_numpy())))
+    scores = cross_validation(folds, X_COLUMNS, Y_COLUMNS, [1], first_column_error)
+    assert np.isclose(scores[1], np.mean(expected))
+
+
+def test_engine_results_do_not_depend_on_the_executor():
+    df = load_data()
+    X, Y = df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+    fold_ids = fold_assignments(len(X), 7, 20)
+    serial = cross_validation_engine(X, Y, fold_ids, [0, 2, 4], performance_metric, target_transform="multipliers",
+                                     post_process=normalise_in_place)
+    for executor in ["thread", "process"]:
+        pooled = cross_validation_engine(X, Y, fold_ids, [0, 2, 4], performance_metric, target_transform="multipliers",
+                                         post_process=normalise_in_place, executor=executor, n_workers=2, chunk_size=3)
+        for i, rows in enumerate(serial["fold_rows"]):
+            np.testing.assert_array_equal(pooled["predictions"][i, :, :len(rows)],
+                                          serial["predictions"][i, :, :len(rows)])
+        assert pooled["scores"] == serial["scores"]
@@ -0,0 +1,47 @@
+import numpy as np
+import registry_tools
+from data_tools import load_data
+from registry_tools import model_fingerprint, model_path, save_model, load_model
+from script import X_COLUMNS, Y_COLUMNS
+
+
+def _model():
+    rng = np.random.default_rng(0)
+    return {"order": 2, "coefficients": rng.random((10, 3)), "error_margin": 0.034, "cv_residuals": rng.random(50),
+            "test_residuals": rng.random(20)}
+
+
+def test_saved_models_load_unchanged(tmp_path):
+    model = _model()
+    fingerprint = model_fingerprint(load_data(), X_COLUMNS, Y_COLUMNS, orders=[0, 1, 2])
+    save_model(model, fingerprint, X_COLUMNS, Y_COLUMNS, tmp_path)
+    loaded = load_model(fingerprint, tmp_path)
+    assert loaded.keys() == model.keys()
+    assert loaded["order"] == 2 and loaded["error_margin"] == 0.034
+    for key in ["coefficients", "cv_residuals", "test_residuals"]:
+        np.testing.assert_array_equal(loaded[key], model[key])
+
+
+def test_fingerprints_change_with_the_data_and_options():
+    df = load_data()
+    fingerprint = model_fingerprint(df, X_COLUMNS, Y_COLUMNS, orders=[0, 1, 2])
+    assert model_fingerprint(df.copy(), X_COLUMNS, Y_COLUMNS, orders=[0, 1, 2]) == fingerprint
+    assert model_fingerprint(df, X_COLUMNS, Y_COLUMNS, orders=[0, 1]) != fingerprint
+    changed = df.copy()
+    changed.iloc[0, 0] += 0.001
+    assert model_fingerprint(changed, X_COLUMNS, Y_COLUMNS, orders=[0, 1, 2]) != fingerprint
+
+
+def test_mismatched_or_missing_models_are_not_loaded(tmp_path, monkeypatch):
+    fingerprint = "a" * 64
+    assert load_model(fingerprint, tmp_path) is None
+    save_model(_model(), fingerprint, X_COLUMNS, Y_COLUMNS, tmp_path)
+    # Fingerprints sharing the prefix of the file name are told apart by the full fingerprint saved in the file
+    other_fingerprint = "a" * 32 + "b" * 32
+    assert model_path(other_fingerprint, tmp_path) == model_path(fingerprint, tmp_path)
+    assert load_model(other_fingerprint, tmp_path) is None
+    monkeypatch.setattr(registry_tools, "MODEL_FORMAT_VERSION", registry_tools.MODEL_FORMAT_VERSION + 1)
+    assert load_model(fingerprint, tmp_path) is None
+    monkeypatch.undo()
+    model_path(fingerprint, tmp_path).write_bytes(b"not a model")
+    assert load_model(fingerprint, tmp_path) is None
@@ -0,0 +1,77 @@
+import numpy as np
+from data_tools import fold_assignments, load_data
+from math_tools import normalise_predictions, performance_metric
+from model_tools import polynomial_features, fit_coefficients, cross_validation_engine, normalise_in_place
+from script import X_COLUMNS, Y_COLUMNS
+from search_tools import search_space, fit_penalty_path, successive_halving_search, fit_search_configuration, \
+    predict_search_configuration
+
+
+def _data():
+    df = load_data()
+    return df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+
+
+def test_unpenalised_scores_match_the_engine():
+    X, Y = _data()
+    search = successive_halving_search(X, Y, k=5, min_folds=5, orders=[1, 2], max_interactions=[3],
+                                       targets=["shares", "multipliers"], penalties=["none"])
+    results = search["results"].set_index(["order", "target"])
+    for target in ["shares", "multipliers"]:
+        engine = cross_validation_engine(X, Y, fold_assignments(len(X), 5, 20), [1, 2], performance_metric,
+                                         target_transform=target, post_process=normalise_in_place)
+        for order in [1, 2]:
+            assert results.loc[(order, target), "n_folds"] == 5
+            assert np.isclose(results.loc[(order, target), "score"], engine["mean"][order])
+
+
+def test_only_the_best_configurations_are_scored_on_every_fold():
+    X, Y = _data()
+    search = successive_halving_search(X, Y, k=9, eta=3, min_folds=1, orders=[0, 1, 2], penalties=["none", "ridge"],
+                                       ridge_alphas=[1e-4, 1e-2, 1])
+    results = search["results"]
+    groups = search_space(3, [0, 1, 2], penalties=["none", "ridge"], ridge_alphas=[1e-4, 1e-2, 1])
+    assert search["n_configurations"] == len(results) == sum(len(group["alphas"]) for group in groups)
+    assert sorted(set(results["n_folds"])) == [1, 3, 9]
+    # The penalty strengths of a group are scored together, so a group with a survivor is scored on as many folds
+    survivors = int(np.ceil(np.ceil(len(results) / 3) / 3))
+    assert survivors <= (results["n_folds"] == 9).sum() < (results["n_folds"] >= 3).sum() < len(results)
+    assert results.iloc[0]["n_folds"] == 9
+    assert results.iloc[0]["score"] == results[results["n_folds"] == 9]["score"].min()
+
+
+def test_searches_resume_from_their_log(tmp_path):
+    X, Y = _data()
+    log_path = tmp_path / "search.jsonl"
+    options = {"k": 6, "min_folds": 2, "orders": [1, 2], "penalties": ["none", "ridge"], "ridge_alphas": [1e-3, 1]}
+    first = successive_halving_search(X, Y, log_path=log_path, **options)
+    lines = log_path.read_text().splitlines()
+    # A line cut short by an interrupted search is skipped
+    with open(log_path, "a") as log_file:
+        log_file.write(lines[0][:20])
+    second = successive_halving_search(X, Y, log_path=log_path, **options)
+    assert log_path.read_text().splitlines()[:len(lines)] == lines
+    assert len(log_path.read_text().splitlines()) == len(lines) + 1
+    assert first["results"].equals(second["results"])
+    # A log for other data is not reused
+    third = successive_halving_search(X, Y + 0.001, log_path=log_path, **options)
+    assert not first["results"]["score"].equals(third["results"]["score"])
+
+
+def test_strong_lasso_penalties_leave_only_the_intercepts():
+    X, Y = _data()
+    features = polynomial_features(X, 2)
+    weights = np.ones((1, len(X)))
+    coefficients, intercepts = fit_penalty_path(features, Y, weights, "lasso", [1e-6, 10.0])
+    np.testing.assert_array_equal(coefficients[0, 1], 0)
+    np.testing.assert_allclose(intercepts[0, 1], Y.mean(axis=0))
+    assert np.any(coefficients[0, 0] != 0)
+
+
+def test_fitted_configurations_match_fit_coefficients():
+    X, Y = _data()
+    configuration = {"order": 2, "max_interaction": 3, "target": "shares", "penalty": "none", "alpha": 0.0}
+    model = fit_search_configuration(X, Y, configuration)
+    np.testing.assert_allclose(predict_search_configuration(model, X[:20]),
+                               normalise_predictions(polynomial_features(X[:20], 2) @
+                                                     fit_coefficients(polynomial_features(X, 2), Y)), atol=1e-8)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+from data_tools import load_data
+from forecast_tools import forecast_arrays
+from model_tools import fit_coefficients, polynomial_features
+from script import X_COLUMNS, Y_COLUMNS
+from service_tools import new_service_state, parse_poll_rows, serve, _route
+
+
+def _model():
+    df = load_data()
+    coefficients = fit_coefficients(polynomial_features(df[X_COLUMNS].to_numpy(), 1), df[Y_COLUMNS].to_numpy())
+    return {"order": 1, "coefficients": coefficients, "error_margin": 0.01}
+
+
+def _post(state, body, content_type="application/json"):
+    return asyncio.run(_route(state, "POST", "/forecast", {"content-type": content_type}, body))
+
+
+def test_csv_rows_without_a_state_are_null():
+    body = b"State Alpha,Poll-D,Poll-R,Poll-Other\nPA,0.47,0.48,0.05\n,0.5,0.4,0.1\n"
+    states, X = parse_poll_rows(body, "text/csv")
+    assert states == ["PA", None]
+    np.testing.assert_allclose(X, [[0.47, 0.48, 0.05], [0.5, 0.4, 0.1]])
+    json.dumps(states, allow_nan=False)
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b'{"rows": []}',
+    b"[1, 2]",
+    b'[{"Poll-D": 0.47, "Poll-R": 0.48}]',
+    b'[{"Poll-D": {"a": 1}, "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"Poll-D": [0.47], "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"Poll-D": "0.47", "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"Poll-D": true, "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"Poll-D": null, "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"Poll-D": NaN, "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b'[{"State Alpha": {"a": 1}, "Poll-D": 0.47, "Poll-R": 0.48, "Poll-Other": 0.05}]',
+    b"\xff\xfe",
+])
+def test_malformed_json_is_a_bad_request(body):
+    status, response = _post(new_service_state(None), body)
+    assert status == 400
+    assert "error" in response
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b"State Alpha,Poll-D,Poll-R\nPA,0.47,0.48\n",
+    b"Poll-D,Poll-R,Poll-Other\n0.47,abc,0.05\n",
+    b'Poll-D,Poll-R,Poll-Other\n0.47,0.48,0.05\n"unclosed\n',
+])
+def test_malformed_csv_is_a_bad_request(body):
+    status, response = _post(new_service_state(None), body, "text/csv")
+    assert status == 400
+    assert "error" in response
+
+
+def test_batched_forecasts_match_forecast_arrays():
+    model = _model()
+    rows = [{"State Alpha": "PA", "Poll-D": 0.47, "Poll-R": 0.48, "Poll-Other": 0.05},
+            {"Poll-D": 0.52, "Poll-R": 0.41, "Poll-Other": 0.07}]
+
+    async def main():
+        state = new_service_state(model)
+        server, worker = await serve(state, port=0)
+        try:
+            return await asyncio.gather(*[_route(state, "POST", "/forecast", {}, json.dumps([row]).encode())
+                                          for row in rows])
+        finally:
+            worker.cancel()
+            server.close()
+    responses = asyncio.run(main())
+    expected = forecast_arrays(1, model["coefficients"], 0.01, np.array([[row[c] for c in X_COLUMNS] for row in rows]))
+    for i, (status, response) in enumerate(responses):
+        assert status == 200
+        forecast, = response["forecasts"]
+        assert forecast["State Alpha"] == rows[i].get("State Alpha")
+        assert forecast["pred-D"] == expected["pred-D"][i]
+        assert forecast["Party win"] == expected["Party win"][i]
+        json.dumps(response, allow_nan=False)
@@ -0,0 +1,63 @@
+import numpy as np
+from simulation_tools import ELECTORAL_VOTES, PARTIES, _simulate_chunk, _state_groups, simulate_electoral_college
+
+STATES = ["PA", "GA", "AZ", "MI", "WI", "NV", "NC", "TX", "CA", "NY", "FL", "OH", "ME-AL", "ME-1", "ME-2", "NE-AL",
+          "NE-1", "NE-2", "NE-3", "UT"]
+SHARES = np.array([[0.47, 0.48, 0.05], [0.46, 0.49, 0.05], [0.45, 0.5, 0.05], [0.48, 0.47, 0.05], [0.48, 0.48, 0.04],
+                   [0.47, 0.47, 0.06], [0.46, 0.5, 0.04], [0.42, 0.54, 0.04], [0.6, 0.36, 0.04], [0.58, 0.38, 0.04],
+                   [0.44, 0.52, 0.04], [0.43, 0.53, 0.04], [0.52, 0.44, 0.04], [0.57, 0.39, 0.04], [0.44, 0.52, 0.04],
+                   [0.4, 0.56, 0.04], [0.41, 0.55, 0.04], [0.49, 0.47, 0.04], [0.3, 0.66, 0.04], [0.3, 0.32, 0.38]])
+
+
+def _baseline_tipping_counts(republican_margin, other_win, votes, party_votes, fixed_votes):
+    # The tipping point of each simulation found one at a time, by walking down the winner's rows from the strongest
+    majority = (votes.sum() + fixed_votes.sum()) // 2 + 1
+    counts = np.zeros(len(votes), dtype=np.int64)
+    for i in range(len(republican_margin)):
+        winner = 1 if party_votes[i, 1] >= majority else 0 if party_votes[i, 0] >= majority else None
+        if winner is None:
+            continue
+        total = fixed_votes[winner]
+        for row in np.argsort(republican_margin[i] * (-1 if winner == 1 else 1), kind="stable"):
+            total += 0 if other_win[i, row] else votes[row]
+            if total >= majority:
+                counts[row] += 1
+                break
+    return counts
+
+
+def test_tipping_points_match_baseline():
+    votes = np.array([ELECTORAL_VOTES[state] for state in STATES])
+    groups, n_groups = _state_groups(STATES)
+    fixed_votes = np.array([200, 150, 0])
+    seed = np.random.SeedSequence(3)
+    party_votes, row_wins, tipping_counts = _simulate_chunk(seed, 2000, SHARES, votes, groups, n_groups, 0.03, 0.03,
+                                                            fixed_votes)
+    # The same errors as the chunk, drawn from the same seed
+    rng = np.random.default_rng(seed)
+    national_errors = 0.03 * rng.standard_normal((2000, 1), dtype=np.float32)
+    state_errors = 0.03 * rng.standard_normal((2000, n_groups), dtype=np.float32)
+    republican_margin = (SHARES[:, 1] - SHARES[:, 0]).astype(np.float32) + national_errors + state_errors[:, groups]
+    other_win = np.abs(republican_margin) < (2 * SHARES[:, 2] - SHARES[:, 0] - SHARES[:, 1]).astype(np.float32)
+    republican_win_rows = (republican_margin >= 0) & ~other_win
+    democrat_win_rows = (republican_margin < 0) & ~other_win
+    np.testing.assert_array_equal(row_wins, [democrat_win_rows.sum(axis=0), republican_win_rows.sum(axis=0),
+                                             other_win.sum(axis=0)])
+    np.testing.assert_array_equal(party_votes, np.column_stack([democrat_win_rows @ votes, republican_win_rows @ votes,
+                                                                other_win @ votes]) + fixed_votes)
+    assert other_win[:, -1].any()
+    np.testing.assert_array_equal(tipping_counts, _baseline_tipping_counts(republican_margin, other_win, votes,
+                                                                           party_votes, fixed_votes))
+
+
+def test_results_do_not_depend_on_the_number_of_processes():
+    options = {"n_simulations": 25000, "chunk_size": 4000, "seed": 7, "fixed_winners": {"DC": "D", "WY": "R"}}
+    serial = simulate_electoral_college(STATES, list(SHARES.T), 0.03, **options)
+    parallel = simulate_electoral_college(STATES, list(SHARES.T), 0.03, n_jobs=2, **options)
+    assert serial["win_probabilities"] == parallel["win_probabilities"]
+    assert serial["tipping_point_probabilities"] == parallel["tipping_point_probabilities"]
+    for party in PARTIES:
+        np.testing.assert_array_equal(serial["electoral_vote_distributions"][party],
+                                      parallel["electoral_vote_distributions"][party])
+        assert serial["state_win_probabilities"][party] == parallel["state_win_probabilities"][party]
+    assert np.isclose(sum(serial["tipping_point_probabilities"].values()) + serial["no_majority_probability"], 1)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from data_tools import load_data
+from math_tools import performance_metric
+from model_tools import polynomial_features, fit_coefficients, cross_validation_engine, normalise_in_place
+from script import X_COLUMNS, Y_COLUMNS
+from stream_tools import read_chunks, stream_fold_ids, streaming_fit, streaming_cross_validation
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / "data.csv"
+    load_data().reset_index().to_csv(path, index=False)
+    return path
+
+
+def test_streaming_cross_validation_matches_in_memory(data_path):
+    df = load_data()
+    X, Y = df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy()
+    orders = [0, 1, 2, 3]
+    streamed = streaming_cross_validation(data_path, X_COLUMNS, Y_COLUMNS, orders, n_folds=7, chunk_size=97)
+    fold_ids = stream_fold_ids(np.arange(len(X)), 7)
+    in_memory = cross_validation_engine(X, Y, fold_ids, orders, performance_metric, post_process=normalise_in_place)
+    np.testing.assert_array_equal(streamed["counts"], np.bincount(fold_ids))
+    for j, order in enumerate(orders):
+        np.testing.assert_allclose(streamed["fold_scores"][order], in_memory["scores"][j], atol=1e-10)
+        assert np.isclose(streamed["mean"][order], in_memory["mean"][order])
+    assert streamed["selected_order"] == min(orders, key=lambda order: in_memory["mean"][order])
+    np.testing.assert_allclose(streamed["coefficients"],
+                               fit_coefficients(polynomial_features(X, streamed["selected_order"]), Y), atol=1e-8)
+
+
+def test_folds_do_not_depend_on_the_chunk_size(data_path):
+    small_chunks = streaming_cross_validation(data_path, X_COLUMNS, Y_COLUMNS, [1, 2], n_folds=5, chunk_size=10)
+    one_chunk = streaming_cross_validation(data_path, X_COLUMNS, Y_COLUMNS, [1, 2], n_folds=5)
+    np.testing.assert_array_equal(small_chunks["counts"], one_chunk["counts"])
+    for order in [1, 2]:
+        np.testing.assert_allclose(small_chunks["fold_scores"][order], one_chunk["fold_scores"][order], atol=1e-10)
+
+
+def test_streaming_fit_matches_fit_coefficients(data_path):
+    df = load_data()
+    for order in range(4):
+        np.testing.assert_allclose(streaming_fit(data_path, X_COLUMNS, Y_COLUMNS, order, chunk_size=50),
+                                   fit_coefficients(polynomial_features(df[X_COLUMNS].to_numpy(), order),
+                                                    df[Y_COLUMNS].to_numpy()), atol=1e-8)
+
+
+def test_fold_column_holds_out_given_folds(tmp_path):
+    df = load_data().reset_index()
+    df["Fold"] = df["Year"].rank(method="dense").astype(int) - 1
+    path = tmp_path / "folds.csv"
+    df.to_csv(path, index=False)
+    n_folds = df["Fold"].max() + 1
+    streamed = streaming_cross_validation(path, X_COLUMNS, Y_COLUMNS, [1], n_folds=n_folds, fold_column="Fold",
+                                          chunk_size=64)
+    in_memory = cross_validation_engine(df[X_COLUMNS].to_numpy(), df[Y_COLUMNS].to_numpy(), df["Fold"].to_numpy(), [1],
+                                        performance_metric, post_process=normalise_in_place)
+    np.testing.assert_allclose(streamed["fold_scores"][1], in_memory["scores"][0], atol=1e-10)
+    df.loc[0, "Fold"] = n_folds
+    df.to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        streaming_cross_validation(path, X_COLUMNS, Y_COLUMNS, [1], n_folds=n_folds, fold_column="Fold")
+
+
+def test_parquet_chunks_match_csv(data_path, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "data.parquet"
+    load_data().reset_index().to_parquet(path)
+    for csv_chunk, parquet_chunk in zip(read_chunks(data_path, X_COLUMNS, 100), read_chunks(path, X_COLUMNS, 100)):
+        np.testing.assert_allclose(csv_chunk.to_numpy(), parquet_chunk.to_numpy())
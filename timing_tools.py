@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+
+
+_stage_hooks = []
+
+
+def add_stage_hook(hook):
+    """
+    This function registers a function to be called with the name and duration of each timed stage of the pipeline.
+    Timing is off (and costs nothing) while no hooks are registered.
+    :param hook: A function taking the name of the stage and its duration in seconds.
+    """
+    _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook):
+    """
+    This function unregisters a function added by add_stage_hook.
+    :param hook: The function to be removed.
+    """
+    _stage_hooks.remove(hook)
+
+
+@contextmanager
+def timed_stage(name):
+    """
+    This function is a context manager that times a stage of the pipeline and passes the duration to each hook.
+    :param name: A string for the name of the stage, e.g. "cross_validation".
+    """
+    if not _stage_hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for hook in list(_stage_hooks):
+            hook(name, elapsed)
+
+
+@contextmanager
+def record_stages():
+    """
+    This function is a context manager that collects the durations of all the timed stages run within it.
+    :return: A dictionary which is filled with the name of each stage and a list of its durations in seconds.
+    """
+    durations = {}
+
+    def hook(name, elapsed):
+        durations.setdefault(name, []).append(elapsed)
+    add_stage_hook(hook)
+    try:
+        yield durations
+    finally:
+        remove_stage_hook(hook)